@@ -1,10 +1,18 @@
 from django.urls import path
-from .api_views import CommandDetailView, ReaderListView, ReaderDetailView, TagEventListView, CommandCreateView
+from .api_views import (
+    CommandDetailView, ReaderListView, ReaderDetailView, TagEventListView, CommandCreateView, CommandFanOutView,
+    CommandBatchCreateView, CommandBatchStatusView, CommandStatusView,
+)
 
 urlpatterns = [
     path('readers/', ReaderListView.as_view(), name='api-reader-list'),
     path('readers/<str:serial_number>/', ReaderDetailView.as_view(), name='api-reader-detail'),
     path('tag-events/', TagEventListView.as_view(), name='api-tag-event-list'),
     path('commands/', CommandCreateView.as_view(), name='api-command-create'),
+    path('commands/batch/', CommandBatchCreateView.as_view(), name='api-command-batch-create'),
+    path('commands/fan-out/', CommandFanOutView.as_view(), name='api-command-fan-out'),
+    path('commands/batches/<str:batch_id>/', CommandBatchStatusView.as_view(), name='api-command-batch-status'),
+    # Before commands/<command_id>/, which would otherwise take 'status' as an id
+    path('commands/status/', CommandStatusView.as_view(), name='api-command-status'),
     path('commands/<str:command_id>/', CommandDetailView.as_view(), name='command-detail'),
 ]
\ No newline at end of file
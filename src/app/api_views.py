@@ -1,14 +1,33 @@
+import json
+import math
+from django.conf import settings
 from rest_framework import generics, status
+from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from django.core.paginator import InvalidPage
+from django.db.models import Count, Max, Q
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse
+from django.views.decorators.http import condition
 from django.utils.translation import gettext as _
 from .authentication import APIKeyAuthentication
 from rest_framework.permissions import IsAuthenticated
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from .models import Reader, TagEvent, Command
-from .serializers import ReaderSerializer, TagEventSerializer, CommandSerializer
-from .services import send_command_service, store_command
+from .serializers import (
+    ReaderSerializer, TagEventSerializer, CommandSerializer, CommandFanOutSerializer, CommandBatchItemSerializer,
+    TAG_EVENT_API_COLUMNS,
+    render_tag_event_rows,
+)
+from .services import (
+    send_command_service, store_command, fan_out_command, submit_command_batch, get_command_batch_status,
+    wait_for_commands, ACTIVE_COMMAND_STATUSES,
+)
+from .db_routers import read_from_replica
+from .caching import get_list_version, get_reader_serials, make_etag
 
 import logging
 
@@ -19,6 +38,76 @@ class StandardResultsSetPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 1000
 
+TAG_EVENT_CHUNK_SIZE = 500
+
+class TagEventPagination(StandardResultsSetPagination):
+    """
+    Returns the page as an unevaluated queryset slice so it can be iterated
+    in chunks, and wraps pre-rendered result bytes in the usual envelope.
+    """
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.request = request
+        return self.page.object_list
+
+    def render_paginated_response(self, results):
+        envelope = json.dumps({
+            'count': self.page.paginator.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+        }, ensure_ascii=False, separators=(',', ':'))
+        yield envelope[:-1].encode('utf-8') + b',"results":'
+        yield from results
+        yield b'}'
+
+# Validators for conditional GET. Polling clients that send back the ETag
+# (or Last-Modified) get a 304 before anything is queried or serialised.
+# Readers have no modification timestamp. Their ETags are built from what
+# the database says (the MQTT service updates readers from another
+# process), plus the reader_list version for edits such as a new location
+# that change none of the aggregated columns.
+def reader_list_etag(request, *args, **kwargs):
+    state = Reader.objects.aggregate(
+        count=Count('id'),
+        last_id=Max('id'),
+        connected=Count('id', filter=Q(is_connected=True)),
+        enabled=Count('id', filter=Q(enabled=True)),
+        last_communication=Max('last_communication'),
+    )
+    return make_etag('readers', sorted(state.items()), get_list_version('reader_list'), sorted(request.GET.lists()))
+
+def reader_detail_etag(request, serial_number, *args, **kwargs):
+    row = Reader.objects.filter(serial_number=serial_number).values_list(
+        'pk', 'ip_address', 'location', 'last_communication', 'enabled', 'is_connected'
+    ).first()
+    return make_etag('reader', serial_number, *row, get_list_version('reader_list')) if row else None
+
+def _get_command_validator(request, command_id):
+    # condition() asks for the ETag and Last-Modified separately; fetch once
+    if not hasattr(request, '_command_validator'):
+        request._command_validator = Command.objects.filter(command_id=command_id).values_list(
+            'pk', 'status', Coalesce('updated_at', 'date_sent')
+        ).first()
+    return request._command_validator
+
+def command_etag(request, command_id, *args, **kwargs):
+    validator = _get_command_validator(request, command_id)
+    return make_etag('command', *validator) if validator else None
+
+def command_last_modified(request, command_id, *args, **kwargs):
+    validator = _get_command_validator(request, command_id)
+    return validator[2] if validator else None
+
+@method_decorator(read_from_replica, name='dispatch')
+@method_decorator(condition(etag_func=reader_list_etag), name='get')
 class ReaderListView(generics.ListAPIView):
     queryset = Reader.objects.all()
     serializer_class = ReaderSerializer
@@ -31,15 +120,17 @@ class ReaderListView(generics.ListAPIView):
             queryset = queryset.filter(serial_number__icontains=serial_number)
         return queryset
 
+@method_decorator(condition(etag_func=reader_detail_etag), name='get')
 class ReaderDetailView(generics.RetrieveAPIView):
     queryset = Reader.objects.all()
     serializer_class = ReaderSerializer
     lookup_field = 'serial_number'
 
+@method_decorator(read_from_replica, name='dispatch')
 class TagEventListView(generics.ListAPIView):
     queryset = TagEvent.objects.all()
     serializer_class = TagEventSerializer
-    pagination_class = StandardResultsSetPagination
+    pagination_class = TagEventPagination
 
     def get_queryset(self):
         queryset = TagEvent.objects.all()
@@ -50,7 +141,19 @@ class TagEventListView(generics.ListAPIView):
         if reader_serial is not None:
             queryset = queryset.filter(reader__serial_number=reader_serial)
         return queryset
-    
+
+    def list(self, request, *args, **kwargs):
+        # Rows are streamed from a values_list() cursor straight into the JSON
+        # body; TagEventSerializer produces the same output but instantiates a
+        # model, a reader and a dict per row.
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*TAG_EVENT_API_COLUMNS)
+        page = self.paginate_queryset(queryset)
+        rows = (page if page is not None else queryset).iterator(chunk_size=TAG_EVENT_CHUNK_SIZE)
+        body = render_tag_event_rows(rows, get_reader_serials())
+        if page is not None:
+            body = self.paginator.render_paginated_response(body)
+        return HttpResponse(body, content_type='application/json')
+
 @method_decorator(csrf_exempt, name='dispatch')
 class CommandCreateView(generics.CreateAPIView):
     authentication_classes = [APIKeyAuthentication]
@@ -81,7 +184,7 @@ class CommandCreateView(generics.CreateAPIView):
             except Reader.DoesNotExist:
                 return Response({'error': _('Reader not found')}, status=status.HTTP_404_NOT_FOUND)
             
-            command = store_command(reader, command_type, details)
+            command = store_command(reader, command_type, details, serializer.validated_data.get('priority'))
             success = True
             logger.info(f"Command stored: type={command_type}, reader={reader_serial_number}, details={details}")
             # command = self.perform_create(serializer)
@@ -107,6 +210,7 @@ class CommandCreateView(generics.CreateAPIView):
     def perform_create(self, serializer):
         return serializer.save()
     
+@method_decorator(condition(etag_func=command_etag, last_modified_func=command_last_modified), name='get')
 class CommandDetailView(generics.RetrieveAPIView):
     authentication_classes = [APIKeyAuthentication]
     permission_classes = [IsAuthenticated]
@@ -134,4 +238,142 @@ class CommandDetailView(generics.RetrieveAPIView):
             return Response({'error': _('Command not found')}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             logger.error(f"CommandDetailView - Error retrieving command: {str(e)}")
-            return Response({'error': _('Failed to retrieve command')}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return Response({'error': _('Failed to retrieve command')}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CommandFanOutView(APIView):
+    """Send one command to every reader matching the selection, as a pollable batch"""
+    authentication_classes = [APIKeyAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = CommandFanOutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        details = data.get('details')
+        try:
+            batch_id, count, skipped = fan_out_command(
+                data['command_type'],
+                json.dumps(details) if details is not None else None,
+                reader_ids=data.get('reader_ids'),
+                serial_pattern=data.get('serial_pattern'),
+                location=data.get('location'),
+                priority=data.get('priority'),
+            )
+        except Exception as e:
+            logger.error(f"CommandFanOutView - Error storing commands: {str(e)}")
+            return Response({'error': _('Failed to send command')}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not count and not skipped:
+            return Response({'error': _('No readers match the selection')}, status=status.HTTP_404_NOT_FOUND)
+        # skipped: readers already running the requested mode configuration
+        return Response({'batch_id': batch_id, 'total': count, 'skipped': skipped}, status=status.HTTP_202_ACCEPTED)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CommandBatchCreateView(APIView):
+    """
+    Accepts a list of {reader_serial_number, command_type, details} and
+    answers with one result per item, in request order. Valid items are
+    stored even when others are rejected.
+    """
+    authentication_classes = [APIKeyAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({'error': _('Expected a non-empty list of commands')}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.COMMAND_BATCH_MAX_SIZE:
+            return Response(
+                {'error': _('At most %(max)d commands per batch') % {'max': settings.COMMAND_BATCH_MAX_SIZE}},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = [None] * len(items)
+        valid_items = []
+        valid_indexes = []
+        for index, item in enumerate(items):
+            serializer = CommandBatchItemSerializer(data=item)
+            if serializer.is_valid():
+                data = dict(serializer.validated_data)
+                if data.get('details') is not None:
+                    data['details'] = json.dumps(data['details'])
+                valid_items.append(data)
+                valid_indexes.append(index)
+            else:
+                results[index] = {'error': serializer.errors}
+
+        batch_id = None
+        if valid_items:
+            try:
+                batch_id, stored = submit_command_batch(valid_items)
+            except Exception as e:
+                logger.error(f"CommandBatchCreateView - Error storing commands: {str(e)}")
+                return Response({'error': _('Failed to send command')}, status=status.HTTP_400_BAD_REQUEST)
+            for index, result in zip(valid_indexes, stored):
+                results[index] = result
+
+        for index, result in enumerate(results):
+            result['index'] = index
+            result['status'] = 'PENDING' if 'command_id' in result else 'REJECTED'
+        accepted = sum(1 for result in results if result['status'] == 'PENDING')
+        return Response(
+            {'batch_id': batch_id if accepted else None, 'accepted': accepted, 'results': results},
+            status=status.HTTP_202_ACCEPTED if accepted else status.HTTP_400_BAD_REQUEST
+        )
+
+class CommandStatusView(APIView):
+    """
+    Statuses of many commands in one query:
+    GET /api/commands/status/?ids=<command_id>,<command_id>[&wait=<seconds>]
+
+    With `wait`, the request is held until none of the commands is active
+    (pending, processing or deferred) or the wait, capped at
+    COMMAND_STATUS_MAX_WAIT, has passed; `done` tells which happened.
+    """
+    authentication_classes = [APIKeyAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        command_ids = list(dict.fromkeys(filter(None, request.query_params.get('ids', '').split(','))))
+        if not command_ids:
+            return Response({'error': _('No command ids given')}, status=status.HTTP_400_BAD_REQUEST)
+        if len(command_ids) > settings.COMMAND_STATUS_MAX_IDS:
+            return Response(
+                {'error': _('At most %(max)d command ids per request') % {'max': settings.COMMAND_STATUS_MAX_IDS}},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            wait = float(request.query_params.get('wait', 0))
+        except ValueError:
+            wait = math.nan
+        if not math.isfinite(wait):
+            return Response({'error': _('wait must be a number of seconds')}, status=status.HTTP_400_BAD_REQUEST)
+        wait = min(max(wait, 0), settings.COMMAND_STATUS_MAX_WAIT)
+
+        statuses = wait_for_commands(command_ids, timeout=wait)
+        return Response({
+            'commands': {
+                command_id: {
+                    'command_type': row['command'],
+                    'status': row['status'],
+                    'response': row['response'],
+                    'reader_serial_number': row['reader__serial_number'],
+                    'updated_at': row['updated_at'],
+                }
+                for command_id, row in statuses.items()
+            },
+            'missing': [command_id for command_id in command_ids if command_id not in statuses],
+            'done': not any(row['status'] in ACTIVE_COMMAND_STATUSES for row in statuses.values()),
+        })
+
+class CommandBatchStatusView(APIView):
+    authentication_classes = [APIKeyAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, batch_id):
+        batch_status = get_command_batch_status(batch_id)
+        if batch_status is None:
+            return Response({'error': _('Batch not found')}, status=status.HTTP_404_NOT_FOUND)
+        return Response(batch_status)
@@ -46,6 +46,9 @@ class AppConfig(AppConfig):
 
     def ready(self):
         from celery import current_app
+        # Connects the list cache invalidation signal receivers
+        from app import caching  # noqa: F401
+        from app import scheduler  # noqa: F401
         print(f"Registered Celery tasks: {current_app.tasks.keys()}")
         print(f"Current beat schedule: {current_app.conf.beat_schedule}")
         # post_migrate.connect(create_periodic_tasks, sender=self)
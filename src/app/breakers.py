@@ -0,0 +1,122 @@
+# app/breakers.py
+import logging
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Guards calls to one outbound dependency (the Dapr sidecar, the MQTT
+    broker) so an outage costs callers nothing instead of a timeout each.
+
+    CLOSED: calls go through; `failure_threshold` consecutive failures open
+    the breaker. OPEN: allow() is False and callers fail at once. With a
+    `probe`, a daemon thread calls it every `reset_timeout` seconds and
+    closes the breaker once it returns True; without one, the first call
+    after `reset_timeout` is let through as a trial (HALF_OPEN) and its
+    outcome closes or reopens the breaker.
+    """
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+    HALF_OPEN = 'HALF_OPEN'
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None, probe=None, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold or getattr(settings, 'CIRCUIT_BREAKER_FAILURES', 5)
+        self.reset_timeout = reset_timeout or getattr(settings, 'CIRCUIT_BREAKER_RESET_TIMEOUT', 10.0)
+        self.probe = probe
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.times_opened = 0
+        self._opened_at = None
+        self._prober = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.state == self.OPEN
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN and self.probe is None
+                    and self.clock() - self._opened_at >= self.reset_timeout):
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit '{self.name}' closed, dependency is back")
+                self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._open()
+
+    def trip(self):
+        """Open right away, e.g. when the dependency reported it went away"""
+        with self._lock:
+            self._open()
+
+    def _open(self):
+        self._opened_at = self.clock()
+        if self.state == self.OPEN:
+            return
+        self.state = self.OPEN
+        self.times_opened += 1
+        logger.warning(f"Circuit '{self.name}' opened after {self.failures} failures, failing fast")
+        if self.probe is not None and self._prober is None:
+            self._prober = threading.Thread(target=self._run_probe, name=f'breaker-{self.name}', daemon=True)
+            self._prober.start()
+
+    def _run_probe(self):
+        while True:
+            time.sleep(self.reset_timeout)
+            with self._lock:
+                if self.state != self.OPEN:
+                    self._prober = None
+                    return
+            try:
+                healthy = self.probe()
+            except Exception as e:
+                logger.debug(f"Circuit '{self.name}' probe failed: {e}")
+                healthy = False
+            if healthy:
+                self.record_success()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'times_opened': self.times_opened,
+                'open_for': round(self.clock() - self._opened_at, 1) if self.state != self.CLOSED else None,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name, **kwargs):
+    """Process-wide breaker per dependency; `kwargs` only apply when it is first created"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(name, **kwargs)
+    return breaker
+
+def get_breaker_states():
+    """{name: state snapshot} for diagnostics"""
+    return {name: breaker.snapshot() for name, breaker in list(_breakers.items())}
@@ -0,0 +1,127 @@
+# app/caching.py
+import hashlib
+import logging
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.middleware.csrf import get_token
+from django.utils.translation import get_language
+
+logger = logging.getLogger(__name__)
+
+# Which model changes invalidate which cached list. None means any field;
+# a set limits invalidation to saves touching those fields, so e.g. the
+# last_communication updates done on every MQTT message only expire the
+# reader list and not the scheduled command list.
+LIST_CACHE_DEPENDENCIES = {
+    'reader_list': {'app.Reader': None},
+    'firmware_list': {'app.Firmware': None},
+    'scheduled_command_list': {'app.ScheduledCommand': None, 'app.Reader': {'serial_number'}},
+    'alert_list': {'app.Alert': None},
+    'reader_serials': {'app.Reader': {'serial_number'}},
+}
+
+def get_list_cache_timeout():
+    return getattr(settings, 'LIST_CACHE_TIMEOUT', 300)
+
+def _version_key(list_name):
+    return f'list-cache:version:{list_name}'
+
+def get_list_version(list_name):
+    key = _version_key(list_name)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so a version lost on eviction is never reused
+        version = time.time_ns()
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+def bump_list_version(list_name):
+    try:
+        cache.incr(_version_key(list_name))
+    except ValueError:
+        cache.set(_version_key(list_name), time.time_ns(), None)
+    logger.debug(f"Invalidated cached list {list_name}")
+
+def make_list_cache_key(list_name, *parts):
+    digest = hashlib.md5(
+        ':'.join(str(part) for part in (get_language(),) + parts).encode()
+    ).hexdigest()
+    return f'list-cache:{list_name}:{get_list_version(list_name)}:{digest}'
+
+class CachedPaginator(Paginator):
+    """Paginator whose count comes from the cache instead of a COUNT query."""
+    def __init__(self, object_list, per_page, count):
+        super().__init__(object_list, per_page)
+        self.count = count
+
+def get_cached_page(list_name, queryset, page_number, *key_parts, per_page=10):
+    """
+    Return the requested page of `queryset`, serving the rows and the total
+    count from the cache while the list version is unchanged.
+    """
+    key = make_list_cache_key(list_name, 'rows', per_page, page_number, *key_parts)
+    cached = cache.get(key)
+    if cached is None:
+        page = Paginator(queryset, per_page).get_page(page_number)
+        cached = (page.paginator.count, page.number, list(page.object_list))
+        cache.set(key, cached, get_list_cache_timeout())
+    count, number, rows = cached
+    return Page(rows, number, CachedPaginator(queryset, per_page, count))
+
+def get_cached_rows(list_name, queryset, *key_parts):
+    key = make_list_cache_key(list_name, 'rows', *key_parts)
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(queryset)
+        cache.set(key, rows, get_list_cache_timeout())
+    return rows
+
+def make_etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+def get_reader_serials():
+    """Map of reader id -> serial number, used to label rows fetched with values()."""
+    from .models import Reader
+    key = make_list_cache_key('reader_serials')
+    serials = cache.get(key)
+    if serials is None:
+        serials = dict(Reader.objects.values_list('id', 'serial_number'))
+        cache.set(key, serials, get_list_cache_timeout())
+    return serials
+
+def get_fragment_cache_context(request, list_name, *key_parts):
+    """
+    Context for a {% cache %} block around a list table. Fragments contain
+    {% csrf_token %}, so they are keyed per user and per CSRF secret.
+    """
+    get_token(request)
+    csrf_secret = hashlib.md5(request.META.get('CSRF_COOKIE', '').encode()).hexdigest()
+    return {
+        'list_cache_timeout': get_list_cache_timeout(),
+        'list_cache_key': make_list_cache_key(
+            list_name, 'fragment', request.user.pk, csrf_secret, *key_parts
+        ),
+    }
+
+def _invalidate_lists(sender, update_fields=None):
+    label = sender._meta.label
+    for list_name, dependencies in LIST_CACHE_DEPENDENCIES.items():
+        if label not in dependencies:
+            continue
+        fields = dependencies[label]
+        if fields is None or update_fields is None or fields & set(update_fields):
+            bump_list_version(list_name)
+
+@receiver(post_save)
+def invalidate_lists_on_save(sender, update_fields=None, raw=False, **kwargs):
+    if not raw:
+        _invalidate_lists(sender, update_fields)
+
+@receiver(post_delete)
+def invalidate_lists_on_delete(sender, **kwargs):
+    _invalidate_lists(sender)
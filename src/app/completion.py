@@ -0,0 +1,133 @@
+# app/completion.py
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Wakes requests waiting for commands to finish (see wait_for_commands in
+# services) when the response handler or the dispatcher records a final
+# status. Waiters are told which command pks changed and re-read only
+# then, instead of polling the database. With the Redis cache the wake-ups
+# cross processes (MQTT service -> web) over a pub/sub channel; otherwise
+# they only reach waiters in the same process.
+
+CHANNEL = 'command-status'
+
+
+class LocalStatusListener:
+    def __init__(self, notifier):
+        self.notifier = notifier
+        self._changed = set()
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.notifier._add(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.notifier._remove(self)
+
+    def _deliver(self, pks):
+        with self._lock:
+            self._changed.update(pks)
+        self._event.set()
+
+    def wait(self, timeout):
+        """Set of command pks finished since the last call; empty if `timeout` passed first"""
+        self._event.wait(timeout)
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            self._event.clear()
+        return changed
+
+
+class LocalStatusNotifier:
+    def __init__(self):
+        self._listeners = set()
+        self._lock = threading.Lock()
+
+    def listen(self):
+        return LocalStatusListener(self)
+
+    def _add(self, listener):
+        with self._lock:
+            self._listeners.add(listener)
+
+    def _remove(self, listener):
+        with self._lock:
+            self._listeners.discard(listener)
+
+    def notify(self, pks):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener._deliver(pks)
+
+
+class RedisStatusListener:
+    def __init__(self, connection):
+        self.pubsub = connection.pubsub(ignore_subscribe_messages=True)
+
+    def __enter__(self):
+        self.pubsub.subscribe(CHANNEL)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.pubsub.close()
+
+    def wait(self, timeout):
+        changed = set()
+        deadline = time.monotonic() + timeout
+        while not changed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            message = self.pubsub.get_message(timeout=remaining)
+            if message is not None:
+                changed.update(int(pk) for pk in message['data'].split(b','))
+        return changed
+
+
+class RedisStatusNotifier:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def listen(self):
+        return RedisStatusListener(self.connection)
+
+    def notify(self, pks):
+        self.connection.publish(CHANNEL, ','.join(str(pk) for pk in pks))
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+def get_status_notifier():
+    global _notifier
+    if _notifier is None:
+        with _notifier_lock:
+            if _notifier is None:
+                if settings.CACHES['default']['BACKEND'].startswith('django_redis'):
+                    from django_redis import get_redis_connection
+                    _notifier = RedisStatusNotifier(get_redis_connection('default'))
+                else:
+                    _notifier = LocalStatusNotifier()
+    return _notifier
+
+def notify_commands_finished(pks):
+    """Wake waiters for these command pks once the surrounding transaction commits"""
+    pks = list(pks)
+    if not pks:
+        return
+
+    def notify():
+        try:
+            get_status_notifier().notify(pks)
+        except Exception as e:
+            logger.warning(f"Could not notify command status waiters: {e}")
+
+    transaction.on_commit(notify)
@@ -0,0 +1,49 @@
+# app/correlation.py
+import logging
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Outstanding command_id -> (pk, reader serial, command) recorded when a
+# command is dispatched, so its controlResult/manageResult can be applied
+# with a primary key UPDATE instead of a joined lookup by command_id.
+# The shared cache (Redis in production) makes entries written by the
+# dispatching worker visible to the MQTT service that receives the reply.
+
+def _key(command_id):
+    return f'command-correlation:{command_id}'
+
+def get_correlation_timeout():
+    return getattr(settings, 'COMMAND_CORRELATION_TTL', 3600)
+
+def remember_commands(commands):
+    """
+    Args:
+        commands: iterable of (command_id, pk, reader_serial, command)
+    """
+    entries = {
+        _key(command_id): (pk, reader_serial, command)
+        for command_id, pk, reader_serial, command in commands
+        if command_id
+    }
+    if entries:
+        try:
+            cache.set_many(entries, get_correlation_timeout())
+        except Exception as e:
+            # Responses fall back to the database lookup
+            logger.warning(f"Could not record command correlation: {e}")
+
+def lookup_command(command_id):
+    """Return (pk, reader_serial, command) or None"""
+    try:
+        return cache.get(_key(command_id))
+    except Exception as e:
+        logger.warning(f"Could not read command correlation: {e}")
+        return None
+
+def forget_command(command_id):
+    try:
+        cache.delete(_key(command_id))
+    except Exception as e:
+        logger.warning(f"Could not clear command correlation: {e}")
@@ -0,0 +1,61 @@
+# app/db_routers.py
+import random
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from django.conf import settings
+
+_state = threading.local()
+
+def get_replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica_')]
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Route reads issued inside the block to a read replica, if any are configured."""
+    previous = getattr(_state, 'use_replica', False)
+    _state.use_replica = enabled
+    try:
+        yield
+    finally:
+        _state.use_replica = previous
+
+@contextmanager
+def primary_pinned(pinned=True):
+    """Force reads to the primary, e.g. right after the user wrote something."""
+    previous = getattr(_state, 'pinned', False)
+    _state.pinned = pinned
+    try:
+        yield
+    finally:
+        _state.pinned = previous
+
+def read_from_replica(view_func):
+    """Decorator for read-only views and exports."""
+    @wraps(view_func)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view_func(*args, **kwargs)
+    return wrapper
+
+class ReadReplicaRouter:
+    """
+    Sends reads to a replica only when the current request opted in through
+    read_from_replica and the user is not pinned to the primary. Everything
+    else, including all writes and migrations, stays on 'default'.
+    """
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'use_replica', False) and not getattr(_state, 'pinned', False):
+            replicas = get_replica_aliases()
+            if replicas:
+                return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
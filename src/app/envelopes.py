@@ -0,0 +1,45 @@
+# app/envelopes.py
+import ast
+import json
+
+# Commands are rendered once, when they are stored: `details` is kept as
+# canonical JSON text and `envelope` holds the exact message published to
+# the reader, so dispatching a command never parses or re-serialises it.
+
+def normalize_details(details):
+    """
+    Command details as canonical JSON text, or None without details.
+    Accepts a dict/list, JSON text, or the Python dict repr (single quotes)
+    older code stored. Raises ValueError for anything else.
+    """
+    if details is None or details == '':
+        return None
+    if isinstance(details, (dict, list)):
+        return json.dumps(details)
+    if not isinstance(details, str):
+        raise ValueError(f"Unsupported command details: {type(details).__name__}")
+    try:
+        return json.dumps(json.loads(details))
+    except json.JSONDecodeError:
+        pass
+    try:
+        value = ast.literal_eval(details)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise ValueError("Command details are not valid JSON")
+    if not isinstance(value, (dict, list)):
+        raise ValueError("Command details are not valid JSON")
+    return json.dumps(value)
+
+def render_envelope(command_id, command_type, details_json=None):
+    """The message published for a command, from already normalised details"""
+    # The payload is spliced in as text: it was validated by normalize_details
+    return (
+        f'{{"command": {json.dumps(command_type)}, "command_id": {json.dumps(command_id)}, '
+        f'"payload": {details_json or "{}"}}}'
+    )
+
+def prepare_command(command):
+    """Normalise the details of an unsaved Command and render its envelope (for bulk_create)"""
+    command.details = normalize_details(command.details)
+    command.envelope = render_envelope(command.command_id, command.command or command.command_type, command.details)
+    return command
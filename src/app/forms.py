@@ -77,6 +77,11 @@ class ModeForm(forms.Form):
         label=_("Tag Population"),
         widget=forms.NumberInput(attrs={'class': 'form-control'})
     )
+    force = forms.BooleanField(
+        label=_("Send the full configuration, even if the reader already runs it"),
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
 
 class AlertForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,73 @@
+# app/management/commands/benchmark_tag_event_api.py
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from app.models import Reader, TagEvent
+from app.api_views import TAG_EVENT_CHUNK_SIZE
+from app.caching import get_reader_serials
+from app.serializers import TagEventSerializer, TAG_EVENT_API_COLUMNS, render_tag_event_rows
+
+
+class Command(BaseCommand):
+    help = 'Compares TagEventSerializer with the values_list() fast path used by the tag event API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows per page (the API allows up to 1000)')
+        parser.add_argument('--readers', type=int, default=50, help='Distinct readers among the rows')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per path; the best run is reported')
+
+    def handle(self, *args, **options):
+        rows, readers, repeat = options['rows'], options['readers'], options['repeat']
+
+        # Work on throwaway data and roll it back afterwards
+        with transaction.atomic():
+            self._create_data(rows, readers)
+            queryset = TagEvent.objects.order_by('id')[:rows]
+            serializer_time, serializer_peak = self._measure(repeat, lambda: self._serializer_page(queryset))
+            fast_time, fast_peak = self._measure(repeat, lambda: self._fast_page(queryset))
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'{rows} rows, {readers} readers, best of {repeat}')
+        self.stdout.write(f'  serializer: {serializer_time * 1000:8.1f} ms  peak {serializer_peak / 1024:8.1f} KiB')
+        self.stdout.write(f'  fast path : {fast_time * 1000:8.1f} ms  peak {fast_peak / 1024:8.1f} KiB')
+        self.stdout.write(self.style.SUCCESS(
+            f'  speed-up {serializer_time / fast_time:.1f}x, memory {serializer_peak / max(fast_peak, 1):.1f}x'
+        ))
+
+    def _create_data(self, rows, readers):
+        reader_objs = Reader.objects.bulk_create([
+            Reader(serial_number=f'BENCH{index:05d}', ip_address='10.0.0.1') for index in range(readers)
+        ])
+        reader_objs = list(Reader.objects.filter(serial_number__startswith='BENCH'))
+        now = timezone.now()
+        TagEvent.objects.bulk_create([
+            TagEvent(
+                reader=reader_objs[index % len(reader_objs)], reader_name='bench', mac_address='00:00:00:00:00:00',
+                epc=f'E280{index:020d}', first_seen_timestamp=now, antenna_port=1, antenna_zone='Zone1',
+                peak_rssi=-50.0, tx_power=30.0, tag_data_key='', tag_data_key_name='', tag_data_serial=''
+            )
+            for index in range(rows)
+        ], batch_size=500)
+
+    def _measure(self, repeat, func):
+        best_time, best_peak = None, None
+        for _ in range(repeat):
+            tracemalloc.start()
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            _current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+            best_peak = peak if best_peak is None else min(best_peak, peak)
+        return best_time, best_peak
+
+    def _serializer_page(self, queryset):
+        return JSONRenderer().render(TagEventSerializer(queryset.all(), many=True).data)
+
+    def _fast_page(self, queryset):
+        rows = queryset.values_list(*TAG_EVENT_API_COLUMNS).iterator(chunk_size=TAG_EVENT_CHUNK_SIZE)
+        return b''.join(render_tag_event_rows(rows, get_reader_serials()))
@@ -1,8 +1,7 @@
 import logging
-import time
 from django.core.management.base import BaseCommand
 from django.core.wsgi import get_wsgi_application
-from app.tasks import execute_scheduled_commands_task
+from app.scheduler import command_scheduler
 
 logger = logging.getLogger(__name__)
 
@@ -14,11 +13,5 @@ class Command(BaseCommand):
 
         logger.info("Starting scheduled commands service...")
 
-        while True:
-            try:
-                execute_scheduled_commands_task()
-                logger.debug("Executed scheduled commands")
-            except Exception as e:
-                logger.error(f"Error executing scheduled commands: {e}")
-
-            time.sleep(60)  # Run every minute
\ No newline at end of file
+        # Sleeps until the next schedule is due; see app/scheduler.py
+        command_scheduler.run_forever()
@@ -1,5 +1,9 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
 from django.http import JsonResponse
 from django.utils.translation import gettext as _
+from .db_routers import get_replica_aliases, primary_pinned
 from .models import APIKey
 import logging
 
@@ -24,4 +28,44 @@ class APIKeyMiddleware:
                 return JsonResponse({'error': _('Invalid API key')}, status=401)
 
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
+
+class ReplicaPinMiddleware:
+    """
+    Keeps a client's reads on the primary for REPLICA_PIN_SECONDS after any
+    request of theirs that could have written (non-safe HTTP method), so they
+    never read their own writes back from a lagging replica. API clients are
+    pinned by their API key, everyone else by their user; the pin is set
+    after the view ran, so users authenticated by DRF are covered too.
+    """
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @staticmethod
+    def get_pin_key(request):
+        api_key = request.headers.get('X-API-Key')
+        if api_key:
+            return f'replica-pin:key:{hashlib.sha256(api_key.encode()).hexdigest()}'
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'replica-pin:user:{user.pk}'
+        return None
+
+    def __call__(self, request):
+        if not get_replica_aliases():
+            return self.get_response(request)
+
+        pin_key = self.get_pin_key(request)
+        writing = request.method not in self.SAFE_METHODS
+        pinned = writing or (pin_key is not None and cache.get(pin_key) is not None)
+
+        with primary_pinned(pinned):
+            response = self.get_response(request)
+
+        # DRF sets request.user during the view
+        pin_key = self.get_pin_key(request)
+        if writing and pin_key is not None:
+            cache.set(pin_key, True, getattr(settings, 'REPLICA_PIN_SECONDS', 10))
+        return response
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# GIN indexes (jsonb_path_ops) answer the `@>` containment lookups issued by
+# filter_detailed_status_events_by_json. They only exist on Postgres.
+JSON_INDEXES = [
+    ('app_dse_details_gin', 'details'),
+    ('app_dse_non_antenna_details_gin', 'non_antenna_details'),
+]
+
+
+def create_json_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, column in JSON_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON app_detailedstatusevent '
+            f'USING gin ({column} jsonb_path_ops)'
+        )
+
+
+def drop_json_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _column in JSON_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_apikey'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_json_indexes, drop_json_indexes),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.20 on 2026-10-19 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_detailedstatusevent_json_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='command',
+            index=models.Index(fields=['status', 'date_sent'], name='command_status_sent_idx'),
+        ),
+    ]
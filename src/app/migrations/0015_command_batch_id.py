@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-19 15:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_command_status_sent_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='command',
+            name='batch_id',
+            field=models.CharField(blank=True, db_index=True, max_length=50, null=True, verbose_name='Batch ID'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-19 16:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_command_batch_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='command',
+            name='command_id',
+            field=models.CharField(blank=True, db_index=True, default=None, max_length=50, null=True, verbose_name='Command ID'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.20 on 2026-10-19 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_command_id_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='command',
+            index=models.Index(fields=['status', 'updated_at'], name='command_status_updated_idx'),
+        ),
+    ]
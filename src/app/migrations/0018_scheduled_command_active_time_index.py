@@ -0,0 +1,17 @@
+# Generated by Django 3.2.20 on 2026-10-19 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_command_status_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scheduledcommand',
+            index=models.Index(fields=['is_active', 'scheduled_time'], name='scheduled_active_time_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-19 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_scheduled_command_active_time_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='command',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed'), ('SUPERSEDED', 'Superseded')], default='PENDING', max_length=50, verbose_name='Status'),
+        ),
+    ]
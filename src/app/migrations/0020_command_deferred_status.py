@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-19 16:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_command_superseded_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='command',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed'), ('SUPERSEDED', 'Superseded'), ('DEFERRED', 'Deferred')], default='PENDING', max_length=50, verbose_name='Status'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.20 on 2026-10-19 16:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0020_command_deferred_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='command',
+            name='priority',
+            field=models.CharField(choices=[('high', 'High'), ('low', 'Low')], default='high', max_length=10, verbose_name='Priority'),
+        ),
+        migrations.AddIndex(
+            model_name='command',
+            index=models.Index(fields=['status', 'priority', 'date_sent'], name='command_lane_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-19 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0021_command_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='command',
+            name='envelope',
+            field=models.TextField(blank=True, default=None, editable=False, null=True, verbose_name='Envelope'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.20 on 2026-10-19 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0022_command_envelope'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scheduledcommand',
+            index=models.Index(fields=['updated_at'], name='scheduled_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-19 16:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0023_scheduledcommand_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledcommand',
+            name='day_of_month',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True, verbose_name='Day of Month'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-19 16:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0024_scheduledcommand_day_of_month'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='command',
+            name='not_before',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Not Before'),
+        ),
+    ]
@@ -4,6 +4,7 @@ from django.core.validators import FileExtensionValidator
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 import secrets
+from .envelopes import prepare_command
 
 # Create your models here.
 
@@ -30,8 +31,17 @@ class Command(models.Model):
         ('PROCESSING', _('Processing')),
         ('COMPLETED', _('Completed')),
         ('FAILED', _('Failed')),
+        # Skipped: a newer command for the same reader made it redundant
+        ('SUPERSEDED', _('Superseded')),
+        # Parked until the reader reconnects
+        ('DEFERRED', _('Deferred')),
     ]
-    command_id = models.CharField(max_length=50, default=None, blank=True, null=True, verbose_name=_('Command ID'))
+    # Dispatch lanes, see COMMAND_PRIORITIES and COMMAND_PRIORITY_QUEUES in settings
+    PRIORITY_CHOICES = [
+        ('high', _('High')),
+        ('low', _('Low')),
+    ]
+    command_id = models.CharField(max_length=50, default=None, blank=True, null=True, db_index=True, verbose_name=_('Command ID'))
     command_type = models.CharField(max_length=50, choices=COMMAND_TYPES, verbose_name=_('Command Type'))
     reader = models.ForeignKey(Reader, on_delete=models.CASCADE, verbose_name=_('Reader'))
     command = models.CharField(max_length=255, blank=True, null=True, verbose_name=_('Command'))
@@ -40,10 +50,35 @@ class Command(models.Model):
     date_sent = models.DateTimeField(auto_now_add=True, verbose_name=_('Date Sent'))
     updated_at = models.DateTimeField(auto_now=True, blank=True, null=True, verbose_name=_('Updated At'))
     response = models.TextField(default=None, blank=True, null=True, verbose_name=_('Response'))  
+    batch_id = models.CharField(max_length=50, blank=True, null=True, db_index=True, verbose_name=_('Batch ID'))
+    priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='high', verbose_name=_('Priority'))
+    # Pre-rendered message published to the reader, see app/envelopes.py
+    envelope = models.TextField(default=None, blank=True, null=True, editable=False, verbose_name=_('Envelope'))
+    # Set on throttled commands: not claimed again before their tokens are back
+    not_before = models.DateTimeField(null=True, blank=True, editable=False, verbose_name=_('Not Before'))
     
     class Meta:
         verbose_name = _('Command')
         verbose_name_plural = _('Commands')
+        indexes = [
+            # Dispatchers claim the oldest PENDING commands first
+            models.Index(fields=['status', 'date_sent'], name='command_status_sent_idx'),
+            # The stale-command sweep only reads the PROCESSING range
+            models.Index(fields=['status', 'updated_at'], name='command_status_updated_idx'),
+            # Pollers drain each priority lane oldest first
+            models.Index(fields=['status', 'priority', 'date_sent'], name='command_lane_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Only render on insert or when the rendered fields change: a status
+        # update must not re-parse details stored by older code
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding and update_fields is None:
+            prepare_command(self)
+        elif update_fields is not None and {'command_id', 'command', 'command_type', 'details'} & set(update_fields):
+            prepare_command(self)
+            kwargs['update_fields'] = set(update_fields) | {'details', 'envelope'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.reader.serial_number} - {self.command} ({self.status})"
@@ -123,12 +158,20 @@ class ScheduledCommand(models.Model):
     recurrence = models.CharField(max_length=10, choices=RECURRENCE_CHOICES, default='ONCE', verbose_name=_('Recurrence'))
     is_active = models.BooleanField(default=True, verbose_name=_('Is Active'))
     last_run = models.DateTimeField(null=True, blank=True, verbose_name=_('Last Run'))
+    # Intended day of a MONTHLY schedule, taken from scheduled_time on its first run
+    day_of_month = models.PositiveSmallIntegerField(null=True, blank=True, editable=False, verbose_name=_('Day of Month'))
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Created At'))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated At'))
 
     class Meta:
         verbose_name = _('Scheduled Command')
         verbose_name_plural = _('Scheduled Commands')
+        indexes = [
+            # The scheduler loads the next window of active schedules
+            models.Index(fields=['is_active', 'scheduled_time'], name='scheduled_active_time_idx'),
+            # ...and polls for schedules edited by other processes
+            models.Index(fields=['updated_at'], name='scheduled_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.reader.serial_number} - {self.command_type} ({self.get_recurrence_display()})"
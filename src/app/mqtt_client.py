@@ -1,13 +1,13 @@
 # mqtt_client.py
 
-import time
 import os
 import django
 from django.conf import settings
 import paho.mqtt.client as mqtt
 import json
 import logging
-from threading import Lock
+from threading import Lock, Thread
+from .breakers import get_breaker, get_breaker_states
 
 logger = logging.getLogger(__name__)
 
@@ -40,9 +40,16 @@ class MQTTManager:
         self.client = mqtt.Client()
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
+        # The network loop reconnects on its own, backing off between attempts
+        self.client.reconnect_delay_set(min_delay=1, max_delay=max(1, int(getattr(settings, 'MQTT_RECONNECT_DELAY', 5))))
+        self.publish_timeout = float(getattr(settings, 'MQTT_PUBLISH_TIMEOUT', 10.0))
+        self._connect_lock = Lock()
+        self.breaker = get_breaker('mqtt-publisher', probe=self._probe_broker)
         self.connect()
 
     def connect(self):
+        if not self._connect_lock.acquire(blocking=False):
+            return  # another thread is already connecting
         try:
             mqtt_port = int(settings.MQTT_PORT)
             mqtt_broker = settings.MQTT_BROKER
@@ -52,65 +59,78 @@ class MQTTManager:
             self.logger.info(f"Connected to MQTT broker at {mqtt_broker}:{mqtt_port}")
         except Exception as e:
             self.logger.error(f"Failed to connect to MQTT broker: {str(e)}")
+            self.breaker.record_failure()
+        finally:
+            self._connect_lock.release()
+
+    def _reconnect_in_background(self):
+        """Connect off the caller's thread, unless the network loop is already reconnecting"""
+        if self.client._thread is not None and self.client._thread.is_alive():
+            return
+        Thread(target=self.connect, name='mqtt-reconnect', daemon=True).start()
+
+    def _probe_broker(self):
+        if self.client.is_connected():
+            return True
+        self._reconnect_in_background()
+        return False
 
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             self.logger.info(f"Connected to MQTT broker at {settings.MQTT_BROKER}:{settings.MQTT_PORT}")
             self.logger.info(f"Client ID: {client._client_id}")
             self.logger.info(f"Protocol version: {client._protocol}")
+            self.breaker.record_success()
             self.subscribe_to_topics()
         else:
+            self.breaker.record_failure()
             self.logger.error(f"Connection failed with result code {rc}")
             self.logger.error(f"Result code meaning: {mqtt.connack_string(rc)}")
 
     def _on_disconnect(self, client, userdata, rc):
         if rc != 0:
-            self.logger.warning(f"Unexpected disconnection from MQTT broker {settings.MQTT_BROKER}:{settings.MQTT_PORT}. Attempting to reconnect...")
-            try:
-                # Add delay before reconnect attempt
-                time.sleep(5)  
-                self.connect()
-            except Exception as e:
-                self.logger.error(f"Reconnection failed: {str(e)}")
+            # Runs on paho's network thread: the loop itself reconnects with
+            # backoff, so neither sleep nor connect here
+            self.logger.warning(f"Unexpected disconnection from MQTT broker {settings.MQTT_BROKER}:{settings.MQTT_PORT}. Reconnecting in the background...")
+            self.breaker.trip()
 
     def publish(self, topic, message):
-        with self._publish_lock:  # Ensure thread-safe publishing
-            try:
-                # Convert message to string if it's not already in an acceptable format
-                if not isinstance(message, (str, bytearray, int, float, type(None))):
-                    try:
-                        message = str(message)  # Convert to string
-                    except Exception as e:
-                        self.logger.error(f"Failed to convert message to string: {e}")
-                        return False
-
-                if self.client.is_connected():
-                    result = self.client.publish(topic, message)
-                    # Wait for message to be sent
-                    result.wait_for_publish()
-                    if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                        self.logger.info(f"Message published successfully to {topic}")
-                        return True
-                    else:
-                        self.logger.error(f"Failed to publish message to {topic}")
-                        return False
-                else:
-                    self.logger.error("Cannot publish message: MQTT client is not connected.")
-                    mqtt_port = int(settings.MQTT_PORT)
-                    mqtt_broker = settings.MQTT_BROKER
-                    logger.info(f"Connecting to broker to {mqtt_broker}:{mqtt_port}")
-                    result = self.client.connect(mqtt_broker, mqtt_port, 60)                   
-                    if result == mqtt.MQTT_ERR_SUCCESS:
-                        logger.info("Reconnected to MQTT broker")
-                        result = self.client.publish(topic, message)
-                        self.logger.info(f"Message published successfully to {topic}")
-                        return True
-                    else:
-                        self.logger.error(f"Failed to publish message to {topic}")
-                        return False
-            except Exception as e:
-                self.logger.exception(f"Error publishing message to {topic}: {e}")
+        # Fail fast while the broker is away instead of queueing every caller
+        # behind a connection attempt
+        if not self.breaker.allow():
+            self.logger.error(f"MQTT broker circuit is open, not publishing to {topic}")
+            return False
+        if not self.client.is_connected():
+            self.logger.error("Cannot publish message: MQTT client is not connected. Reconnecting in the background")
+            self.breaker.record_failure()
+            self._reconnect_in_background()
+            return False
+        try:
+            # Convert message to string if it's not already in an acceptable format
+            if not isinstance(message, (str, bytearray, int, float, type(None))):
+                try:
+                    message = str(message)  # Convert to string
+                except Exception as e:
+                    self.logger.error(f"Failed to convert message to string: {e}")
+                    return False
+
+            with self._publish_lock:  # Ensure thread-safe publishing
+                result = self.client.publish(topic, message)
+            if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                self.logger.error(f"Failed to publish message to {topic}. Result code: {result.rc}")
+                if result.rc == mqtt.MQTT_ERR_NO_CONN:
+                    self.breaker.record_failure()
+                return False
+            # Wait for message to be sent, outside the lock and bounded
+            result.wait_for_publish(timeout=self.publish_timeout)
+            if not result.is_published():
+                self.logger.error(f"Timed out publishing message to {topic}")
                 return False
+            self.logger.info(f"Message published successfully to {topic}")
+            return True
+        except Exception as e:
+            self.logger.exception(f"Error publishing message to {topic}: {e}")
+            return False
     
     def get_diagnostics(self):
         return {
@@ -119,7 +139,8 @@ class MQTTManager:
             "broker": getattr(settings, 'MQTT_BROKER', 'unknown'),
             "port": getattr(settings, 'MQTT_PORT', 'unknown'),
             "keepalive": self.client._keepalive,
-            "loop_status": self.client._thread is not None and self.client._thread.is_alive()
+            "loop_status": self.client._thread is not None and self.client._thread.is_alive(),
+            "circuit_breakers": get_breaker_states(),
         }
 
 # mqtt_manager = MQTTManager()
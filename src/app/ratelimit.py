@@ -0,0 +1,180 @@
+# app/ratelimit.py
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = 'command-rate:stats'
+
+# Takes one token from the reader's bucket and from its per-command bucket,
+# or from neither. Buckets refill continuously at `rate` tokens per second
+# up to `burst`. Returns '0' when allowed, otherwise the seconds until both
+# buckets hold a token (as a string: Lua numbers are truncated to integers
+# in Redis replies).
+# KEYS: reader bucket, command bucket, stats hash
+# ARGV: reader rate, reader burst, command rate, command burst, command type
+TOKEN_BUCKET_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local function level(key, rate, burst)
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    return math.min(burst, tokens + math.max(0, now - ts) * rate)
+end
+local reader_rate, reader_burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local command_rate, command_burst = tonumber(ARGV[3]), tonumber(ARGV[4])
+local reader_tokens = level(KEYS[1], reader_rate, reader_burst)
+local command_tokens = level(KEYS[2], command_rate, command_burst)
+if reader_tokens >= 1 and command_tokens >= 1 then
+    redis.call('HSET', KEYS[1], 'tokens', reader_tokens - 1, 'ts', now)
+    redis.call('HSET', KEYS[2], 'tokens', command_tokens - 1, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(reader_burst / reader_rate) + 1)
+    redis.call('EXPIRE', KEYS[2], math.ceil(command_burst / command_rate) + 1)
+    redis.call('HINCRBY', KEYS[3], 'allowed', 1)
+    return '0'
+end
+redis.call('HINCRBY', KEYS[3], 'throttled', 1)
+redis.call('HINCRBY', KEYS[3], 'throttled:' .. ARGV[5], 1)
+local wait = math.max((1 - reader_tokens) / reader_rate, (1 - command_tokens) / command_rate)
+return tostring(wait)
+"""
+
+def get_limits(command):
+    """((reader rate, burst), (command rate, burst)) from settings.COMMAND_RATE_LIMITS"""
+    limits = settings.COMMAND_RATE_LIMITS
+    return limits['reader'], limits.get(command, limits['default'])
+
+
+class RedisCommandLimiter:
+    """Buckets kept in Redis, so the limits hold across dispatcher processes"""
+    shared = True
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.script = connection.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def acquire_many(self, requests):
+        """
+        Args:
+            requests: list of (reader_id, command)
+
+        Returns:
+            list of seconds to wait, 0 where the command may be sent now
+        """
+        pipeline = self.connection.pipeline(transaction=False)
+        for reader_id, command in requests:
+            (reader_rate, reader_burst), (command_rate, command_burst) = get_limits(command)
+            self.script(
+                keys=[f'command-rate:{reader_id}', f'command-rate:{reader_id}:{command}', STATS_KEY],
+                args=[reader_rate, reader_burst, command_rate, command_burst, command],
+                client=pipeline,
+            )
+        return [float(wait) for wait in pipeline.execute()]
+
+    def get_stats(self):
+        return {key.decode(): int(value) for key, value in self.connection.hgetall(STATS_KEY).items()}
+
+
+class LocalCommandLimiter:
+    """
+    In-process buckets for setups without Redis; limits only hold per
+    process. The counters go to the Django cache, so diagnostics read in
+    another process (the MQTT service) see them whenever the cache is shared.
+    """
+    shared = False
+
+    def __init__(self):
+        self._buckets = {}  # key -> (tokens, timestamp)
+        self._lock = threading.Lock()
+
+    def _level(self, key, rate, burst, now):
+        tokens, ts = self._buckets.get(key, (burst, now))
+        return min(burst, tokens + max(0, now - ts) * rate)
+
+    def acquire_many(self, requests):
+        waits = []
+        counts = {}
+        with self._lock:
+            for reader_id, command in requests:
+                now = time.monotonic()
+                (reader_rate, reader_burst), (command_rate, command_burst) = get_limits(command)
+                reader_key, command_key = reader_id, (reader_id, command)
+                reader_tokens = self._level(reader_key, reader_rate, reader_burst, now)
+                command_tokens = self._level(command_key, command_rate, command_burst, now)
+                if reader_tokens >= 1 and command_tokens >= 1:
+                    self._buckets[reader_key] = (reader_tokens - 1, now)
+                    self._buckets[command_key] = (command_tokens - 1, now)
+                    names = ['allowed']
+                    waits.append(0)
+                else:
+                    names = ['throttled', f'throttled:{command}']
+                    waits.append(max((1 - reader_tokens) / reader_rate, (1 - command_tokens) / command_rate))
+                for name in names:
+                    counts[name] = counts.get(name, 0) + 1
+        self._record(counts)
+        return waits
+
+    def _record(self, counts):
+        try:
+            for name, count in counts.items():
+                key = f'{STATS_KEY}:{name}'
+                cache.add(key, 0, None)
+                cache.incr(key, count)
+        except Exception as e:
+            logger.warning(f"Could not record command throttle stats: {e}")
+
+    def get_stats(self):
+        from .models import Command
+        names = ['allowed', 'throttled'] + [f'throttled:{command}' for command, _label in Command.COMMAND_TYPES]
+        found = cache.get_many([f'{STATS_KEY}:{name}' for name in names])
+        return {name: found[f'{STATS_KEY}:{name}'] for name in names if f'{STATS_KEY}:{name}' in found}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_command_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                if settings.CACHES['default']['BACKEND'].startswith('django_redis'):
+                    from django_redis import get_redis_connection
+                    _limiter = RedisCommandLimiter(get_redis_connection('default'))
+                else:
+                    logger.warning(
+                        "Cache backend is not Redis: command rate limits only hold within this process. "
+                        "Set REDIS_CACHE_URL so every dispatcher shares them"
+                    )
+                    _limiter = LocalCommandLimiter()
+    return _limiter
+
+def throttle_commands(commands):
+    """
+    Take tokens for claimed commands (dicts with 'id', 'reader_id' and
+    'command'). Returns {pk: seconds to wait} for those over their limit.
+    If the limiter cannot be reached, commands are let through.
+    """
+    if not settings.COMMAND_RATE_LIMIT_ENABLED or not commands:
+        return {}
+    try:
+        waits = get_command_limiter().acquire_many(
+            [(command['reader_id'], command['command']) for command in commands]
+        )
+    except Exception as e:
+        logger.warning(f"Command rate limiter unavailable, not throttling: {e}")
+        return {}
+    return {command['id']: wait for command, wait in zip(commands, waits) if wait > 0}
+
+def get_throttle_stats():
+    """Allowed and throttled counts, and whether the limits hold across processes"""
+    try:
+        limiter = get_command_limiter()
+        return {'shared_limits': limiter.shared, 'counts': limiter.get_stats()}
+    except Exception as e:
+        logger.warning(f"Could not read command throttle stats: {e}")
+        return {}
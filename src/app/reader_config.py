@@ -0,0 +1,100 @@
+# app/reader_config.py
+import logging
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# The mode configuration each reader last acknowledged, keyed by serial
+# number, so mode commands that would change nothing can be skipped and
+# the others reduced to the settings that differ. The full configuration a
+# mode command leads to is parked under its command_id until the reader's
+# manageResult/controlResult confirms it. Anything missing from the cache
+# simply means the full configuration is sent. Entries expire after
+# READER_CONFIG_CACHE_TIMEOUT and are forgotten whenever the reader
+# connects or disconnects, as it may have been reconfigured or restarted.
+# While a mode command is in flight the reader's configuration is about to
+# change, so the next one is sent whole as well.
+
+def _acknowledged_key(serial_number):
+    return f'reader-config:{serial_number}'
+
+def _expected_key(command_id):
+    return f'reader-config:expected:{command_id}'
+
+def _in_flight_key(serial_number):
+    return f'reader-config:in-flight:{serial_number}'
+
+def get_acknowledged_configs(serial_numbers):
+    """
+    Return {serial number: configuration} for the readers with a known
+    configuration and no mode command in flight
+    """
+    keys = [_acknowledged_key(serial) for serial in serial_numbers] + [_in_flight_key(serial) for serial in serial_numbers]
+    try:
+        found = cache.get_many(keys)
+    except Exception as e:
+        logger.warning(f"Could not read reader configurations: {e}")
+        return {}
+    return {
+        serial: found[_acknowledged_key(serial)] for serial in serial_numbers
+        if _acknowledged_key(serial) in found and _in_flight_key(serial) not in found
+    }
+
+def forget_reader_configs(serial_numbers):
+    """Drop what is known about these readers' configuration, e.g. after a reconnect or a superseded mode command"""
+    keys = [_acknowledged_key(serial) for serial in serial_numbers] + [_in_flight_key(serial) for serial in serial_numbers]
+    try:
+        cache.delete_many(keys)
+    except Exception as e:
+        logger.warning(f"Could not clear reader configurations: {e}")
+
+def expect_configs(entries):
+    """
+    Args:
+        entries: iterable of (command_id, reader serial, full configuration
+            the reader runs once the command succeeds)
+    """
+    expected = {}
+    for command_id, serial, config in entries:
+        expected[_expected_key(command_id)] = (serial, config)
+        # the newest mode command of each reader
+        expected[_in_flight_key(serial)] = command_id
+    if expected:
+        try:
+            cache.set_many(expected, settings.COMMAND_CORRELATION_TTL)
+        except Exception as e:
+            logger.warning(f"Could not record expected reader configurations: {e}")
+
+def record_mode_result(command_id, serial_number, succeeded):
+    """Adopt the configuration a mode command led to, or forget it if the outcome is unknown"""
+    try:
+        expected = cache.get(_expected_key(command_id))
+        cache.delete(_expected_key(command_id))
+        if cache.get(_in_flight_key(serial_number)) == command_id:
+            cache.delete(_in_flight_key(serial_number))
+        if succeeded and expected is not None and expected[0] == serial_number:
+            cache.set(_acknowledged_key(serial_number), expected[1], settings.READER_CONFIG_CACHE_TIMEOUT)
+        else:
+            # Failed, or sent without going through handle_mode_command
+            cache.delete(_acknowledged_key(serial_number))
+    except Exception as e:
+        logger.warning(f"Could not record configuration of reader {serial_number}: {e}")
+
+def plan_mode_update(acknowledged, desired):
+    """
+    What to send to move a reader from its `acknowledged` configuration to
+    `desired`: None when nothing would change, only the changed top-level
+    settings (plus 'type'). Without MODE_DRIFT_ONLY it is always `desired`.
+    """
+    if acknowledged is None or not settings.MODE_DRIFT_ONLY:
+        return desired
+    if acknowledged == desired:
+        return None
+    if set(acknowledged) - set(desired):
+        # A cleared setting can only be expressed by the full configuration
+        return desired
+    changed = {key: value for key, value in desired.items() if acknowledged.get(key) != value}
+    if 'type' in desired:
+        changed['type'] = desired['type']
+    return changed
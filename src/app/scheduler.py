@@ -0,0 +1,225 @@
+# app/scheduler.py
+import calendar
+import heapq
+import logging
+import threading
+import zlib
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .caching import get_list_version
+from .models import ScheduledCommand
+
+logger = logging.getLogger(__name__)
+
+RECURRENCE_PERIODS = {
+    'DAILY': timedelta(days=1),
+    'WEEKLY': timedelta(weeks=1),
+}
+
+def add_months(moment, months, day=None):
+    """
+    `day` (default: the day of `moment`) of a later month, clamped to the
+    last day of shorter months
+    """
+    month_index = moment.month - 1 + months
+    year, month = moment.year + month_index // 12, month_index % 12 + 1
+    day = day or moment.day
+    return moment.replace(year=year, month=month, day=min(day, calendar.monthrange(year, month)[1]))
+
+def get_spread_offset(reader_id, command_type):
+    """
+    Fixed delay of one reader within its command type's SCHEDULED_COMMAND_SPREAD
+    window. It is derived from the reader id, so a fleet scheduled for the
+    same minute fires spread evenly over the window, and each reader fires
+    at the same offset every run.
+    """
+    window = getattr(settings, 'SCHEDULED_COMMAND_SPREAD', {}).get(command_type, 0)
+    if not window:
+        return timedelta(0)
+    fraction = zlib.crc32(f'{command_type}:{reader_id}'.encode()) / 2 ** 32
+    return timedelta(seconds=round(fraction * window, 3))
+
+def get_fire_time(scheduled_time, reader_id, command_type):
+    """When a schedule actually fires: its scheduled_time plus the reader's spread offset"""
+    return scheduled_time + get_spread_offset(reader_id, command_type)
+
+def next_occurrence(scheduled_time, recurrence, now, day_of_month=None):
+    """
+    First occurrence of a recurring schedule strictly after `now`, or None
+    for ONCE. Steps are taken in local wall-clock time, so a daily command
+    keeps its hour across DST changes and a monthly one its day of month:
+    `day_of_month` is the intended day, which a run clamped to the end of a
+    short month (31st -> 28th) no longer shows.
+    Occurrences missed while the scheduler was down are skipped, not replayed.
+    """
+    if recurrence not in RECURRENCE_PERIODS and recurrence != 'MONTHLY':
+        return None
+    tz = timezone.get_current_timezone()
+    start = timezone.localtime(scheduled_time, tz).replace(tzinfo=None)
+    elapsed = timezone.localtime(now, tz).replace(tzinfo=None) - start
+    if recurrence == 'MONTHLY':
+        step = max(1, elapsed.days // 31)
+    else:
+        step = max(1, elapsed // RECURRENCE_PERIODS[recurrence])
+    while True:
+        if recurrence == 'MONTHLY':
+            candidate = add_months(start, step, day_of_month)
+        else:
+            candidate = start + RECURRENCE_PERIODS[recurrence] * step
+        candidate = timezone.make_aware(candidate, tz, is_dst=False)
+        if candidate > now:
+            return candidate
+        step += 1
+
+
+class CommandScheduler:
+    """
+    Fires ScheduledCommands at their scheduled_time, shifted by the reader's
+    spread offset (see get_spread_offset). Active schedules due
+    within SCHEDULER_HORIZON are kept in a min-heap; the loop sleeps until
+    the earliest one, so commands go out within a tick instead of up to a
+    minute late, and the database is only asked for the next window of
+    schedules, not scanned on every pass.
+
+    Edits made in this process wake the loop through the model signals
+    below. Edits made elsewhere (the web process) are picked up every
+    SCHEDULER_POLL_INTERVAL seconds by asking the database for schedules
+    updated since the last one seen, which does not depend on the cache
+    being shared. A change of the 'scheduled_command_list' version in the
+    cache (deletes, with a shared cache) reloads the heap.
+    """
+    def __init__(self, horizon=None, poll_interval=None):
+        self.horizon = timedelta(seconds=horizon or getattr(settings, 'SCHEDULER_HORIZON', 3600))
+        self.poll_interval = poll_interval or getattr(settings, 'SCHEDULER_POLL_INTERVAL', 1.0)
+        self._heap = []  # (fire time, schedule pk)
+        self._due_at = {}  # schedule pk -> fire time of its live heap entry
+        self._loaded_until = None
+        self._version = None
+        self._changed_since = None  # latest updated_at the heap reflects
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def load(self, now):
+        # Read the version first so an edit racing with the query triggers another reload
+        self._version = get_list_version('scheduled_command_list')
+        self._changed_since = ScheduledCommand.objects.aggregate(latest=Max('updated_at'))['latest']
+        loaded_until = now + self.horizon
+        rows = ScheduledCommand.objects.filter(
+            is_active=True, scheduled_time__lte=loaded_until
+        ).values_list('id', 'scheduled_time', 'reader_id', 'command_type')
+        with self._lock:
+            self._due_at = {
+                pk: get_fire_time(scheduled_time, reader_id, command_type)
+                for pk, scheduled_time, reader_id, command_type in rows
+            }
+            self._heap = [(fire_time, pk) for pk, fire_time in self._due_at.items()]
+            heapq.heapify(self._heap)
+            self._loaded_until = loaded_until
+        logger.debug(f"Scheduler loaded {len(self._heap)} schedules due before {loaded_until}")
+
+    def notify(self, pk, fire_time=None, is_active=False):
+        """Record a changed (or deleted, is_active=False) schedule and wake the loop"""
+        with self._lock:
+            self._push(pk, fire_time if is_active else None)
+        self._wake.set()
+
+    def _push(self, pk, fire_time):
+        if fire_time is None or self._loaded_until is None or fire_time > self._loaded_until:
+            # Dropped entries stay in the heap and are skipped when popped
+            self._due_at.pop(pk, None)
+            return
+        self._due_at[pk] = fire_time
+        heapq.heappush(self._heap, (fire_time, pk))
+
+    def apply_edits(self):
+        """Push schedules saved since the last poll, by any process, onto the heap"""
+        edited = ScheduledCommand.objects.all()
+        if self._changed_since is not None:
+            # >= so an edit committed with the same timestamp is not missed; pushing twice is harmless
+            edited = edited.filter(updated_at__gte=self._changed_since)
+        rows = list(edited.values_list('id', 'scheduled_time', 'reader_id', 'command_type', 'is_active', 'updated_at'))
+        with self._lock:
+            for pk, scheduled_time, reader_id, command_type, is_active, updated_at in rows:
+                self._push(pk, get_fire_time(scheduled_time, reader_id, command_type) if is_active else None)
+                if self._changed_since is None or updated_at > self._changed_since:
+                    self._changed_since = updated_at
+
+    def _discard_stale(self):
+        while self._heap and self._due_at.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        with self._lock:
+            self._discard_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        due = []
+        with self._lock:
+            self._discard_stale()
+            while self._heap and self._heap[0][0] <= now:
+                _fire_time, pk = heapq.heappop(self._heap)
+                del self._due_at[pk]
+                due.append(pk)
+                self._discard_stale()
+        return due
+
+    def run_once(self, now=None):
+        """Fire whatever is due; returns the number of commands stored"""
+        from .services import dispatch_scheduled_commands
+        now = now or timezone.now()
+        if (self._loaded_until is None or now >= self._loaded_until
+                or get_list_version('scheduled_command_list') != self._version):
+            self.load(now)
+        else:
+            self.apply_edits()
+        due = self.pop_due(now)
+        if not due:
+            return 0
+        version = self._version
+        fired = dispatch_scheduled_commands(now, schedule_ids=due)
+        # Our own bump of the list version is no reason to reload
+        if fired and get_list_version('scheduled_command_list') == version + 1:
+            self._version = version + 1
+        with self._lock:
+            for pk, fire_time, is_active in fired:
+                self._push(pk, fire_time if is_active else None)
+        return len(fired)
+
+    def seconds_until_next(self, now=None):
+        now = now or timezone.now()
+        next_due = self.next_due()
+        wait = self.poll_interval
+        if next_due is not None:
+            wait = min(wait, (next_due - now).total_seconds())
+        return max(wait, 0)
+
+    def run_forever(self):
+        logger.info("Starting scheduled command scheduler")
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Error executing scheduled commands: {e}")
+            finally:
+                close_old_connections()
+            self._wake.wait(self.seconds_until_next())
+            self._wake.clear()
+
+
+command_scheduler = CommandScheduler()
+
+@receiver(post_save, sender=ScheduledCommand)
+def _schedule_saved(sender, instance, **kwargs):
+    command_scheduler.notify(
+        instance.pk, get_fire_time(instance.scheduled_time, instance.reader_id, instance.command_type), instance.is_active
+    )
+
+@receiver(post_delete, sender=ScheduledCommand)
+def _schedule_deleted(sender, instance, **kwargs):
+    command_scheduler.notify(instance.pk)
@@ -1,3 +1,4 @@
+import json
 import uuid
 from rest_framework import serializers
 from .models import Reader, TagEvent, Command
@@ -14,6 +15,42 @@ class TagEventSerializer(serializers.ModelSerializer):
         model = TagEvent
         fields = ['reader_serial_number', 'epc', 'first_seen_timestamp', 'antenna_port', 'antenna_zone', 'peak_rssi']
 
+# Fast path for TagEventListView: the same JSON as TagEventSerializer, rendered
+# straight from values_list() tuples instead of model instances and dicts.
+TAG_EVENT_API_COLUMNS = ('reader_id', 'epc', 'first_seen_timestamp', 'antenna_port', 'antenna_zone', 'peak_rssi')
+
+_tag_event_timestamp_field = serializers.DateTimeField()
+# Matches JSONRenderer with the default UNICODE_JSON, COMPACT_JSON and STRICT_JSON settings
+_encode_json = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), allow_nan=False).encode
+
+def render_tag_event_rows(rows, reader_serials):
+    """
+    Yield a UTF-8 JSON array of tag events chunk by chunk, without building
+    intermediate dicts.
+
+    Args:
+        rows: iterable of tuples in TAG_EVENT_API_COLUMNS order
+        reader_serials: dict of reader id -> serial number
+    """
+    to_timestamp = _tag_event_timestamp_field.to_representation
+    encode = _encode_json
+    separator = '['
+    for reader_id, epc, first_seen_timestamp, antenna_port, antenna_zone, peak_rssi in rows:
+        yield (
+            '%s{"reader_serial_number":%s,"epc":%s,"first_seen_timestamp":%s,'
+            '"antenna_port":%s,"antenna_zone":%s,"peak_rssi":%s}' % (
+                separator,
+                encode(reader_serials.get(reader_id)),
+                encode(epc),
+                encode(to_timestamp(first_seen_timestamp) if first_seen_timestamp else None),
+                encode(antenna_port),
+                encode(antenna_zone),
+                encode(peak_rssi),
+            )
+        ).encode('utf-8')
+        separator = ','
+    yield b'[]' if separator == '[' else b']'
+
 from rest_framework import serializers
 from .models import Command, Reader
 from .services import store_command
@@ -26,7 +63,7 @@ class CommandSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Command
-        fields = ['command_id', 'reader_serial_number', 'command_type', 'details', 'status']
+        fields = ['command_id', 'reader_serial_number', 'command_type', 'details', 'status', 'priority']
         read_only_fields = ['command_id', 'status']
 
     def create(self, validated_data):
@@ -40,7 +77,7 @@ class CommandSerializer(serializers.ModelSerializer):
         command = validated_data.pop('command')
         details = validated_data.get('details')
         
-        return store_command(reader, command, details)
+        return store_command(reader, command, details, validated_data.get('priority'))
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -55,4 +92,25 @@ class CommandSerializer(serializers.ModelSerializer):
             Reader.objects.get(serial_number=value)
         except Reader.DoesNotExist:
             raise serializers.ValidationError("Reader with this serial number does not exist.")
-        return value
\ No newline at end of file
+        return value
+
+
+class CommandFanOutSerializer(serializers.Serializer):
+    command_type = serializers.ChoiceField(choices=[choice for choice, _label in Command.COMMAND_TYPES])
+    details = serializers.JSONField(required=False)
+    reader_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    serial_pattern = serializers.CharField(required=False, max_length=255)
+    location = serializers.CharField(required=False, max_length=255)
+    priority = serializers.ChoiceField(choices=[choice for choice, _label in Command.PRIORITY_CHOICES], required=False)
+
+    def validate(self, attrs):
+        if not any(attrs.get(key) for key in ('reader_ids', 'serial_pattern', 'location')):
+            raise serializers.ValidationError("Select readers by reader_ids, serial_pattern or location.")
+        return attrs
+
+class CommandBatchItemSerializer(serializers.Serializer):
+    """One entry of a batch submission; reader serials are resolved in bulk by the service"""
+    reader_serial_number = serializers.CharField(max_length=255)
+    command_type = serializers.ChoiceField(choices=[choice for choice, _label in Command.COMMAND_TYPES])
+    details = serializers.JSONField(required=False)
+    priority = serializers.ChoiceField(choices=[choice for choice, _label in Command.PRIORITY_CHOICES], required=False)
@@ -1,9 +1,14 @@
 # services.py
 import logging
 import json
+import math
+import re
+import time
 import uuid
 from django.conf import settings
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Case, Count, DateTimeField, F, Q, Value, When
+from django.db.models.fields.json import KeyTransform
 from django.core.paginator import Paginator
 from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import get_object_or_404
@@ -12,11 +17,53 @@ from django.utils.translation import gettext as _
 from django.utils import timezone
 from datetime import datetime
 
+from dapr_integration.client import get_publisher_client
+from dapr_integration.config import DAPR_PUBSUB_NAME
+from .caching import bump_list_version
+from .correlation import remember_commands, lookup_command, forget_command
+from .envelopes import normalize_details, render_envelope, prepare_command
+from .breakers import get_breaker
+from .completion import get_status_notifier, notify_commands_finished
+from .ratelimit import throttle_commands
+from .reader_config import get_acknowledged_configs, expect_configs, record_mode_result, plan_mode_update, forget_reader_configs
 from .models import Command, Reader, TagEvent, DetailedStatusEvent, Alert, AlertLog, ScheduledCommand, Firmware
+from .scheduler import get_fire_time, next_occurrence
 
 
 logger = logging.getLogger(__name__)
 
+# Opened after repeated failed publishes; while open, commands are not
+# claimed or sent, and the sidecar's health endpoint is probed until it
+# answers again
+sidecar_breaker = get_breaker('dapr-publisher', probe=lambda: get_publisher_client().healthz())
+
+# Columns rendered by the list pages; everything else (JSON blobs, tag data
+# keys, ...) stays in the database until a detail page asks for it.
+TAG_EVENT_LIST_FIELDS = (
+    'epc', 'first_seen_timestamp', 'antenna_port', 'antenna_zone', 'peak_rssi',
+    'reader__serial_number',
+)
+DETAILED_STATUS_EVENT_LIST_FIELDS = (
+    'event_type', 'component', 'timestamp', 'status',
+    'reader__serial_number',
+)
+
+def apply_list_projection(queryset, fields):
+    """
+    Restrict a list queryset to `fields`, joining the related models they
+    reach through ('reader__serial_number' -> select_related('reader')).
+    """
+    related = {field.rsplit('__', 1)[0] for field in fields if '__' in field}
+    return queryset.select_related(*related).only(*fields)
+
+def get_tag_event_list(search_query, sort_by):
+    return apply_list_projection(get_tag_events(search_query, sort_by), TAG_EVENT_LIST_FIELDS)
+
+def get_detailed_status_event_list(search_query, sort_by):
+    return apply_list_projection(
+        get_detailed_status_events(search_query, sort_by), DETAILED_STATUS_EVENT_LIST_FIELDS
+    )
+
 def get_tag_events(search_query, sort_by):
     return TagEvent.objects.filter(
         Q(epc__icontains=search_query) |
@@ -35,96 +82,133 @@ def get_readers(search_query, sort_by):
         Q(location__icontains=search_query)
     ).order_by(sort_by)
 
-def send_command_service(request, reader_id, command_id, command_type, payload=None):
-    reader = get_object_or_404(Reader, pk=reader_id)
-    command_payload = None
+def parse_command_details(details):
+    """Turn Command.details (JSON text, or a dict repr with single quotes) into the payload dict"""
+    if details is None:
+        return {}
+    if isinstance(details, dict):
+        return details
     try:
-        command = Command.objects.filter(
-            command_id=command_id,
-            reader__serial_number=reader.serial_number
-        ).latest('date_sent')
-        
-        # Check if command.details is a string and convert it to a dictionary if needed
-        if isinstance(command.details, str):
-            try:
-                command_payload = json.loads(command.details)  # Parse it to a dictionary
-            except json.JSONDecodeError:
-                # If it's not valid JSON, replace single quotes with double quotes
-                logger.warning("command.details is not valid JSON, trying to fix format")
-                try:
-                    command_payload = json.loads(command.details.replace("'", '"'))
-                except Exception as e:
-                    logger.warning("Invalid JSON stored in command details.")
-                    command_payload = {}
+        return json.loads(details)  # Parse it to a dictionary
+    except json.JSONDecodeError:
+        # If it's not valid JSON, replace single quotes with double quotes
+        logger.warning("command.details is not valid JSON, trying to fix format")
+        try:
+            return json.loads(details.replace("'", '"'))
+        except Exception as e:
+            logger.warning("Invalid JSON stored in command details.")
+            return {}
+
+def send_command_service(request, reader_id, command_id, command_type, payload=None, command=None, envelope=None):
+    """
+    Publish a command. Pass the stored `command` (with its reader loaded)
+    to send its pre-rendered envelope without touching the database;
+    otherwise `envelope` (as returned by get_pending_commands) or, for rows
+    without one, `payload` is sent.
+    """
+    if command is not None:
+        reader_serial = command.reader.serial_number
+        remember_commands([(command.command_id, command.pk, reader_serial, command.command)])
+        return publish_command(reader_serial, command.command_id, command.command or command_type, envelope=command.envelope)
+    reader = get_object_or_404(Reader, pk=reader_id)
+    return publish_command(reader.serial_number, command_id, command_type, payload, envelope=envelope)
+
+def build_command_message(reader_serial, command_id, command_type, details=None, envelope=None):
+    """(topic, message bytes) for a command, from its pre-rendered envelope when there is one"""
+    if envelope is None:
+        # Rows stored before envelopes were rendered, and ad-hoc payloads
+        try:
+            envelope = render_envelope(command_id, command_type, normalize_details(details))
+        except ValueError as e:
+            logger.warning(f"Invalid details for command {command_id}, sending an empty payload: {e}")
+            envelope = render_envelope(command_id, command_type)
+    if command_type == 'status-detailed':
+        topic = f'smartreader/{reader_serial}/manage'
+    else:
+        topic = f'smartreader/{reader_serial}/control'
+    return topic, envelope.encode()
+
+def publish_commands(commands, window=None):
+    """
+    Publish claimed commands (dicts from claim_pending_commands) through
+    the Dapr publisher sidecar, concurrently across topics and in claim
+    order within one (see DaprSidecarClient.publish_many). Does not touch
+    the database.
+
+    Returns:
+        list of (status, response) per command, in order
+    """
+    messages = [
+        build_command_message(
+            command['reader__serial_number'], command['command_id'], command['command'],
+            command['details'], command['envelope'],
+        )
+        for command in commands
+    ]
+    if not sidecar_breaker.allow():
+        logger.warning(f"Dapr publisher circuit is open, failing {len(commands)} commands without sending")
+        results = [(False, 'circuit open')] * len(commands)
+    else:
+        try:
+            results = get_publisher_client().publish_many(DAPR_PUBSUB_NAME, messages, window=window)
+        except Exception as e:
+            logger.exception(f"Failed to publish via Dapr: {e}")
+            results = [(False, str(e))] * len(commands)
+        if any(ok for ok, _error in results):
+            sidecar_breaker.record_success()
+        elif results:
+            sidecar_breaker.record_failure()
+    outcomes = []
+    for command, (ok, error) in zip(commands, results):
+        if ok:
+            outcomes.append(('COMPLETED', _("Command sent successfully.")))
         else:
-            if not isinstance(command.details, (str, bytearray, int, float, type(None))):
-                try:
-                    command_payload = str(command.details)  # It's already a dictionary 
-                    command_payload = json.loads(command_payload)
-                    logger.info(f'command payload from database: {command.details}')
-                except Exception as e:
-                    logger.error(f"Failed to convert command details to string: {e}")
-                    return False       
-    except ObjectDoesNotExist:
-        command = None
-    except Exception as e:
-        command = None
-        logger.error(f"Error searching command: {str(e)}")
+            logger.error(f"Failed to publish command {command['command_id']} via Dapr: {error}")
+            outcomes.append(('FAILED', _("Failed to send command. Please try again.")))
+    return outcomes
 
-    logger.info(f'Command payload to send: {command_payload}')
-    payload = command_payload
-    
-    print(f'send_command_service {command_type}')
+def publish_command(reader_serial, command_id, command_type, details=None, envelope=None):
+    """
+    Publish a command to its reader through the Dapr publisher sidecar.
+    Does not touch the database, so it is safe to call from worker threads.
+    `envelope` is the message pre-rendered when the command was stored
+    (Command.envelope); without it one is rendered from `details`.
+    """
     if not command_type:
-        logger.error(f"No command type selected for reader {reader.serial_number}")
+        logger.error(f"No command type selected for reader {reader_serial}")
         return False, _("No command type selected.")
 
-    if payload is None:
-        payload = {}
+    topic, message = build_command_message(reader_serial, command_id, command_type, details, envelope)
 
-    message = {
-        'command': command_type,
-        'command_id': command_id,
-        'payload': payload  # payload should now be a proper dictionary
-    }
-
-    if command_type == 'status-detailed':
-        topic = f'smartreader/{reader.serial_number}/manage'
-    else:
-        topic = f'smartreader/{reader.serial_number}/control'
+    if not sidecar_breaker.allow():
+        logger.warning(f"Dapr publisher circuit is open, command '{command_id}' not sent")
+        return False, _("Failed to send command. Please try again.")
 
     # Convert the message to a JSON string with proper formatting
     # message_json = json.dumps(message, indent=4)
     # message_json = json.dumps(message)
 
-    logger.info(f"Sending command '{command_id}' - '{command_type}' to reader '{reader.serial_number}' on topic '{topic}' message: {message}")
+    logger.info(f"Sending command '{command_id}' - '{command_type}' to reader '{reader_serial}' on topic '{topic}' message: {message}")
    
     # The following block is unnecessary, as `message['payload']` is already a dictionary
     # Therefore, we don't need to sanitize it again
 
     try:
-        # Publish via Dapr
-        DAPR_HTTP_PORT = 3501
-        publish_data = {
-            "data": message,
-            "pubsubname": "mqtt-pubsub",
-            "topic": topic
-        }
+        # Publish via the Dapr publisher sidecar
+        response = get_publisher_client().publish(DAPR_PUBSUB_NAME, topic, message)
         
-        import requests
-        response = requests.post(
-            f"http://{settings.DAPR_PUBLISHER_HOST_}:{DAPR_HTTP_PORT}/v1.0/publish",
-            json=publish_data
-        )
-        
-        if response.status_code == 200:
+        if response.ok:
+            sidecar_breaker.record_success()
             logger.info(f"Message published successfully via Dapr")
             return True, _("Command sent successfully.")
         else:
+            if response.status_code >= 500:
+                sidecar_breaker.record_failure()
             logger.error(f"Failed to publish via Dapr: {response.status_code}")
             return False, _("Failed to send command. Please try again.")
             
     except Exception as e:
+        sidecar_breaker.record_failure()
         logger.exception(f"Failed to publish via Dapr: {e}")
         return False, _("Failed to send command. Please try again.")
 
@@ -283,7 +367,12 @@ def send_command(reader, command_id, command_type, payload=None):
     #     logger.exception(f"An exception occurred while publishing the message: {e}")
     #     return False
 
-def handle_mode_command(reader, data):
+def handle_mode_command(reader, data, force=False):
+    """
+    Store a mode command for `reader`, or return None when it already runs
+    this configuration. `force` sends the full configuration regardless of
+    what the reader last acknowledged.
+    """
     payload = {
         'type': data['type'],
         'antennas': data['antennas'],
@@ -321,12 +410,26 @@ def handle_mode_command(reader, data):
     # Log the cleaned-up message
     logger.info(f'Payload after clean-up: {payload}')
 
+    # Send only what differs from the configuration the reader acknowledged
+    acknowledged = None if force else get_acknowledged_configs([reader.serial_number]).get(reader.serial_number)
+    update = plan_mode_update(acknowledged, payload)
+    if update is None:
+        logger.info(f"Reader {reader.serial_number} already runs this configuration, mode command skipped")
+        return None
     # command = store_command(reader, 'mode', payload)
     # return send_command(reader, command.command_id, command.command_type, payload)
-    # message_json = json.dumps(payload)
-    return store_command(reader, 'mode', payload)
+    with transaction.atomic():
+        command = store_command(reader, 'mode', json.dumps(update))
+        expect_configs([(command.command_id, reader.serial_number, payload)])
+    return command
 
-def store_command(reader, command_type, details=None):
+def get_command_priority(command_type, priority=None):
+    """The requested priority, or the default for the command type from COMMAND_PRIORITIES"""
+    if priority:
+        return priority
+    return settings.COMMAND_PRIORITIES.get(command_type, settings.COMMAND_PRIORITIES['default'])
+
+def store_command(reader, command_type, details=None, priority=None):
     try:
         command_id = str(uuid.uuid4())
         command = Command.objects.create(
@@ -334,15 +437,241 @@ def store_command(reader, command_type, details=None):
             reader=reader,
             command=command_type,
             status='PENDING',
-            details=details
+            details=details,
+            priority=get_command_priority(command_type, priority),
         )
         logger.info(f"Command stored: {command}")
+        schedule_command_dispatch([command.pk], priority=command.priority)
         return command
     except Exception as e:
         logger.error(f"Error storing command: {str(e)}")
         raise
 
+def schedule_command_dispatch(command_ids, countdown=None, priority='high'):
+    """
+    Hand freshly stored commands to a worker of their priority lane as soon
+    as the surrounding transaction commits, or `countdown` seconds later. If
+    the broker cannot be reached the commands simply stay PENDING for the
+    polling dispatchers to pick up.
+    """
+    if not settings.COMMAND_PUSH_DISPATCH:
+        return
+
+    def enqueue():
+        from .tasks import dispatch_commands
+        options = {'countdown': countdown} if countdown else {}
+        try:
+            # retry=False: never hold up the request waiting for the broker
+            dispatch_commands.apply_async(
+                args=[list(command_ids)], queue=settings.COMMAND_PRIORITY_QUEUES[priority], retry=False, **options
+            )
+        except Exception as e:
+            logger.warning(f"Could not enqueue dispatch of commands {command_ids}, leaving them to the poller: {e}")
+
+    transaction.on_commit(enqueue)
+
+def schedule_batch_dispatch(batch_id, priority='high'):
+    """Like schedule_command_dispatch, for the commands of a batch in one priority lane"""
+    if not settings.COMMAND_PUSH_DISPATCH:
+        return
+
+    def enqueue():
+        from .tasks import dispatch_command_batch
+        try:
+            dispatch_command_batch.apply_async(
+                args=[batch_id, priority], queue=settings.COMMAND_PRIORITY_QUEUES[priority], retry=False
+            )
+        except Exception as e:
+            logger.warning(f"Could not enqueue dispatch of batch {batch_id}, leaving it to the poller: {e}")
+
+    transaction.on_commit(enqueue)
+
+def select_readers(reader_ids=None, serial_pattern=None, location=None):
+    """
+    Readers matching every given criterion. `serial_pattern` takes shell
+    style wildcards (DOCK-*), `location` is matched case-insensitively.
+    """
+    readers = Reader.objects.all()
+    if reader_ids:
+        readers = readers.filter(id__in=reader_ids)
+    if serial_pattern:
+        regex = re.escape(serial_pattern).replace(r'\*', '.*').replace(r'\?', '.')
+        readers = readers.filter(serial_number__regex=f'^{regex}$')
+    if location:
+        readers = readers.filter(location__iexact=location)
+    return readers
+
+def fan_out_command(command_type, details=None, reader_ids=None, serial_pattern=None, location=None, priority=None):
+    """
+    Store one command per selected reader with a single bulk_create and hand
+    the whole batch to a dispatcher once the transaction commits. A mode
+    command is skipped for readers already running its configuration and
+    reduced to the differing settings for the others (see plan_mode_update).
+
+    Returns:
+        (batch_id, number of commands created, number of readers skipped)
+    """
+    if not (reader_ids or serial_pattern or location):
+        raise ValueError(_("Select readers by id, serial pattern or location."))
+    batch_id = str(uuid.uuid4())
+    priority = get_command_priority(command_type, priority)
+    readers = list(select_readers(reader_ids, serial_pattern, location).values_list('id', 'serial_number'))
+    details = normalize_details(details)
+    reader_details = {reader_pk: details for reader_pk, _serial in readers}
+    if command_type == 'mode' and details:
+        desired = parse_command_details(details)
+        acknowledged = get_acknowledged_configs([serial for _pk, serial in readers])
+        for reader_pk, serial in readers:
+            update = plan_mode_update(acknowledged.get(serial), desired)
+            if update is None:
+                del reader_details[reader_pk]
+            else:
+                reader_details[reader_pk] = json.dumps(update)
+    commands = []
+    for reader_pk, _serial in readers:
+        if reader_pk not in reader_details:
+            continue
+        command_id = str(uuid.uuid4())
+        commands.append(Command(
+            command_id=command_id,
+            reader_id=reader_pk,
+            command=command_type,
+            status='PENDING',
+            details=reader_details[reader_pk],
+            envelope=render_envelope(command_id, command_type, reader_details[reader_pk]),
+            batch_id=batch_id,
+            priority=priority,
+        ))
+    with transaction.atomic():
+        Command.objects.bulk_create(commands, batch_size=500)
+        if command_type == 'mode' and details:
+            serials = dict(readers)
+            expect_configs((command.command_id, serials[command.reader_id], desired) for command in commands)
+        if commands:
+            schedule_batch_dispatch(batch_id, priority)
+    skipped = len(readers) - len(commands)
+    logger.info(f"Fan-out batch {batch_id}: {len(commands)} '{command_type}' commands stored, {skipped} readers up to date")
+    return batch_id, len(commands), skipped
+
+def submit_command_batch(items):
+    """
+    Store a batch of commands for different readers with one reader lookup
+    and one bulk_create, and dispatch them together once committed.
+
+    Args:
+        items: list of dicts with reader_serial_number, command_type and
+            optional details (already JSON encoded) and priority
+
+    Returns:
+        (batch_id, results) where results has one entry per item, in order:
+        {'command_id': ...} or {'error': ...}
+    """
+    batch_id = str(uuid.uuid4())
+    serials = {item['reader_serial_number'] for item in items}
+    reader_pks = dict(Reader.objects.filter(serial_number__in=serials).values_list('serial_number', 'id'))
+
+    commands = []
+    results = []
+    for item in items:
+        reader_pk = reader_pks.get(item['reader_serial_number'])
+        if reader_pk is None:
+            results.append({'error': _('Reader not found')})
+            continue
+        command = Command(
+            command_id=str(uuid.uuid4()),
+            reader_id=reader_pk,
+            command=item['command_type'],
+            status='PENDING',
+            details=item.get('details'),
+            batch_id=batch_id,
+            priority=get_command_priority(item['command_type'], item.get('priority')),
+        )
+        try:
+            prepare_command(command)
+        except ValueError as e:
+            results.append({'error': str(e)})
+            continue
+        commands.append(command)
+        results.append({'command_id': command.command_id})
+
+    with transaction.atomic():
+        Command.objects.bulk_create(commands, batch_size=500)
+        for priority in {command.priority for command in commands}:
+            schedule_batch_dispatch(batch_id, priority)
+    logger.info(f"Command batch {batch_id}: {len(commands)} of {len(items)} commands stored")
+    return batch_id, results
+
+def get_command_batch_status(batch_id):
+    """Aggregate status of a fan-out batch from one grouped COUNT, or None if unknown"""
+    counts = dict(
+        Command.objects.filter(batch_id=batch_id)
+        .order_by()
+        .values_list('status')
+        .annotate(count=Count('id'))
+    )
+    if not counts:
+        return None
+    total = sum(counts.values())
+    return {
+        'batch_id': batch_id,
+        'total': total,
+        'statuses': counts,
+        'done': not any(counts.get(status) for status in ACTIVE_COMMAND_STATUSES),
+    }
+
+# Statuses a command can still leave on its own; anything else is final
+ACTIVE_COMMAND_STATUSES = ('PENDING', 'PROCESSING', 'DEFERRED')
+COMMAND_STATUS_FIELDS = ('id', 'command_id', 'command', 'status', 'response', 'updated_at', 'reader__serial_number')
+
+def get_command_statuses(command_ids):
+    """
+    {command_id: status row} for the known `command_ids`, read with one
+    query on the command_id index (the reader serial comes from a join).
+    """
+    rows = Command.objects.filter(command_id__in=command_ids).order_by('date_sent').values(*COMMAND_STATUS_FIELDS)
+    # A reused command_id resolves to its latest command
+    return {row['command_id']: row for row in rows}
+
+def wait_for_commands(command_ids, timeout=0):
+    """
+    Status rows of `command_ids` (see get_command_statuses) once none of
+    them is active any more, or when `timeout` seconds have passed. While
+    waiting, the database is only read again after a finished command has
+    been announced (app/completion.py).
+    """
+    if not math.isfinite(timeout) or timeout <= 0:
+        return get_command_statuses(command_ids)
+    with get_status_notifier().listen() as listener:
+        # Listening before the first read, so no announcement is missed
+        statuses = get_command_statuses(command_ids)
+        active = {row['id'] for row in statuses.values() if row['status'] in ACTIVE_COMMAND_STATUSES}
+        if not active:
+            return statuses
+        deadline = time.monotonic() + timeout
+        while active:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            active -= listener.wait(remaining)
+    return get_command_statuses(command_ids)
+
 def update_command_status(command_id, reader_serial, command_type, status, response):
+    # Fast path: the dispatcher recorded which row this command_id belongs to
+    correlated = lookup_command(command_id)
+    if correlated is not None:
+        pk, correlated_serial, correlated_command = correlated
+        if (correlated_serial, correlated_command) == (reader_serial, command_type):
+            updated = Command.objects.filter(pk=pk).update(
+                status=status, response=response, updated_at=timezone.now()
+            )
+            if updated:
+                forget_command(command_id)
+                if status not in ACTIVE_COMMAND_STATUSES:
+                    notify_commands_finished([pk])
+                if command_type == 'mode':
+                    record_mode_result(command_id, reader_serial, status == 'COMPLETED')
+                logger.info(f"Command status updated: {command_id} ({status})")
+                return
     try:
         command = Command.objects.filter(
             command_id=command_id,
@@ -352,13 +681,33 @@ def update_command_status(command_id, reader_serial, command_type, status, respo
         
         command.status = status
         command.response = response
-        command.save()
+        command.save(update_fields=['status', 'response', 'updated_at'])
+        forget_command(command_id)
+        if status not in ACTIVE_COMMAND_STATUSES:
+            notify_commands_finished([command.pk])
+        if command_type == 'mode':
+            record_mode_result(command_id, reader_serial, status == 'COMPLETED')
         logger.info(f"Command status updated: {command}")
     except Command.DoesNotExist:
         logger.warning(f"No matching command found for update: {reader_serial} - {command_type}")
     except Exception as e:
         logger.error(f"Error updating command status: {str(e)}")
 
+def get_command_history(search_query, reader_serial):
+    commands = Command.objects.all()
+    
+    if reader_serial:
+        commands = commands.filter(reader__serial_number=reader_serial)
+    
+    if search_query:
+        commands = commands.filter(
+            Q(reader__serial_number__icontains=search_query) |
+            Q(command__icontains=search_query) |
+            Q(status__icontains=search_query)
+        )
+    
+    return commands.select_related('reader').order_by('-date_sent')
+
 def get_detailed_status_events(search_query, sort_by):
     return DetailedStatusEvent.objects.filter(
         Q(reader__serial_number__icontains=search_query) |
@@ -367,11 +716,123 @@ def get_detailed_status_events(search_query, sort_by):
         Q(status__icontains=search_query)
     ).order_by(sort_by)
 
-def update_reader_last_communication(serial_number):
+def parse_json_path(path):
+    """
+    Split a JSON path such as 'gpiConfigurations[0].state' or
+    'gpiConfigurations[*].state' into its keys: ['gpiConfigurations', '0', 'state'].
+    """
+    keys = []
+    for part in (path or '').strip().split('.'):
+        if not part:
+            continue
+        name, _sep, rest = part.partition('[')
+        if name:
+            keys.append(name)
+        while rest:
+            index, _sep, rest = rest.partition(']')
+            keys.append(index.strip() or '*')
+            rest = rest.lstrip('[')
+    return keys
+
+def extract_json_path(value, keys):
+    """Walk an already loaded JSON value, mapping '*' over list items."""
+    for position, key in enumerate(keys):
+        if key == '*':
+            if not isinstance(value, list):
+                return None
+            return [extract_json_path(item, keys[position + 1:]) for item in value]
+        if isinstance(value, dict):
+            value = value.get(key)
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            return None
+    return value
+
+def build_json_containment(keys, value):
+    """
+    Turn a path and a value into a containment document, e.g.
+    ['gpiConfigurations', '*', 'state'], 'high' -> {'gpiConfigurations': [{'state': 'high'}]}
+    so the lookup can be answered by the GIN index on Postgres. A document
+    cannot pin a list position ([x] is contained in any list holding x), so
+    numeric indexes raise ValueError.
+    """
+    document = value
+    for key in reversed(keys):
+        if key.isdigit():
+            raise ValueError(f"List index [{key}] cannot be matched by containment")
+        if key == '*':
+            document = [document]
+        else:
+            document = {key: document}
+    return document
+
+def filter_detailed_status_events_by_json(queryset, path, value, field='non_antenna_details'):
+    """
+    Events whose `field` holds `value` at `path`. Paths with list indexes
+    ('gpiConfigurations[0].state') are resolved with key transforms, up to
+    the last index when a '[*]' follows it (matched by containment from
+    there on); an index after a '[*]' cannot be expressed and raises
+    ValueError.
+    """
+    keys = parse_json_path(path)
+    if not keys:
+        return queryset
+    try:
+        value = json.loads(value)
+    except (TypeError, ValueError):
+        pass
+    indexes = [position for position, key in enumerate(keys) if key.isdigit()]
+    if not indexes:
+        return queryset.filter(**{f'{field}__contains': build_json_containment(keys, value)})
+    last_index = indexes[-1]
+    if '*' in keys[:last_index]:
+        raise ValueError("A list index cannot follow [*] in a JSON path")
+    transformed = keys if '*' not in keys else keys[:last_index + 1]
+    expression = F(field)
+    for key in transformed:
+        expression = KeyTransform(key, expression)
+    queryset = queryset.alias(json_match=expression)
+    if len(transformed) < len(keys):
+        return queryset.filter(json_match__contains=build_json_containment(keys[len(transformed):], value))
+    return queryset.filter(json_match=value)
+
+def get_detailed_status_event_projection(event_id, path, field='non_antenna_details'):
+    """
+    Fetch only the sub-tree of `field` addressed by `path`. Concrete keys are
+    resolved by the database; anything after a '*' is mapped in Python over the
+    (already reduced) list that comes back.
+    Returns (found, value).
+    """
+    keys = parse_json_path(path)
+    db_keys = keys[:keys.index('*')] if '*' in keys else keys
+    expression = F(field)
+    for key in db_keys:
+        expression = KeyTransform(key, expression)
+
+    projected = DetailedStatusEvent.objects.filter(pk=event_id).annotate(
+        projected=expression
+    ).values_list('projected', flat=True).first()
+    if projected is None:
+        return False, None
+    if len(db_keys) < len(keys):
+        projected = extract_json_path(projected, keys[len(db_keys):])
+    return True, projected
+
+def update_reader_last_communication(serial_number, mark_connected=True):
+    """
+    Record that a reader was heard from. Any message but its last will
+    (mark_connected=False) also proves it is online, so a reader created
+    while already running, or streaming since before the MQTT service
+    started, is not left is_connected=False with its commands deferred.
+    """
     try:
         reader = Reader.objects.get(serial_number=serial_number)
         reader.last_communication = timezone.now()
-        reader.save(update_fields=['last_communication'])
+        if mark_connected and not reader.is_connected:
+            update_reader_connection_status(reader, True)
+        else:
+            reader.save(update_fields=['last_communication'])
         logger.info(f"Updated last_communication for reader {serial_number}")
         return reader
     except Reader.DoesNotExist:
@@ -447,11 +908,16 @@ def store_detailed_status_event(reader, payload):
     logger.info(f"Stored detailed status event (type: {event_type}) for reader {reader.serial_number}")
 
 def update_reader_connection_status(reader, is_connected):
+    was_connected = reader.is_connected
     reader.is_connected = is_connected
     reader.save(update_fields=['is_connected', 'last_communication'])
     logger.info(f"Reader {reader.serial_number} connection status updated: {'connected' if is_connected else 'disconnected'}")
+    if is_connected != was_connected:
+        forget_reader_configs([reader.serial_number])
+    if is_connected and not was_connected and settings.COMMAND_DEFER_OFFLINE:
+        flush_deferred_commands(reader)
 
-def get_alerts(user, search_query, sort_by, page):
+def filter_alerts(user, search_query, sort_by):
     alerts = Alert.objects.filter(user=user)
     
     if search_query:
@@ -460,8 +926,10 @@ def get_alerts(user, search_query, sort_by, page):
             Q(condition_type__icontains=search_query)
         )
     
-    alerts = alerts.order_by(sort_by)
-    return get_paginated_items(alerts, page)
+    return alerts.order_by(sort_by)
+
+def get_alerts(user, search_query, sort_by, page):
+    return get_paginated_items(filter_alerts(user, search_query, sort_by), page)
 
 def create_alert(form, user):
     alert = form.save(commit=False)
@@ -498,7 +966,7 @@ def get_alert_by_id(pk, user):
     return get_object_or_404(Alert, pk=pk, user=user)
 
 def get_scheduled_commands(search_query, sort_by):
-    return ScheduledCommand.objects.filter(
+    return ScheduledCommand.objects.select_related('reader').filter(
         Q(reader__serial_number__icontains=search_query) |
         Q(command_type__icontains=search_query) |
         Q(recurrence__icontains=search_query)
@@ -516,6 +984,9 @@ def create_scheduled_command(data):
 def update_scheduled_command(scheduled_command_id, data):
     try:
         scheduled_command = ScheduledCommand.objects.get(id=scheduled_command_id)
+        if 'scheduled_time' in data and data['scheduled_time'] != scheduled_command.scheduled_time:
+            # A rescheduled monthly command takes its day from the new time
+            scheduled_command.day_of_month = None
         for key, value in data.items():
             setattr(scheduled_command, key, value)
         scheduled_command.save()
@@ -540,30 +1011,67 @@ def delete_scheduled_command(scheduled_command_id):
         logger.error(f"Error deleting scheduled command: {str(e)}")
         raise
 
-def execute_scheduled_commands():
-    now = timezone.now()
-    scheduled_commands = ScheduledCommand.objects.filter(is_active=True, scheduled_time__lte=now)
-    
-    for command in scheduled_commands:
-        try:
-            from tasks import process_command
-            process_command.delay(command.reader.id, command.command)
-            logger.info(f"Executed scheduled command: {command}")
-            
-            if command.recurrence == 'ONCE':
-                command.is_active = False
+def dispatch_scheduled_commands(now=None, schedule_ids=None):
+    """
+    Store a command for every active schedule due at `now` (optionally only
+    those in `schedule_ids`) with one bulk_create, move each schedule to its
+    next occurrence with one bulk_update, and dispatch the commands as a
+    batch once committed. A schedule is due once its scheduled_time plus the
+    reader's spread offset (SCHEDULED_COMMAND_SPREAD) has passed.
+
+    Returns:
+        list of (schedule pk, next fire time, is_active)
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = ScheduledCommand.objects.select_for_update(skip_locked=True).filter(
+            is_active=True, scheduled_time__lte=now
+        )
+        if schedule_ids is not None:
+            due = due.filter(id__in=schedule_ids)
+        due = [
+            schedule for schedule in due
+            if get_fire_time(schedule.scheduled_time, schedule.reader_id, schedule.command_type) <= now
+        ]
+        if not due:
+            return []
+        batch_id = str(uuid.uuid4())
+        Command.objects.bulk_create([
+            prepare_command(Command(
+                command_id=str(uuid.uuid4()),
+                reader_id=schedule.reader_id,
+                command=schedule.command_type,
+                status='PENDING',
+                batch_id=batch_id,
+                priority=get_command_priority(schedule.command_type),
+            ))
+            for schedule in due
+        ], batch_size=500)
+        for schedule in due:
+            if schedule.recurrence == 'MONTHLY' and schedule.day_of_month is None:
+                schedule.day_of_month = timezone.localtime(schedule.scheduled_time).day
+            next_time = next_occurrence(schedule.scheduled_time, schedule.recurrence, now, schedule.day_of_month)
+            if next_time is None:
+                schedule.is_active = False
             else:
-                if command.recurrence == 'DAILY':
-                    command.scheduled_time += timezone.timedelta(days=1)
-                elif command.recurrence == 'WEEKLY':
-                    command.scheduled_time += timezone.timedelta(weeks=1)
-                elif command.recurrence == 'MONTHLY':
-                    command.scheduled_time += timezone.timedelta(days=30)  # Approximate
-            
-            command.last_run = now
-            command.save()
-        except Exception as e:
-            logger.error(f"Error executing scheduled command {command.id}: {str(e)}")
+                schedule.scheduled_time = next_time
+            schedule.last_run = now
+            schedule.updated_at = now
+        ScheduledCommand.objects.bulk_update(
+            due, ['scheduled_time', 'day_of_month', 'is_active', 'last_run', 'updated_at']
+        )
+        for priority in {get_command_priority(schedule.command_type) for schedule in due}:
+            schedule_batch_dispatch(batch_id, priority)
+    # bulk_update sends no post_save, so expire the cached list here
+    bump_list_version('scheduled_command_list')
+    logger.info(f"Executed {len(due)} scheduled commands as batch {batch_id}")
+    return [
+        (schedule.pk, get_fire_time(schedule.scheduled_time, schedule.reader_id, schedule.command_type), schedule.is_active)
+        for schedule in due
+    ]
+
+def execute_scheduled_commands():
+    return len(dispatch_scheduled_commands())
 
 def get_all_firmwares():
     return Firmware.objects.all().order_by('-upload_date')
@@ -580,22 +1088,277 @@ def get_reader(reader_id):
 def get_firmware(firmware_id):
     return get_object_or_404(Firmware, id=firmware_id)
 
-def get_pending_commands():
-    """Get all pending commands and update their status to PROCESSING"""
-    pending_commands = Command.objects.filter(status='PENDING')
-    command_list = []
-    
-    for command in pending_commands:
-        command_data = {
-            'id': command.id,
-            'command_id': command.command_id,
-            'reader_serial': command.reader.serial_number,
-            'command': command.command,
-            'details': command.details,
-            'date_sent': command.date_sent.isoformat() if command.date_sent else None
+COMMAND_CLAIM_BATCH_SIZE = 100
+
+# Commands in the same group replace each other: only the newest pending
+# one per reader and group is sent. start/stop set the run state, so a
+# later stop makes an earlier start pointless; status-detailed is
+# idempotent; a mode command carries the complete configuration.
+COMMAND_COALESCE_GROUPS = {
+    'start': 'run-state',
+    'stop': 'run-state',
+    'status-detailed': 'status-detailed',
+    'mode': 'mode',
+}
+
+def find_superseded_commands(claimed):
+    """
+    Return {pk: command_id of the newer command replacing it} for the
+    claimed rows that have a newer command of the same
+    COMMAND_COALESCE_GROUPS group for the same reader. The newer command
+    counts whatever its status (unless it was superseded itself): one
+    already sent, e.g. while this row was throttled, must not be
+    overtaken by it.
+    """
+    grouped = [row for row in claimed if row['command'] in COMMAND_COALESCE_GROUPS]
+    if not grouped:
+        return {}
+    newest = {}
+    candidates = Command.objects.filter(
+        reader_id__in={row['reader_id'] for row in grouped},
+        command__in=COMMAND_COALESCE_GROUPS,
+        date_sent__gte=min(row['date_sent'] for row in grouped),
+    ).exclude(status='SUPERSEDED').values_list('id', 'command_id', 'reader_id', 'command', 'date_sent')
+    for pk, command_id, reader_id, command, date_sent in candidates:
+        key = (reader_id, COMMAND_COALESCE_GROUPS[command])
+        if key not in newest or (date_sent, pk) > newest[key][0]:
+            newest[key] = ((date_sent, pk), command_id)
+    superseded = {}
+    for row in claimed:
+        group = COMMAND_COALESCE_GROUPS.get(row['command'])
+        latest = newest.get((row['reader_id'], group)) if group else None
+        if latest is not None and latest[0][1] != row['id']:
+            superseded[row['id']] = latest[1]
+    return superseded
+
+def claim_pending_commands(limit=COMMAND_CLAIM_BATCH_SIZE, command_ids=None, batch_id=None, priority=None):
+    """
+    Atomically move up to `limit` of the oldest PENDING commands (optionally
+    restricted to the pks in `command_ids`, to one fan-out batch or to one
+    priority lane) to PROCESSING and return them with their reader serial
+    numbers.
+
+    The rows are selected FOR UPDATE SKIP LOCKED inside one transaction, so
+    any number of dispatchers can drain the queue in parallel without two
+    of them claiming the same command. Databases without SKIP LOCKED
+    support (SQLite in development) fall back to a plain select.
+
+    Claimed commands made redundant by a newer command for the same
+    reader (see COMMAND_COALESCE_GROUPS) are marked SUPERSEDED instead, and
+    with COMMAND_DEFER_OFFLINE those for disconnected readers are DEFERRED
+    until the reader reconnects (see flush_deferred_commands). Neither are
+    returned. Commands over a rate limit stay PENDING and are not claimed
+    again before their `not_before` time.
+    """
+    pending = Command.objects.filter(status='PENDING')
+    if command_ids is not None:
+        pending = pending.filter(id__in=command_ids)
+    if batch_id is not None:
+        pending = pending.filter(batch_id=batch_id)
+    if priority is not None:
+        pending = pending.filter(priority=priority)
+    while True:
+        with transaction.atomic():
+            due = Q(not_before__isnull=True) | Q(not_before__lte=timezone.now())
+            claimed = list(
+                pending.filter(due).select_for_update(skip_locked=True, of=('self',))
+                .order_by('date_sent', 'id')
+                .values(
+                    'id', 'command_id', 'command', 'details', 'envelope', 'date_sent', 'priority',
+                    'reader_id', 'reader__serial_number', 'reader__is_connected'
+                )
+                [:limit]
+            )
+            superseded = find_superseded_commands(claimed)
+            now = timezone.now()
+            if superseded:
+                skip_commands(superseded, now)
+                # what the reader runs no longer follows from the acknowledged configuration
+                forget_reader_configs({
+                    row['reader__serial_number'] for row in claimed if row['id'] in superseded and row['command'] == 'mode'
+                })
+            commands = [row for row in claimed if row['id'] not in superseded]
+            if settings.COMMAND_DEFER_OFFLINE:
+                offline = [row['id'] for row in commands if not row['reader__is_connected']]
+                if offline:
+                    defer_commands(offline, now)
+                    commands = [row for row in commands if row['reader__is_connected']]
+            # Over-limit commands stay PENDING, out of the claim until their
+            # reader's token buckets have refilled, and are dispatched again then
+            throttled = throttle_commands(commands)
+            if throttled:
+                hold_throttled_commands(throttled, now)
+                commands = [row for row in commands if row['id'] not in throttled]
+            if commands:
+                Command.objects.filter(id__in=[row['id'] for row in commands]).update(
+                    status='PROCESSING', updated_at=now
+                )
+        if throttled:
+            retry_throttled_commands(throttled, {row['id']: row['priority'] for row in claimed})
+        # A batch that was entirely superseded or throttled says nothing about what is left
+        if commands or len(claimed) < limit:
+            return commands
+
+def hold_throttled_commands(throttled, now):
+    """Keep throttled commands out of the claim until their tokens are expected back, in one UPDATE"""
+    Command.objects.filter(id__in=throttled).update(
+        not_before=Case(*[
+            When(id=pk, then=Value(now + timezone.timedelta(seconds=wait))) for pk, wait in throttled.items()
+        ], output_field=DateTimeField()),
+    )
+
+def retry_throttled_commands(throttled, priorities):
+    """Dispatch throttled commands again, in their lane, when their tokens are expected back"""
+    delays = {}
+    for pk, wait in throttled.items():
+        delays.setdefault((math.ceil(wait), priorities[pk]), []).append(pk)
+    for (countdown, priority), pks in delays.items():
+        schedule_command_dispatch(pks, countdown=countdown, priority=priority)
+    logger.info(f"Throttled {len(throttled)} commands over their reader rate limits")
+
+def skip_commands(superseded, now=None):
+    """Mark commands SUPERSEDED in one UPDATE, recording which command replaced each"""
+    Command.objects.filter(id__in=superseded).update(
+        status='SUPERSEDED',
+        response=Case(*[
+            When(id=pk, then=Value(f"Superseded by {command_id}")) for pk, command_id in superseded.items()
+        ]),
+        updated_at=now or timezone.now(),
+    )
+    notify_commands_finished(superseded)
+    logger.info(f"Skipped {len(superseded)} commands superseded by newer ones")
+
+COMMAND_DEFERRED_RESPONSE = "Reader offline, waiting for it to reconnect"
+
+def defer_commands(pks, now=None):
+    """Park commands for disconnected readers until flush_deferred_commands"""
+    Command.objects.filter(id__in=pks).update(
+        status='DEFERRED', response=COMMAND_DEFERRED_RESPONSE, updated_at=now or timezone.now()
+    )
+    logger.info(f"Deferred {len(pks)} commands for offline readers")
+
+def get_deferral_cutoff(now):
+    """Deferred commands stored before this are dropped; None when COMMAND_DEFERRAL_TTL is 0"""
+    ttl = settings.COMMAND_DEFERRAL_TTL
+    return now - timezone.timedelta(seconds=ttl) if ttl else None
+
+def flush_deferred_commands(reader):
+    """
+    Put a reconnected reader's deferred commands back in the queue and hand
+    them to a dispatcher once committed. Commands that outlived
+    COMMAND_DEFERRAL_TTL are failed instead.
+
+    Returns:
+        number of commands re-queued
+    """
+    now = timezone.now()
+    deferred = Command.objects.filter(reader=reader, status='DEFERRED')
+    cutoff = get_deferral_cutoff(now)
+    if cutoff is not None:
+        expire_deferred_commands(deferred.filter(date_sent__lt=cutoff), now)
+        deferred = deferred.filter(date_sent__gte=cutoff)
+    with transaction.atomic():
+        lanes = {}
+        for pk, priority in deferred.select_for_update(skip_locked=True).values_list('id', 'priority'):
+            lanes.setdefault(priority, []).append(pk)
+        pks = [pk for lane in lanes.values() for pk in lane]
+        if pks:
+            Command.objects.filter(id__in=pks).update(status='PENDING', response=None, updated_at=now)
+            for priority, lane in lanes.items():
+                schedule_command_dispatch(lane, priority=priority)
+    if pks:
+        logger.info(f"Reader {reader.serial_number} reconnected, re-queued {len(pks)} deferred commands")
+    return len(pks)
+
+def expire_deferred_commands(queryset=None, now=None):
+    """Fail deferred commands older than COMMAND_DEFERRAL_TTL, in one UPDATE"""
+    now = now or timezone.now()
+    if queryset is None:
+        cutoff = get_deferral_cutoff(now)
+        if cutoff is None:
+            return 0
+        queryset = Command.objects.filter(status='DEFERRED', date_sent__lt=cutoff)
+    pks = list(queryset.values_list('id', flat=True))
+    if not pks:
+        return 0
+    count = Command.objects.filter(id__in=pks, status='DEFERRED').update(
+        status='FAILED', response="Reader stayed offline", updated_at=now
+    )
+    notify_commands_finished(pks)
+    if count:
+        logger.warning(f"{count} deferred commands expired while their readers were offline")
+    return count
+
+def set_commands_status(results):
+    """
+    Record dispatch outcomes with one UPDATE per distinct (status, response).
+    Commands no longer PROCESSING (failed by expire_stale_commands while
+    the publish was in flight) keep their status.
+
+    Args:
+        results: dict of command pk -> (status, response)
+    """
+    grouped = {}
+    for pk, outcome in results.items():
+        grouped.setdefault(outcome, []).append(pk)
+    now = timezone.now()
+    for (status, response), pks in grouped.items():
+        Command.objects.filter(id__in=pks, status='PROCESSING').update(status=status, response=response, updated_at=now)
+        if status not in ACTIVE_COMMAND_STATUSES:
+            notify_commands_finished(pks)
+
+COMMAND_TIMEOUT_RESPONSE = "Command processing timed out"
+DEFAULT_COMMAND_TIMEOUT = 30
+
+def get_command_timeout(command):
+    """Seconds a command may stay PROCESSING, from settings.COMMAND_TIMEOUTS"""
+    timeouts = getattr(settings, 'COMMAND_TIMEOUTS', {})
+    return timeouts.get(command, timeouts.get('default', DEFAULT_COMMAND_TIMEOUT))
+
+def expire_stale_commands():
+    """
+    Fail PROCESSING commands older than their deadline in settings.COMMAND_TIMEOUTS,
+    in one UPDATE. Covers commands claimed by the dispatcher (whose process
+    may have died mid-publish) and by clients of /api/commands/pending/.
+    """
+    now = timezone.now()
+    specific = [command for command in settings.COMMAND_TIMEOUTS if command != 'default']
+    overdue = Q(updated_at__lt=now - timezone.timedelta(seconds=get_command_timeout(None))) & ~Q(command__in=specific)
+    for command in specific:
+        overdue |= Q(command=command, updated_at__lt=now - timezone.timedelta(seconds=get_command_timeout(command)))
+    pks = list(Command.objects.filter(overdue, status='PROCESSING').values_list('id', flat=True))
+    if not pks:
+        return 0
+    # Re-checked in the UPDATE: a reply may have landed since the SELECT
+    count = Command.objects.filter(id__in=pks, status='PROCESSING').update(
+        status='FAILED', response=COMMAND_TIMEOUT_RESPONSE, updated_at=now
+    )
+    notify_commands_finished(pks)
+    if count:
+        logger.warning(f"{count} stale commands timed out and marked as failed")
+    return count
+
+def get_pending_commands(limit=COMMAND_CLAIM_BATCH_SIZE):
+    """
+    Claim a batch of pending commands and return them for publishing.
+    The caller publishes them, so their correlation is recorded here for
+    the replies.
+    """
+    commands = claim_pending_commands(limit)
+    remember_commands(
+        (command['command_id'], command['id'], command['reader__serial_number'], command['command'])
+        for command in commands
+    )
+    return [
+        {
+            'id': command['id'],
+            'command_id': command['command_id'],
+            'reader_id': command['reader_id'],
+            'reader_serial': command['reader__serial_number'],
+            'command': command['command'],
+            'details': command['details'],
+            'envelope': command['envelope'],
+            'date_sent': command['date_sent'].isoformat() if command['date_sent'] else None
         }
-        command_list.append(command_data)
-        command.status = 'PROCESSING'
-        command.save()
-        
-    return command_list
+        for command in commands
+    ]
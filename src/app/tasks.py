@@ -5,8 +5,15 @@ from django.utils import timezone
 import logging
 import threading
 from celery import shared_task
+from django.conf import settings
 from .models import Command, TaskExecution
-from .services import send_command_service
+from .services import (
+    send_command_service, publish_commands, claim_pending_commands, set_commands_status,
+    expire_stale_commands, expire_deferred_commands, defer_commands, sidecar_breaker,
+    ACTIVE_COMMAND_STATUSES,
+)
+from .completion import notify_commands_finished
+from .correlation import remember_commands
 from django.core.exceptions import ObjectDoesNotExist
 
 
@@ -24,64 +31,83 @@ logger = logging.getLogger(__name__)
 #             logger.setLevel(original_level)
 #     return wrapper
 
+def _publisher_down():
+    """While the sidecar circuit is open, leave commands PENDING instead of claiming them to fail"""
+    if sidecar_breaker.is_open:
+        logger.warning("Dapr publisher circuit is open, leaving pending commands for later")
+        return True
+    return False
+
+def send_claimed_commands(commands, window=1):
+    """
+    Publish commands returned by claim_pending_commands, at most `window`
+    readers' topics in flight (each topic's commands in claim order), and
+    record the results with one bulk write. Publishing
+    needs no database access, so worker threads never open connections.
+    """
+    # Record the rows before publishing; a reply can arrive right away
+    remember_commands(
+        (command['command_id'], command['id'], command['reader__serial_number'], command['command'])
+        for command in commands
+    )
+    outcomes = publish_commands(commands, window=window)
+
+    results = {command['id']: outcome for command, outcome in zip(commands, outcomes)}
+    set_commands_status(results)
+    return sum(1 for status, _message in outcomes if status == 'COMPLETED')
+
 @shared_task(bind=True, max_retries=3)
-def process_pending_commands(self):
-    """Process all pending commands and update their status"""
+def process_pending_commands(self, priority=None):
+    """
+    Claim pending commands batch by batch, send them and record the results.
+    Lanes are drained in COMMAND_PRIORITY_QUEUES order unless one is given.
+    """
     logger.info("Starting to process pending commands")
-    pending_commands = Command.objects.filter(status='PENDING')
     processed_count = 0
+    total_count = 0
     
-    for command in pending_commands:
-        logger.info(f"Processing command: {command.command_id} - {command.command}")
-        command.status = 'PROCESSING'
-        command.save()
-        
-        try:
-            success, message = send_command_service(
-                None, 
-                command.reader.id, 
-                command.command_id, 
-                command.command, 
-                command.details
-            )
-            
-            if success:
-                command.status = 'COMPLETED'
-                command.response = message
-                processed_count += 1
-                logger.info(f"Successfully processed command {command.command_id}")
-            else:
-                command.status = 'FAILED'
-                command.response = message
-                logger.error(f"Failed to process command {command.command_id}: {message}")
-                
-        except Exception as e:
-            logger.error(f"Error processing command {command.command_id}: {str(e)}")
-            command.status = 'FAILED'
-            command.response = f"Unexpected error: {str(e)}"
-            
-            # Retry the task if there's an exception
-            try:
-                self.retry(countdown=60)  # Retry after 1 minute
-            except self.MaxRetriesExceededError:
-                logger.error(f"Max retries exceeded for command {command.command_id}")
-                
-        finally:
-            command.updated_at = timezone.now()
-            command.save()
+    for lane in [priority] if priority else settings.COMMAND_PRIORITY_QUEUES:
+        while not _publisher_down():
+            commands = claim_pending_commands(priority=lane)
+            if not commands:
+                break
+            total_count += len(commands)
+            processed_count += send_claimed_commands(commands)
     
-    logger.info(f"Finished processing commands. Successfully processed: {processed_count}/{pending_commands.count()}")
+    logger.info(f"Finished processing commands. Successfully processed: {processed_count}/{total_count}")
+    return processed_count
+
+@shared_task
+def dispatch_commands(command_ids):
+    """
+    Send specific commands right after they were stored (see
+    schedule_command_dispatch). Commands already claimed by a poller are
+    skipped.
+    """
+    if _publisher_down():
+        return 0
+    commands = claim_pending_commands(limit=len(command_ids), command_ids=command_ids)
+    return send_claimed_commands(commands)
+
+@shared_task
+def dispatch_command_batch(batch_id, priority=None):
+    """
+    Publish a fan-out batch (see fan_out_command), or its commands in one
+    priority lane, with COMMAND_FANOUT_WINDOW publishes in flight
+    """
+    processed_count = 0
+    while not _publisher_down():
+        commands = claim_pending_commands(batch_id=batch_id, priority=priority)
+        if not commands:
+            break
+        processed_count += send_claimed_commands(commands, window=settings.COMMAND_FANOUT_WINDOW)
+    logger.info(f"Dispatched batch {batch_id}: {processed_count} commands sent")
     return processed_count
 
 @shared_task
 def cleanup_stale_commands():
-    timeout = timezone.now() - timezone.timedelta(seconds=30)
-    stale_commands = Command.objects.filter(status='PROCESSING', updated_at__lt=timeout)
-    for command in stale_commands:
-        command.status = 'FAILED'
-        command.response = "Command processing timed out"
-        command.save()
-        logger.warning(f"Command {command.id} timed out and marked as failed")
+    expire_deferred_commands()
+    return expire_stale_commands()
 
 @shared_task
 def process_and_cleanup_commands():
@@ -94,11 +120,17 @@ def process_command(command_id):
     #from .mqtt_client import client
     command = None
     try:
-        command = Command.objects.get(id=command_id)
+        command = Command.objects.select_related('reader').get(id=command_id)
+        if settings.COMMAND_DEFER_OFFLINE and not command.reader.is_connected:
+            defer_commands([command.pk])
+            command = None
+            return
         command.status = 'PROCESSING'
-        command.save()
+        command.save(update_fields=['status', 'updated_at'])
 
-        success, message = send_command_service(None, command.reader.id, command.command_id, command.command_type, command.details)
+        success, message = send_command_service(
+            None, command.reader_id, command.command_id, command.command_type, command=command
+        )
 
         if success:
             command.status = 'COMPLETED'
@@ -107,7 +139,7 @@ def process_command(command_id):
             command.status = 'FAILED'
             command.response = message
 
-        command.save()
+        command.save(update_fields=['status', 'response', 'updated_at'])
         logger.info(f"Command {command_id} processed with status: {command.status}")
     except ObjectDoesNotExist:
         logger.error(f"Command with id {command_id} not found")
@@ -116,18 +148,20 @@ def process_command(command_id):
         if command:
             command.status = 'FAILED'
             command.response = f"Error: {str(e)}"
-            command.save()
+            command.save(update_fields=['status', 'response', 'updated_at'])
     except Exception as e:
         logger.error(f"Error processing command {command_id}: {str(e)}")
         if command:
             command.status = 'FAILED'
             command.response = f"Unexpected error: {str(e)}"
-            command.save()
+            command.save(update_fields=['status', 'response', 'updated_at'])
     finally:
         if command and command.status == 'PROCESSING':
             command.status = 'FAILED'
             command.response = "Command processing interrupted unexpectedly"
-            command.save()
+            command.save(update_fields=['status', 'response', 'updated_at'])
+        if command and command.status not in ACTIVE_COMMAND_STATUSES:
+            notify_commands_finished([command.pk])
 
 @shared_task
 def execute_scheduled_commands_task():
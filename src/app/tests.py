@@ -1,3 +1,1246 @@
-from django.test import TestCase
+import json
+import os
+import time
+from threading import BoundedSemaphore, Timer
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.test import RequestFactory, TestCase, override_settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.renderers import JSONRenderer
+
+from app.breakers import CircuitBreaker
+from app.caching import get_list_version
+from app.completion import get_status_notifier
+from app.correlation import lookup_command
+from app.db_routers import ReadReplicaRouter, primary_pinned, replica_reads
+from app.envelopes import normalize_details
+from app.middleware import ReplicaPinMiddleware
+from app.ratelimit import LocalCommandLimiter, get_command_limiter, get_throttle_stats
+from app.reader_config import get_acknowledged_configs, plan_mode_update
+from app.scheduler import CommandScheduler, get_spread_offset, next_occurrence
+from app.models import APIKey, Command, Reader, ScheduledCommand, TagEvent, DetailedStatusEvent
+from app.serializers import TagEventSerializer
+from app.services import (
+    claim_pending_commands, get_command_batch_status, send_command_service, store_command, get_paginated_items, get_tag_event_list,
+    get_detailed_status_event_list, update_command_status, expire_stale_commands, expire_deferred_commands, dispatch_scheduled_commands,
+    flush_deferred_commands, update_reader_connection_status, handle_mode_command, sidecar_breaker,
+    get_command_statuses, wait_for_commands, update_reader_last_communication, set_commands_status,
+    get_pending_commands, parse_json_path, extract_json_path, build_json_containment,
+    filter_detailed_status_events_by_json, get_detailed_status_event_projection,
+)
+from app.tasks import dispatch_command_batch, dispatch_commands, process_command, process_pending_commands
+from dapr_integration.client import RETRY_STATUSES, DaprSidecarClient, get_sidecar_client
+from mqtt_service.metrics import IngestMeter
+
+
+def mock_publisher(fail=()):
+    """
+    Patch the Dapr publisher client. publish_many records the messages it
+    is given (as (topic, decoded message) in `.sent`) and fails those whose
+    command_id is in `fail`.
+    """
+    client = mock.Mock(sent=[])
+    def publish_many(pubsub_name, messages, window=None):
+        results = []
+        for topic, body in messages:
+            message = json.loads(body)
+            client.sent.append((topic, message))
+            results.append((False, 'HTTP 500') if message['command_id'] in fail else (True, None))
+        return results
+    client.publish_many.side_effect = publish_many
+    return mock.patch('app.services.get_publisher_client', return_value=client)
+
+
+def loaded_bytes(objects):
+    """Approximate the bytes pulled from the DB for already fetched model instances."""
+    total = 0
+    for obj in objects:
+        for name, value in obj.__dict__.items():
+            if name.startswith('_'):
+                continue
+            total += len(str(value))
+        if 'reader' in obj._state.fields_cache:
+            total += loaded_bytes([obj.reader])
+    return total
+
+
+class ListProjectionTestCase(TestCase):
+    PAGE_SIZE = 10
+    # Per row budget for the columns a list page renders; the JSON blobs
+    # stored with each status event are several KB on their own.
+    MAX_BYTES_PER_ROW = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='12345')
+        now = timezone.now()
+        big_payload = {'antennas': [{'port': port, 'data': 'x' * 500} for port in range(8)]}
+        for index in range(3):
+            reader = Reader.objects.create(serial_number=f'TEST00{index}', ip_address=f'192.168.1.{index}')
+            for row in range(10):
+                TagEvent.objects.create(
+                    reader=reader, reader_name='reader', mac_address='00:00:00:00:00:00',
+                    epc=f'EPC{index}{row}', first_seen_timestamp=now, antenna_port=1,
+                    antenna_zone='Zone1', peak_rssi=-50.0, tx_power=30.0, tag_data_key='key' * 40,
+                    tag_data_key_name='name' * 40, tag_data_serial='serial' * 40
+                )
+                DetailedStatusEvent.objects.create(
+                    reader=reader, event_type='status', component='reader', timestamp=now,
+                    mac_address='00:00:00:00:00:00', status='ok',
+                    details=big_payload, non_antenna_details={'blob': 'y' * 2000}
+                )
+
+    def setUp(self):
+        self.client.login(username='testuser', password='12345')
+
+    def assert_page_is_projected(self, queryset, heavy_columns):
+        with CaptureQueriesContext(connection) as queries:
+            page = get_paginated_items(queryset, 1, per_page=self.PAGE_SIZE)
+            rows = list(page)
+            serials = [row.reader.serial_number for row in rows]
+        # count() + one joined page query, regardless of how many readers are on the page
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(len(serials), self.PAGE_SIZE)
+        page_sql = queries[-1]['sql']
+        for column in heavy_columns:
+            self.assertNotIn(f'"{column}"', page_sql)
+        self.assertLessEqual(loaded_bytes(rows), self.MAX_BYTES_PER_ROW * self.PAGE_SIZE)
+
+    def test_tag_event_list_projection(self):
+        self.assert_page_is_projected(
+            get_tag_event_list('', 'reader__serial_number'),
+            ['tag_data_key', 'tag_data_key_name', 'tag_data_serial', 'tx_power', 'mac_address']
+        )
+
+    def test_detailed_status_event_list_projection(self):
+        self.assert_page_is_projected(
+            get_detailed_status_event_list('', '-timestamp'),
+            ['details', 'non_antenna_details', 'mac_address']
+        )
+
+    def test_list_views_query_count(self):
+        # session + user + count + page
+        for url in (reverse('tag_event_list'), reverse('detailed_status_event_list')):
+            with self.assertNumQueries(4):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+
+class JsonPathTestCase(TestCase):
+    GPI = {'gpiConfigurations': [{'gpi': 1, 'state': 'low'}, {'gpi': 2, 'state': 'high'}]}
+
+    @classmethod
+    def setUpTestData(cls):
+        reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1')
+        cls.event = DetailedStatusEvent.objects.create(
+            reader=reader, event_type='status', component='reader', timestamp=timezone.now(),
+            mac_address='00:00:00:00:00:00', status='ok', details={}, non_antenna_details=cls.GPI
+        )
+
+    def test_parse_json_path(self):
+        self.assertEqual(parse_json_path('gpiConfigurations[0].state'), ['gpiConfigurations', '0', 'state'])
+        self.assertEqual(parse_json_path('gpiConfigurations[*].state'), ['gpiConfigurations', '*', 'state'])
+        self.assertEqual(parse_json_path('matrix[1][].x'), ['matrix', '1', '*', 'x'])
+        self.assertEqual(parse_json_path(' .a..b '), ['a', 'b'])
+        self.assertEqual(parse_json_path(None), [])
+
+    def test_extract_json_path(self):
+        self.assertEqual(extract_json_path(self.GPI, ['gpiConfigurations', '1', 'state']), 'high')
+        self.assertEqual(extract_json_path(self.GPI, ['gpiConfigurations', '*', 'gpi']), [1, 2])
+        self.assertIsNone(extract_json_path(self.GPI, ['gpiConfigurations', '5', 'state']))
+        self.assertIsNone(extract_json_path(self.GPI, ['missing', '*']))
+
+    def test_build_json_containment(self):
+        self.assertEqual(
+            build_json_containment(['gpiConfigurations', '*', 'state'], 'high'),
+            {'gpiConfigurations': [{'state': 'high'}]}
+        )
+        # [{'state': 'high'}] would match the list at any position
+        with self.assertRaises(ValueError):
+            build_json_containment(['gpiConfigurations', '0', 'state'], 'high')
+
+    def test_indexed_path_filters_on_that_position(self):
+        events = DetailedStatusEvent.objects.all()
+        self.assertFalse(filter_detailed_status_events_by_json(events, 'gpiConfigurations[0].state', 'high').exists())
+        self.assertTrue(filter_detailed_status_events_by_json(events, 'gpiConfigurations[1].state', 'high').exists())
+        self.assertTrue(filter_detailed_status_events_by_json(events, 'gpiConfigurations[1].gpi', '2').exists())
+        with self.assertRaises(ValueError):
+            filter_detailed_status_events_by_json(events, 'gpiConfigurations[*].pins[0]', '1')
+
+    def test_projection(self):
+        self.assertEqual(
+            get_detailed_status_event_projection(self.event.pk, 'gpiConfigurations[1]'),
+            (True, {'gpi': 2, 'state': 'high'})
+        )
+        self.assertEqual(
+            get_detailed_status_event_projection(self.event.pk, 'gpiConfigurations[*].state'), (True, ['low', 'high'])
+        )
+        self.assertEqual(get_detailed_status_event_projection(self.event.pk, 'missing'), (False, None))
+
+
+class ListCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='12345')
+        cls.reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1')
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='testuser', password='12345')
+
+    def test_repeat_load_is_served_from_cache(self):
+        url = reverse('reader_list')
+        self.client.get(url)
+        # session + user only; rows, count and table come from the cache
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertContains(response, 'TEST001')
+
+    def test_save_invalidates_cached_list(self):
+        url = reverse('reader_list')
+        self.client.get(url)
+        self.reader.location = 'Dock 7'
+        self.reader.save()
+        self.assertContains(self.client.get(url), 'Dock 7')
+
+    def test_unrelated_field_does_not_invalidate_dependent_list(self):
+        version = get_list_version('scheduled_command_list')
+        self.reader.last_communication = timezone.now()
+        self.reader.save(update_fields=['last_communication'])
+        self.assertEqual(get_list_version('scheduled_command_list'), version)
+
+
+class APIKeyMixin:
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='apiuser', password='12345')
+        self.api_key = APIKey.objects.create(user=user).key
+        env = mock.patch.dict(os.environ, {'API_KEY': self.api_key})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def api_get(self, url, params=None, **headers):
+        return self.client.get(url, params or {}, HTTP_X_API_KEY=self.api_key, **headers)
+
+
+@mock.patch('app.db_routers.get_replica_aliases', return_value=['replica_1'])
+@mock.patch('app.middleware.get_replica_aliases', return_value=['replica_1'])
+class ReadReplicaTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ReadReplicaRouter()
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+
+    def read_db(self, request, authenticate=None):
+        """Database the router picks for a replica-enabled read made while serving `request`"""
+        def view(request):
+            if authenticate is not None:
+                request.user = authenticate  # as DRF does during the view
+            with replica_reads():
+                return self.router.db_for_read(Reader)
+        return ReplicaPinMiddleware(view)(request)
+
+    def request(self, method, user=None, **headers):
+        request = getattr(self.factory, method)('/api/commands/', **headers)
+        request.user = user or AnonymousUser()
+        return request
+
+    def test_router(self, *_patches):
+        self.assertEqual(self.router.db_for_read(Reader), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Reader), 'replica_1')
+            with primary_pinned():
+                self.assertEqual(self.router.db_for_read(Reader), 'default')
+        self.assertEqual(self.router.db_for_write(Reader), 'default')
+        self.assertFalse(self.router.allow_migrate('replica_1', 'app'))
+
+    def test_writes_pin_the_user_to_the_primary(self, *_patches):
+        self.assertEqual(self.read_db(self.request('get', self.user)), 'replica_1')
+        self.assertEqual(self.read_db(self.request('post', self.user)), 'default')
+        self.assertEqual(self.read_db(self.request('get', self.user)), 'default')
+        other = User.objects.create_user(username='other', password='12345')
+        self.assertEqual(self.read_db(self.request('get', other)), 'replica_1')
+        # a user only known once DRF authenticated the request in the view
+        self.read_db(self.request('post'), authenticate=other)
+        self.assertEqual(self.read_db(self.request('get', other)), 'default')
+
+    def test_api_key_writers_are_pinned(self, *_patches):
+        self.read_db(self.request('post', HTTP_X_API_KEY='secret'))
+        self.assertEqual(self.read_db(self.request('get', HTTP_X_API_KEY='secret')), 'default')
+        self.assertEqual(self.read_db(self.request('get', HTTP_X_API_KEY='other')), 'replica_1')
+
+    def test_pin_expires(self, *_patches):
+        with override_settings(REPLICA_PIN_SECONDS=0.01):
+            self.read_db(self.request('post', self.user))
+        time.sleep(0.05)
+        self.assertEqual(self.read_db(self.request('get', self.user)), 'replica_1')
+
+
+class TagEventApiFastPathTestCase(APIKeyMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        for index in range(3):
+            reader = Reader.objects.create(serial_number=f'TEST00{index}', ip_address=f'192.168.1.{index}')
+            for row in range(5):
+                TagEvent.objects.create(
+                    reader=reader, reader_name='reader', mac_address='00:00:00:00:00:00',
+                    epc=f'EPC{index}{row}', first_seen_timestamp=now, antenna_port=row,
+                    antenna_zone='Zöne', peak_rssi=-50.5, tx_power=30.0
+                )
+
+    def get(self, params):
+        return self.api_get(reverse('api-tag-event-list'), params)
+
+    def test_matches_serializer_output(self):
+        response = self.get({'page_size': 4, 'page': 2})
+        self.assertEqual(response.status_code, 200)
+        payload = json.loads(response.content)
+        expected = TagEventSerializer(TagEvent.objects.all()[4:8], many=True).data
+        self.assertEqual(payload['count'], 15)
+        self.assertIn('page=3', payload['next'])
+        self.assertEqual(payload['results'], json.loads(JSONRenderer().render(expected)))
+
+    def test_empty_page(self):
+        response = self.get({'epc': 'missing'})
+        self.assertEqual(json.loads(response.content), {'count': 0, 'next': None, 'previous': None, 'results': []})
+
+
+class ConditionalGetTestCase(APIKeyMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1')
+        cls.command = Command.objects.create(
+            command_id='cmd-1', command_type='start', reader=cls.reader, command='start'
+        )
+
+    def assert_revalidates(self, url):
+        response = self.api_get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.api_get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        return etag
+
+    def test_reader_views(self):
+        for url in (reverse('api-reader-list'), reverse('api-reader-detail', args=['TEST001'])):
+            etag = self.assert_revalidates(url)
+            self.reader.location = 'Dock 7'
+            self.reader.save()
+            response = self.api_get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'Dock 7')
+
+    def test_reader_etags_follow_updates_made_elsewhere(self):
+        # e.g. the MQTT service, which does not share this process's cache
+        for url in (reverse('api-reader-list'), reverse('api-reader-detail', args=['TEST001'])):
+            etag = self.assert_revalidates(url)
+            with mock.patch('app.api_views.get_list_version', return_value=1):
+                Reader.objects.filter(pk=self.reader.pk).update(
+                    is_connected=True, last_communication=timezone.now()
+                )
+                self.assertEqual(self.api_get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+            Reader.objects.filter(pk=self.reader.pk).update(is_connected=False, last_communication=None)
+
+    def test_command_detail(self):
+        url = reverse('command-detail', args=['cmd-1'])
+        etag = self.assert_revalidates(url)
+        response = self.api_get(url, HTTP_IF_MODIFIED_SINCE=self.api_get(url)['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        self.command.status = 'COMPLETED'
+        self.command.save()
+        response = self.api_get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'COMPLETED')
+
+
+class CommandClaimTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # one reader per command, so nothing is coalesced
+        readers = [
+            Reader.objects.create(serial_number=f'TEST00{index}', ip_address='192.168.1.1', is_connected=True)
+            for index in range(9)
+        ]
+        for index in range(9):
+            Command.objects.create(command_id=f'cmd-{index}', reader=readers[index], command='start')
+
+    def test_claims_are_disjoint_and_in_order(self):
+        # savepoint, locked select, newer pending lookup, update, release
+        with self.assertNumQueries(5):
+            first = claim_pending_commands(limit=5)
+        second = claim_pending_commands(limit=5)
+        self.assertEqual([row['command_id'] for row in first], [f'cmd-{index}' for index in range(5)])
+        self.assertEqual(len(second), 4)
+        self.assertFalse({row['id'] for row in first} & {row['id'] for row in second})
+        self.assertEqual(first[1]['reader__serial_number'], 'TEST001')
+        self.assertEqual(claim_pending_commands(), [])
+        self.assertEqual(Command.objects.filter(status='PROCESSING').count(), 9)
+
+    def test_process_pending_commands_records_results(self):
+        with mock_publisher(fail={'cmd-4'}):
+            self.assertEqual(process_pending_commands(), 8)
+        self.assertEqual(Command.objects.filter(status='COMPLETED', response='Command sent successfully.').count(), 8)
+        self.assertEqual(Command.objects.get(command_id='cmd-4').status, 'FAILED')
+
+    def test_stored_command_is_dispatched_on_commit(self):
+        reader = Reader.objects.get(serial_number='TEST000')
+        with mock.patch('app.tasks.dispatch_commands.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                command = store_command(reader, 'stop')
+                apply_async.assert_not_called()
+        apply_async.assert_called_once_with(args=[[command.pk]], queue='high_priority', retry=False)
+
+        with mock_publisher():
+            self.assertEqual(dispatch_commands([command.pk]), 1)
+            # already claimed, e.g. by a poller
+            self.assertEqual(dispatch_commands([command.pk]), 0)
+        self.assertEqual(Command.objects.get(pk=command.pk).status, 'COMPLETED')
+
+
+class CommandCoalescingTestCase(TestCase):
+    def setUp(self):
+        self.reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1', is_connected=True)
+        self.other = Reader.objects.create(serial_number='TEST002', ip_address='192.168.1.2', is_connected=True)
+
+    def _store(self, command, reader=None, details=None):
+        return Command.objects.create(
+            command_id=f'cmd-{Command.objects.count()}', reader=reader or self.reader, command=command, details=details
+        ).command_id
+
+    def test_redundant_commands_are_superseded(self):
+        self._store('status-detailed')
+        self._store('start')
+        self._store('mode', details='{"a": 1}')
+        self._store('status-detailed')
+        self._store('stop')
+        last_mode = self._store('mode', details='{"a": 2}')
+        self._store('start', reader=self.other)
+        claimed = claim_pending_commands()
+        self.assertEqual(
+            [(row['command_id'], row['command']) for row in claimed],
+            [('cmd-3', 'status-detailed'), ('cmd-4', 'stop'), (last_mode, 'mode'), ('cmd-6', 'start')]
+        )
+        self.assertEqual(
+            dict(Command.objects.filter(status='SUPERSEDED').values_list('command_id', 'response')),
+            {'cmd-0': 'Superseded by cmd-3', 'cmd-1': 'Superseded by cmd-4', 'cmd-2': f'Superseded by {last_mode}'}
+        )
+
+    def test_older_command_is_skipped_when_claimed_alone(self):
+        first = Command.objects.get(command_id=self._store('start'))
+        self._store('stop')
+        self.assertEqual(claim_pending_commands(command_ids=[first.pk]), [])
+        self.assertEqual(Command.objects.get(pk=first.pk).status, 'SUPERSEDED')
+        self.assertEqual([row['command'] for row in claim_pending_commands()], ['stop'])
+
+    def test_older_command_claimed_after_the_newer_one_was_sent(self):
+        # e.g. the start was throttled while the stop went out
+        first = Command.objects.get(command_id=self._store('start'))
+        second = Command.objects.get(command_id=self._store('stop'))
+        self.assertEqual([row['command'] for row in claim_pending_commands(command_ids=[second.pk])], ['stop'])
+        Command.objects.filter(pk=second.pk).update(status='COMPLETED')
+        self.assertEqual(claim_pending_commands(command_ids=[first.pk]), [])
+        self.assertEqual(
+            Command.objects.filter(pk=first.pk).values_list('status', 'response').get(),
+            ('SUPERSEDED', f'Superseded by {second.command_id}')
+        )
+
+
+class OfflineDeferralTestCase(TestCase):
+    def setUp(self):
+        self.reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1', is_connected=False)
+        self.online = Reader.objects.create(serial_number='TEST002', ip_address='192.168.1.2', is_connected=True)
+        self.offline_command = Command.objects.create(command_id='cmd-1', reader=self.reader, command='start')
+        Command.objects.create(command_id='cmd-2', reader=self.online, command='start')
+
+    def test_commands_for_offline_readers_wait_for_reconnect(self):
+        self.assertEqual([row['command_id'] for row in claim_pending_commands()], ['cmd-2'])
+        self.assertEqual(Command.objects.get(pk=self.offline_command.pk).status, 'DEFERRED')
+
+        with mock.patch('app.tasks.dispatch_commands.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                update_reader_connection_status(Reader.objects.get(pk=self.reader.pk), True)
+        apply_async.assert_called_once_with(args=[[self.offline_command.pk]], queue='high_priority', retry=False)
+        self.assertEqual([row['command_id'] for row in claim_pending_commands()], ['cmd-1'])
+
+    def test_any_inbound_message_brings_a_default_reader_online(self):
+        # e.g. created in the UI while it was already streaming tag events
+        reader = Reader.objects.create(serial_number='TEST003', ip_address='192.168.1.3')
+        command = Command.objects.create(command_id='cmd-3', reader=reader, command='stop')
+        claim_pending_commands(command_ids=[command.pk])
+        self.assertEqual(Command.objects.get(pk=command.pk).status, 'DEFERRED')
+
+        with mock.patch('app.tasks.dispatch_commands.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                update_reader_last_communication('TEST003')
+        self.assertTrue(Reader.objects.get(pk=reader.pk).is_connected)
+        apply_async.assert_called_once_with(args=[[command.pk]], queue='high_priority', retry=False)
+        self.assertEqual([row['command_id'] for row in claim_pending_commands(command_ids=[command.pk])], ['cmd-3'])
+
+        # a last will is not a sign of life
+        Reader.objects.filter(pk=reader.pk).update(is_connected=False)
+        update_reader_last_communication('TEST003', mark_connected=False)
+        self.assertFalse(Reader.objects.get(pk=reader.pk).is_connected)
+
+    def test_deferred_commands_expire_after_ttl(self):
+        claim_pending_commands()
+        Command.objects.filter(pk=self.offline_command.pk).update(
+            date_sent=timezone.now() - timezone.timedelta(seconds=settings.COMMAND_DEFERRAL_TTL + 1)
+        )
+        self.assertEqual(flush_deferred_commands(self.reader), 0)
+        command = Command.objects.get(pk=self.offline_command.pk)
+        self.assertEqual((command.status, command.response), ('FAILED', 'Reader stayed offline'))
+
+
+@override_settings(
+    COMMAND_RATE_LIMIT_ENABLED=True,
+    COMMAND_RATE_LIMITS={'reader': (100.0, 3), 'default': (100.0, 3), 'mode': (0.5, 1)},
+)
+class CommandRateLimitTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1', is_connected=True)
+        self.limiter = LocalCommandLimiter()
+        patcher = mock.patch('app.ratelimit.get_command_limiter', return_value=self.limiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_buckets_limit_per_reader_and_per_command(self):
+        waits = self.limiter.acquire_many([(1, 'mode'), (1, 'mode'), (1, 'start'), (1, 'stop'), (2, 'mode')])
+        self.assertEqual(waits[0], 0)
+        self.assertAlmostEqual(waits[1], 2.0, places=2)  # one mode token every 2 s
+        self.assertEqual(waits[2:4], [0, 0])
+        self.assertEqual(waits[4], 0)  # another reader has its own buckets
+        self.assertGreater(self.limiter.acquire_many([(1, 'start')])[0], 0)  # reader burst of 3 used up
+        self.assertEqual(self.limiter.get_stats(), {'allowed': 4, 'throttled': 2, 'throttled:mode': 1, 'throttled:start': 1})
+
+    def test_stats_are_read_from_the_cache(self):
+        self.limiter.acquire_many([(1, 'mode'), (1, 'mode')])
+        # e.g. the MQTT service, which never dispatches itself
+        with mock.patch('app.ratelimit.get_command_limiter', return_value=LocalCommandLimiter()):
+            self.assertEqual(
+                get_throttle_stats(),
+                {'shared_limits': False, 'counts': {'allowed': 1, 'throttled': 1, 'throttled:mode': 1}}
+            )
+
+    def test_local_fallback_is_logged(self):
+        with mock.patch('app.ratelimit._limiter', None), self.assertLogs('app.ratelimit', 'WARNING') as logs:
+            self.assertIsInstance(get_command_limiter(), LocalCommandLimiter)
+        self.assertIn('only hold within this process', logs.output[0])
+
+    def test_throttled_commands_stay_pending_and_are_retried(self):
+        first = Command.objects.create(command_id='cmd-1', reader=self.reader, command='mode', details='{"a": 1}')
+        other = Reader.objects.create(serial_number='TEST002', ip_address='192.168.1.2', is_connected=True)
+        Command.objects.create(command_id='cmd-2', reader=other, command='mode')
+        self.limiter.acquire_many([(self.reader.pk, 'mode')])
+
+        with mock.patch('app.tasks.dispatch_commands.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                claimed = claim_pending_commands()
+        self.assertEqual([row['command_id'] for row in claimed], ['cmd-2'])
+        self.assertEqual(Command.objects.get(pk=first.pk).status, 'PENDING')
+        apply_async.assert_called_once_with(args=[[first.pk]], queue='high_priority', retry=False, countdown=2)
+
+        # held back until its token is due instead of being throttled on every claim
+        with mock.patch('app.tasks.dispatch_commands.apply_async') as apply_async:
+            self.assertEqual(claim_pending_commands(), [])
+        apply_async.assert_not_called()
+        self.assertEqual(self.limiter.get_stats()['throttled'], 1)
+        self.assertGreater(Command.objects.get(pk=first.pk).not_before, timezone.now())
+        # once it is due, the refilled bucket lets it through
+        Command.objects.filter(pk=first.pk).update(not_before=timezone.now())
+        with mock.patch('app.ratelimit.get_command_limiter', return_value=LocalCommandLimiter()):
+            self.assertEqual([row['command_id'] for row in claim_pending_commands()], ['cmd-1'])
+
+    def test_throttled_head_does_not_stop_the_lane(self):
+        for index in range(2):
+            Command.objects.create(command_id=f'mode-{index}', reader=self.reader, command='mode')
+        other = Reader.objects.create(serial_number='TEST002', ip_address='192.168.1.2', is_connected=True)
+        Command.objects.create(command_id='start', reader=other, command='start')
+        self.limiter.acquire_many([(self.reader.pk, 'mode')])
+        with mock.patch('app.tasks.dispatch_commands.apply_async'):
+            # mode-0 is superseded and mode-1 throttled: the next rows are still claimed
+            self.assertEqual([row['command_id'] for row in claim_pending_commands(limit=2)], ['start'])
+
+
+class CommandPriorityTestCase(APIKeyMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1', is_connected=True)
+
+    def test_command_type_picks_the_lane_and_the_api_can_override_it(self):
+        with mock.patch('app.tasks.dispatch_commands.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                poll = store_command(self.reader, 'status-detailed')
+                response = self.client.post(
+                    reverse('api-command-create'),
+                    {'reader_serial_number': 'TEST001', 'command_type': 'status-detailed', 'priority': 'high'},
+                    content_type='application/json', HTTP_X_API_KEY=self.api_key
+                )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(poll.priority, 'low')
+        self.assertEqual([call.kwargs['queue'] for call in apply_async.call_args_list], ['low_priority', 'high_priority'])
+
+    def test_poller_drains_the_high_lane_first(self):
+        for index in range(3):
+            Command.objects.create(command_id=f'poll-{index}', reader=self.reader, command='status-detailed', priority='low')
+        Command.objects.create(command_id='stop', reader=self.reader, command='stop', priority='high')
+        with mock_publisher() as get_client:
+            process_pending_commands()
+        # the polls coalesce into the newest one
+        self.assertEqual([message['command_id'] for _topic, message in get_client.return_value.sent], ['stop', 'poll-2'])
+
+
+class CommandCorrelationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1', is_connected=True)
+        self.command = Command.objects.create(command_id='cmd-1', reader=reader, command='start')
+
+    def test_dispatched_command_reply_is_a_single_update(self):
+        with mock_publisher():
+            dispatch_commands([self.command.pk])
+        with self.assertNumQueries(1):
+            update_command_status('cmd-1', 'TEST001', 'start', 'COMPLETED', 'ok')
+        self.assertEqual(Command.objects.get(pk=self.command.pk).response, 'ok')
+        # the entry is dropped once the reply is applied
+        self.assertIsNone(lookup_command('cmd-1'))
+
+    def test_pending_api_claims_are_correlated(self):
+        commands = get_pending_commands()
+        self.assertEqual(commands[0]['envelope'], self.command.envelope)
+        self.assertEqual(lookup_command('cmd-1'), (self.command.pk, 'TEST001', 'start'))
+        command = commands[0]
+        with mock.patch('app.services.get_publisher_client') as get_client:
+            get_client.return_value.publish.return_value = mock.Mock(ok=True, status_code=204)
+            send_command_service(
+                None, command['reader_id'], command['command_id'], command['command'], command['details'],
+                envelope=command['envelope']
+            )
+        self.assertEqual(get_client.return_value.publish.call_args.args[2], self.command.envelope.encode())
+        with self.assertNumQueries(1):
+            update_command_status('cmd-1', 'TEST001', 'start', 'COMPLETED', 'ok')
+
+    def test_unknown_command_falls_back_to_lookup(self):
+        update_command_status('cmd-1', 'TEST001', 'start', 'FAILED', 'error')
+        command = Command.objects.get(pk=self.command.pk)
+        self.assertEqual((command.status, command.response), ('FAILED', 'error'))
+
+
+MODE_DATA = {
+    'type': 'INVENTORY', 'antennas': [1, 2], 'antennaZone': 'A', 'antennaZoneState': 'enabled',
+    'transmitPower': 30, 'groupIntervalInMs': 500, 'rfMode': 'MaxThroughput', 'searchMode': 'DualTarget',
+    'session': 1, 'tagPopulation': 16,
+}
+
+
+class ModeDriftTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1', is_connected=True)
+
+    def acknowledge(self, command, status='COMPLETED'):
+        update_command_status(command.command_id, self.reader.serial_number, 'mode', status, '{}')
+
+    def test_plan_mode_update(self):
+        desired = {'type': 'INVENTORY', 'transmitPower': 30, 'session': 1}
+        self.assertEqual(plan_mode_update(None, desired), desired)
+        self.assertIsNone(plan_mode_update(desired, dict(desired)))
+        self.assertEqual(plan_mode_update({**desired, 'transmitPower': 20}, desired), {'type': 'INVENTORY', 'transmitPower': 30})
+        # A setting that has to be cleared needs the whole configuration
+        self.assertEqual(plan_mode_update({**desired, 'tagPopulation': 16}, desired), desired)
+        with override_settings(MODE_DRIFT_ONLY=False):
+            self.assertEqual(plan_mode_update({**desired, 'transmitPower': 20}, desired), desired)
+            self.assertEqual(plan_mode_update(desired, dict(desired)), desired)
+
+    def test_only_drift_is_sent_after_an_acknowledged_mode(self):
+        first = handle_mode_command(self.reader, MODE_DATA)
+        self.assertEqual(json.loads(first.details)['transmitPower'], 30)
+        self.acknowledge(first)
+
+        self.assertIsNone(handle_mode_command(self.reader, MODE_DATA))
+        second = handle_mode_command(self.reader, {**MODE_DATA, 'transmitPower': 25})
+        self.assertEqual(json.loads(second.details), {'type': 'INVENTORY', 'transmitPower': 25})
+        self.assertEqual(Command.objects.filter(command='mode').count(), 2)
+
+    def test_failed_mode_forgets_the_configuration(self):
+        first = handle_mode_command(self.reader, MODE_DATA)
+        self.acknowledge(first)
+        second = handle_mode_command(self.reader, {**MODE_DATA, 'transmitPower': 25})
+        self.acknowledge(second, status='FAILED')
+        # The reader's state is unknown again, so the full configuration goes out
+        third = handle_mode_command(self.reader, MODE_DATA)
+        self.assertEqual(json.loads(third.details)['antennas'], [1, 2])
+
+    def test_full_configuration_is_sent_while_a_mode_is_in_flight(self):
+        self.acknowledge(handle_mode_command(self.reader, MODE_DATA))
+        changed = {**MODE_DATA, 'transmitPower': 25}
+        in_flight = handle_mode_command(self.reader, changed)
+        self.assertEqual(json.loads(in_flight.details), {'type': 'INVENTORY', 'transmitPower': 25})
+        reverted = {**MODE_DATA, 'session': 2}
+        latest = handle_mode_command(self.reader, reverted)
+        self.assertEqual(json.loads(latest.details)['transmitPower'], 30)
+        # the older reply does not make the reader's state known while the newer one is out
+        self.acknowledge(in_flight)
+        self.assertIsNotNone(handle_mode_command(self.reader, reverted))
+
+    def test_superseded_mode_forgets_the_configuration(self):
+        self.acknowledge(handle_mode_command(self.reader, MODE_DATA))
+        cache.delete(f'reader-config:in-flight:{self.reader.serial_number}')
+        with mock.patch('app.services.schedule_command_dispatch'):
+            handle_mode_command(self.reader, {**MODE_DATA, 'transmitPower': 25})
+            cache.delete(f'reader-config:in-flight:{self.reader.serial_number}')
+            handle_mode_command(self.reader, {**MODE_DATA, 'transmitPower': 20})
+        self.assertEqual(len(claim_pending_commands()), 1)
+        self.assertEqual(get_acknowledged_configs([self.reader.serial_number]), {})
+
+    def test_configuration_is_resent_when_forced_or_after_a_reconnect(self):
+        self.acknowledge(handle_mode_command(self.reader, MODE_DATA))
+        forced = handle_mode_command(self.reader, MODE_DATA, force=True)
+        self.assertEqual(json.loads(forced.details)['antennas'], [1, 2])
+        self.acknowledge(forced)
+        # the reader may come back with another configuration
+        update_reader_connection_status(self.reader, False)
+        update_reader_connection_status(self.reader, True)
+        self.assertIsNotNone(handle_mode_command(self.reader, MODE_DATA))
+
+
+class CommandTimeoutTestCase(TestCase):
+    def setUp(self):
+        self.reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1')
+
+    def _processing(self, command, age):
+        command = Command.objects.create(command_id=f'cmd-{command}-{age}', reader=self.reader, command=command)
+        Command.objects.filter(pk=command.pk).update(
+            status='PROCESSING', updated_at=timezone.now() - timezone.timedelta(seconds=age)
+        )
+        return command.pk
+
+    def test_dispatch_outcome_does_not_overwrite_a_timeout(self):
+        timed_out, in_flight = self._processing('start', 40), self._processing('start', 0)
+        expire_stale_commands()
+        set_commands_status({pk: ('COMPLETED', 'sent') for pk in (timed_out, in_flight)})
+        self.assertEqual(Command.objects.get(pk=timed_out).status, 'FAILED')
+        self.assertEqual(Command.objects.get(pk=in_flight).status, 'COMPLETED')
+
+    @mock.patch.dict('django.conf.settings.COMMAND_TIMEOUTS', {'default': 30, 'status-detailed': 10, 'mode': 900})
+    def test_stale_sweep_uses_per_command_deadlines(self):
+        expired = [self._processing('start', 40), self._processing('status-detailed', 15)]
+        kept = [self._processing('start', 20), self._processing('mode', 600)]
+        with self.assertNumQueries(2):
+            self.assertEqual(expire_stale_commands(), 2)
+        self.assertEqual(
+            set(Command.objects.filter(status='FAILED').values_list('id', flat=True)), set(expired)
+        )
+        self.assertEqual(Command.objects.filter(id__in=kept, status='PROCESSING').count(), 2)
+
+
+class ScheduledCommandSchedulerTestCase(TestCase):
+    def setUp(self):
+        self.reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1')
+        self.now = timezone.now().replace(microsecond=0)
+
+    def _schedule(self, seconds, recurrence='ONCE'):
+        return ScheduledCommand.objects.create(
+            reader=self.reader, command_type='start', recurrence=recurrence,
+            scheduled_time=self.now + timezone.timedelta(seconds=seconds)
+        )
+
+    def test_next_occurrence_is_calendar_correct(self):
+        utc = timezone.utc
+        jan_31 = timezone.datetime(2025, 1, 31, 8, tzinfo=utc)
+        self.assertEqual(next_occurrence(jan_31, 'MONTHLY', jan_31), timezone.datetime(2025, 2, 28, 8, tzinfo=utc))
+        self.assertEqual(
+            next_occurrence(jan_31.replace(year=2024), 'MONTHLY', jan_31.replace(year=2024)),
+            timezone.datetime(2024, 2, 29, 8, tzinfo=utc)
+        )
+        self.assertEqual(
+            next_occurrence(jan_31, 'MONTHLY', timezone.datetime(2025, 6, 1, tzinfo=utc)),
+            timezone.datetime(2025, 6, 30, 8, tzinfo=utc)
+        )
+        # missed runs are skipped, not replayed
+        self.assertEqual(
+            next_occurrence(jan_31, 'DAILY', timezone.datetime(2025, 3, 10, 9, tzinfo=utc)),
+            timezone.datetime(2025, 3, 11, 8, tzinfo=utc)
+        )
+        self.assertIsNone(next_occurrence(jan_31, 'ONCE', jan_31))
+
+    def test_monthly_schedule_keeps_its_day_after_a_short_month(self):
+        utc = timezone.utc
+        jan_31 = timezone.datetime(2025, 1, 31, 8, tzinfo=utc)
+        schedule = ScheduledCommand.objects.create(
+            reader=self.reader, command_type='start', recurrence='MONTHLY', scheduled_time=jan_31
+        )
+        fired = []
+        for now in (jan_31, timezone.datetime(2025, 2, 28, 8, tzinfo=utc)):
+            dispatch_scheduled_commands(now)
+            schedule.refresh_from_db()
+            fired.append(schedule.scheduled_time)
+        # Feb 28 is a clamped run: March goes back to the 31st
+        self.assertEqual(fired, [timezone.datetime(2025, 2, 28, 8, tzinfo=utc), timezone.datetime(2025, 3, 31, 8, tzinfo=utc)])
+        self.assertEqual(schedule.day_of_month, 31)
+        self.assertEqual(
+            next_occurrence(fired[0], 'MONTHLY', fired[0], day_of_month=31), timezone.datetime(2025, 3, 31, 8, tzinfo=utc)
+        )
+
+    def test_due_schedules_are_dispatched_in_bulk(self):
+        once, daily = self._schedule(-5), self._schedule(-5, 'DAILY')
+        later = self._schedule(60)
+        fired = dispatch_scheduled_commands(self.now)
+        self.assertEqual({pk for pk, _time, _active in fired}, {once.pk, daily.pk})
+        self.assertEqual(Command.objects.filter(command='start', status='PENDING').count(), 2)
+        self.assertFalse(ScheduledCommand.objects.get(pk=once.pk).is_active)
+        self.assertEqual(
+            ScheduledCommand.objects.get(pk=daily.pk).scheduled_time,
+            daily.scheduled_time + timezone.timedelta(days=1)
+        )
+        self.assertIsNone(ScheduledCommand.objects.get(pk=later.pk).last_run)
+        self.assertEqual(dispatch_scheduled_commands(self.now), [])
+
+    @override_settings(SCHEDULED_COMMAND_SPREAD={'status-detailed': 300})
+    def test_fleet_polls_are_spread_per_reader(self):
+        offsets = [get_spread_offset(reader_id, 'status-detailed') for reader_id in range(200)]
+        self.assertEqual(offsets, [get_spread_offset(reader_id, 'status-detailed') for reader_id in range(200)])
+        self.assertTrue(all(timezone.timedelta(0) <= offset < timezone.timedelta(seconds=300) for offset in offsets))
+        # spread over the window rather than bunched at its start
+        self.assertGreater(len({int(offset.total_seconds()) // 60 for offset in offsets}), 4)
+        self.assertEqual(get_spread_offset(1, 'stop'), timezone.timedelta(0))
+
+        poll = ScheduledCommand.objects.create(
+            reader=self.reader, command_type='status-detailed', recurrence='DAILY', scheduled_time=self.now
+        )
+        offset = get_spread_offset(self.reader.pk, 'status-detailed')
+        self.assertEqual(dispatch_scheduled_commands(self.now + offset - timezone.timedelta(seconds=1)), [])
+        fired = dispatch_scheduled_commands(self.now + offset)
+        self.assertEqual(fired, [(poll.pk, self.now + timezone.timedelta(days=1) + offset, True)])
+
+    def test_scheduler_fires_from_heap_and_follows_edits(self):
+        scheduler = CommandScheduler(horizon=600, poll_interval=5)
+        first, second = self._schedule(1), self._schedule(2)
+        scheduler.load(self.now)
+        self.assertEqual(scheduler.next_due(), first.scheduled_time)
+        self.assertEqual(scheduler.seconds_until_next(self.now), 1)
+
+        # an edit in this process reaches the scheduler through post_save
+        with mock.patch('app.scheduler.command_scheduler', scheduler):
+            first.scheduled_time = self.now + timezone.timedelta(seconds=30)
+            first.save()
+        self.assertEqual(scheduler.next_due(), second.scheduled_time)
+
+        with mock.patch('app.scheduler.get_list_version', return_value=scheduler._version):
+            self.assertEqual(scheduler.run_once(self.now + timezone.timedelta(seconds=2)), 1)
+        self.assertEqual(Command.objects.count(), 1)
+        self.assertEqual(scheduler.next_due(), first.scheduled_time)
+
+    def test_scheduler_follows_edits_from_other_processes(self):
+        scheduler = CommandScheduler(horizon=600, poll_interval=5)
+        schedule = self._schedule(300)
+        scheduler.load(self.now)
+        # saved elsewhere: no signal here, and a cache that is not shared
+        ScheduledCommand.objects.filter(pk=schedule.pk).update(
+            scheduled_time=self.now + timezone.timedelta(seconds=1), updated_at=timezone.now()
+        )
+        with mock.patch('app.scheduler.get_list_version', return_value=scheduler._version):
+            self.assertEqual(scheduler.run_once(self.now), 0)
+            self.assertEqual(scheduler.next_due(), self.now + timezone.timedelta(seconds=1))
+            self.assertEqual(scheduler.run_once(self.now + timezone.timedelta(seconds=1)), 1)
+
+
+class DaprSidecarClientTestCase(TestCase):
+    def test_publish_reuses_pooled_session_with_timeout(self):
+        client = get_sidecar_client('sidecar', 3501)
+        self.assertIs(get_sidecar_client('sidecar', '3501'), client)
+        with mock.patch.object(client.session, 'request', return_value=mock.Mock(ok=True, status_code=204)) as request:
+            client.publish('mqtt-pubsub', 'smartreader/TEST001/control', {'command': 'stop'})
+        request.assert_called_once_with(
+            'POST', 'http://sidecar:3501/v1.0/publish/mqtt-pubsub/smartreader/TEST001/control',
+            timeout=client.timeout, json={'command': 'stop'}
+        )
+        adapter = client.session.get_adapter('http://sidecar:3501')
+        self.assertEqual(adapter.max_retries.status_forcelist, RETRY_STATUSES)
+
+    def test_publish_many_bulk_publishes_per_topic(self):
+        client = DaprSidecarClient('sidecar', 3501)
+        partial = mock.Mock(ok=False, status_code=500)
+        partial.json.return_value = {'failedEntries': [{'entryId': '1', 'error': 'broker refused'}]}
+        responses = {
+            'http://sidecar:3501/v1.0-alpha1/publish/bulk/mqtt-pubsub/smartreader/A/control': partial,
+            'http://sidecar:3501/v1.0/publish/mqtt-pubsub/smartreader/B/control': mock.Mock(ok=True, status_code=204),
+        }
+        messages = [
+            ('smartreader/A/control', b'{"command_id": "1"}'),
+            ('smartreader/B/control', {'command_id': '2'}),
+            ('smartreader/A/control', b'{"command_id": "3"}'),
+        ]
+        with mock.patch.object(client.session, 'request', side_effect=lambda method, url, **kwargs: responses[url]) as request:
+            results = client.publish_many('mqtt-pubsub', messages, window=1, ordered=False)
+        self.assertEqual(results, [(True, None), (True, None), (False, 'broker refused')])
+        self.assertEqual(request.call_count, 2)
+        bulk_body = json.loads(request.call_args_list[0].kwargs['data'])
+        self.assertEqual([entry['event'] for entry in bulk_body], [{'command_id': '1'}, {'command_id': '3'}])
+
+    def test_publish_many_falls_back_without_bulk_api(self):
+        client = DaprSidecarClient('sidecar', 3501)
+        def respond(method, url, **kwargs):
+            return mock.Mock(ok=False, status_code=404) if '/bulk/' in url else mock.Mock(ok=True, status_code=204)
+        messages = [('smartreader/A/control', {'n': n}) for n in range(3)]
+        with mock.patch.object(client.session, 'request', side_effect=respond) as request:
+            self.assertEqual(client.publish_many('mqtt-pubsub', messages, ordered=False), [(True, None)] * 3)
+            self.assertFalse(client.bulk_supported)
+            client.publish_many('mqtt-pubsub', messages, ordered=False)
+        # one rejected bulk request, then single publishes only
+        self.assertEqual(request.call_count, 7)
+
+    def test_bulk_stays_enabled_when_the_pubsub_is_missing(self):
+        client = DaprSidecarClient('sidecar', 3501)
+        messages = [('smartreader/A/control', {'n': n}) for n in range(2)]
+        with mock.patch.object(client.session, 'request', return_value=mock.Mock(ok=False, status_code=404)):
+            self.assertEqual(client.publish_many('mqtt-pubsub', messages, ordered=False), [(False, 'HTTP 404')] * 2)
+        self.assertIsNone(client.bulk_supported)
+
+    def test_publish_many_keeps_order_within_a_topic(self):
+        client = DaprSidecarClient('sidecar', 3501)
+        sent = []
+        def respond(method, url, **kwargs):
+            if url.endswith('/A/control'):
+                time.sleep(0.01)  # the first of A's messages is slow
+            sent.append(kwargs['json']['n'])
+            return mock.Mock(ok=True, status_code=204)
+        messages = [('smartreader/A/control', {'n': 0}), ('smartreader/A/control', {'n': 1}),
+                    ('smartreader/B/control', {'n': 2})]
+        with mock.patch.object(client.session, 'request', side_effect=respond) as request:
+            self.assertEqual(client.publish_many('mqtt-pubsub', messages, window=4), [(True, None)] * 3)
+        self.assertNotIn('/bulk/', ' '.join(call.args[1] for call in request.call_args_list))
+        self.assertLess(sent.index(0), sent.index(1))
+        # other topics do not wait for A
+        self.assertEqual(sent[0], 2)
+
+    def test_send_command_service_publishes_through_client(self):
+        reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1')
+        response = mock.Mock(ok=True, status_code=204)
+        with mock.patch('app.services.get_publisher_client') as get_client:
+            get_client.return_value.publish.return_value = response
+            success, _message = send_command_service(None, reader.id, 'cmd-1', 'stop')
+        self.assertTrue(success)
+        (pubsub, topic, body), _kwargs = get_client.return_value.publish.call_args
+        self.assertEqual((pubsub, topic), ('mqtt-pubsub', 'smartreader/TEST001/control'))
+        self.assertEqual(json.loads(body), {'command': 'stop', 'command_id': 'cmd-1', 'payload': {}})
+
+    def test_stored_command_publishes_its_prerendered_envelope(self):
+        reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1')
+        # A Python dict repr, as older callers stored it, is normalised to JSON once
+        command = Command.objects.create(command_id='cmd-1', reader=reader, command='mode', details="{'session': 1}")
+        self.assertEqual(command.details, '{"session": 1}')
+        self.assertEqual(
+            json.loads(command.envelope), {'command': 'mode', 'command_id': 'cmd-1', 'payload': {'session': 1}}
+        )
+        command = Command.objects.select_related('reader').get(pk=command.pk)
+        with mock.patch('app.services.get_publisher_client') as get_client, \
+                mock.patch('app.services.normalize_details') as normalize, \
+                self.assertNumQueries(0):
+            get_client.return_value.publish.return_value = mock.Mock(ok=True, status_code=204)
+            send_command_service(None, reader.id, 'cmd-1', 'mode', command=command)
+        normalize.assert_not_called()
+        get_client.return_value.publish.assert_called_once_with(
+            'mqtt-pubsub', 'smartreader/TEST001/control', command.envelope.encode()
+        )
+
+    def test_invalid_details_are_rejected_when_stored(self):
+        reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1')
+        with self.assertRaises(ValueError):
+            store_command(reader, 'mode', '{not json')
+        self.assertFalse(Command.objects.exists())
+
+    def test_status_update_keeps_legacy_details(self):
+        reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1')
+        self.assertEqual(normalize_details("{'a': None, 'b': True}"), '{"a": null, "b": true}')
+        command = Command.objects.create(command_id='cmd-1', reader=reader, command='mode')
+        # a row written before details were normalised
+        Command.objects.filter(pk=command.pk).update(details="{'a': None", envelope=None)
+        update_command_status('cmd-1', 'TEST001', 'mode', 'COMPLETED', '{}')
+        command.refresh_from_db()
+        self.assertEqual((command.status, command.details), ('COMPLETED', "{'a': None"))
+
+
+class CircuitBreakerTestCase(TestCase):
+    def test_opens_after_failures_and_half_opens_after_timeout(self):
+        now = [0.0]
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.snapshot()['state'], 'OPEN')
+
+        now[0] = 10.0
+        self.assertTrue(breaker.allow())  # the trial call
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'OPEN')
+        now[0] = 20.0
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.snapshot(), {
+            'state': 'CLOSED', 'consecutive_failures': 0, 'times_opened': 2, 'open_for': None,
+        })
+
+    def test_open_sidecar_circuit_leaves_commands_pending(self):
+        reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1', is_connected=True)
+        command = Command.objects.create(command_id='cmd-1', reader=reader, command='start')
+        with mock.patch.object(sidecar_breaker, 'state', CircuitBreaker.OPEN), mock_publisher() as get_client:
+            self.assertEqual(process_pending_commands(), 0)
+            self.assertEqual(dispatch_commands([command.pk]), 0)
+        get_client.return_value.publish_many.assert_not_called()
+        self.assertEqual(Command.objects.get(pk=command.pk).status, 'PENDING')
+
+    def test_disconnected_broker_fails_publishes_without_connecting(self):
+        from mqtt_service.mqtt_manager import mqtt_manager
+        fake_client = mock.Mock(_thread=None)
+        fake_client.is_connected.return_value = False
+        breaker = CircuitBreaker('mqtt-test', failure_threshold=1)
+        with mock.patch.object(mqtt_manager, 'client', fake_client), \
+                mock.patch.object(mqtt_manager, 'breaker', breaker), \
+                mock.patch.object(mqtt_manager, '_reconnect_in_background') as reconnect:
+            self.assertFalse(mqtt_manager.publish_async('smartreader/TEST001/control', {}).result(timeout=0))
+            self.assertFalse(mqtt_manager.publish_async('smartreader/TEST001/control', {}).result(timeout=0))
+            # the disconnect handler neither sleeps nor connects on paho's thread
+            mqtt_manager.on_disconnect(fake_client, None, 1)
+        reconnect.assert_called_once_with()
+        fake_client.connect.assert_not_called()
+        fake_client.publish.assert_not_called()
+        self.assertEqual(breaker.state, 'OPEN')
+
+
+class CommandStatusLookupTestCase(APIKeyMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        reader = Reader.objects.create(serial_number='TEST001', ip_address='192.168.1.1', is_connected=True)
+        self.done = Command.objects.create(command_id='cmd-1', reader=reader, command='start', status='COMPLETED')
+        self.running = Command.objects.create(command_id='cmd-2', reader=reader, command='stop', status='PROCESSING')
+
+    def test_many_statuses_in_one_request(self):
+        with self.assertNumQueries(1):
+            statuses = get_command_statuses(['cmd-1', 'cmd-2'])
+        self.assertEqual(statuses['cmd-2']['reader__serial_number'], 'TEST001')
+
+        data = self.api_get(reverse('api-command-status'), {'ids': 'cmd-1,cmd-2,cmd-9'}).json()
+        self.assertEqual({key: value['status'] for key, value in data['commands'].items()},
+                         {'cmd-1': 'COMPLETED', 'cmd-2': 'PROCESSING'})
+        self.assertEqual(data['missing'], ['cmd-9'])
+        self.assertFalse(data['done'])
+        self.assertEqual(self.api_get(reverse('api-command-status'), {'ids': 'cmd-1', 'wait': 'soon'}).status_code, 400)
+        for wait in ('nan', 'inf', '-inf'):
+            self.assertEqual(self.api_get(reverse('api-command-status'), {'ids': 'cmd-1', 'wait': wait}).status_code, 400)
+        # returns at once instead of spinning on an active command
+        self.assertEqual(wait_for_commands(['cmd-2'], timeout=float('nan'))['cmd-2']['status'], 'PROCESSING')
+
+    def test_commands_failed_without_a_reply_wake_waiters(self):
+        old = timezone.now() - timezone.timedelta(seconds=settings.COMMAND_DEFERRAL_TTL + 1)
+        Command.objects.filter(pk=self.running.pk).update(updated_at=old)
+        deferred = Command.objects.create(command_id='cmd-3', reader=self.done.reader, command='start')
+        Command.objects.filter(pk=deferred.pk).update(status='DEFERRED', date_sent=old)
+        pending = Command.objects.create(command_id='cmd-4', reader=self.done.reader, command='stop')
+        with mock.patch.object(get_status_notifier(), 'notify') as notify, \
+                mock.patch('app.tasks.send_command_service', return_value=(False, 'unreachable')), \
+                self.captureOnCommitCallbacks(execute=True):
+            expire_stale_commands()
+            expire_deferred_commands()
+            process_command(pending.pk)
+        self.assertEqual(
+            notify.call_args_list, [mock.call([self.running.pk]), mock.call([deferred.pk]), mock.call([pending.pk])]
+        )
+
+    def test_wait_is_woken_by_the_response_handler(self):
+        # The reply announces the finished command once its update commits
+        with mock.patch.object(get_status_notifier(), 'notify') as notify, \
+                self.captureOnCommitCallbacks(execute=True):
+            update_command_status('cmd-2', 'TEST001', 'stop', 'COMPLETED', 'ok')
+        notify.assert_called_once_with([self.running.pk])
+
+        # A waiter reads again only when told, not on a timer
+        rows = [
+            {'cmd-2': {'id': self.running.pk, 'status': 'PROCESSING'}},
+            {'cmd-2': {'id': self.running.pk, 'status': 'COMPLETED'}},
+        ]
+        Timer(0.05, get_status_notifier().notify, args=[[self.running.pk]]).start()
+        started = time.monotonic()
+        with mock.patch('app.services.get_command_statuses', side_effect=rows) as lookup:
+            statuses = wait_for_commands(['cmd-2'], timeout=5)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(lookup.call_count, 2)
+        self.assertEqual(statuses['cmd-2']['status'], 'COMPLETED')
+
+
+class CommandFanOutTestCase(APIKeyMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(6):
+            Reader.objects.create(
+                serial_number=f'DOCK-{index:02d}', ip_address='192.168.1.1', location='North' if index % 2 else 'South',
+                is_connected=True,
+            )
+        Reader.objects.create(serial_number='YARD-01', ip_address='192.168.1.1', location='North')
+
+    def post(self, data):
+        return self.client.post(
+            reverse('api-command-fan-out'), data, content_type='application/json', HTTP_X_API_KEY=self.api_key
+        )
+
+    def test_fan_out_creates_batch_and_dispatches_it(self):
+        with mock.patch('app.tasks.dispatch_command_batch.apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.post({'command_type': 'start', 'serial_pattern': 'DOCK-*', 'location': 'North'})
+        self.assertEqual(response.status_code, 202)
+        batch_id = response.json()['batch_id']
+        self.assertEqual(response.json()['total'], 3)
+        apply_async.assert_called_once_with(args=[batch_id, 'high'], queue='high_priority', retry=False)
+
+        status_url = reverse('api-command-batch-status', args=[batch_id])
+        self.assertEqual(self.api_get(status_url).json()['statuses'], {'PENDING': 3})
+
+        with mock_publisher() as get_client:
+            self.assertEqual(dispatch_command_batch(batch_id), 3)
+        published = sorted(topic for topic, _message in get_client.return_value.sent)
+        self.assertEqual(published, [f'smartreader/DOCK-0{n}/control' for n in (1, 3, 5)])
+        with self.assertNumQueries(1):
+            batch_status = get_command_batch_status(batch_id)
+        self.assertEqual(batch_status['statuses'], {'COMPLETED': 3})
+        self.assertTrue(batch_status['done'])
+        # a deferred command is still going to run
+        Command.objects.filter(batch_id=batch_id).update(status='DEFERRED')
+        self.assertFalse(get_command_batch_status(batch_id)['done'])
+
+    def test_fan_out_requires_a_selection(self):
+        self.assertEqual(self.post({'command_type': 'start'}).status_code, 400)
+        self.assertEqual(self.post({'command_type': 'start', 'serial_pattern': 'NONE-*'}).status_code, 404)
+
+
+class CommandBatchSubmitTestCase(APIKeyMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(3):
+            Reader.objects.create(serial_number=f'TEST00{index}', ip_address='192.168.1.1')
+
+    def post(self, data):
+        return self.client.post(
+            reverse('api-command-batch-create'), data, content_type='application/json', HTTP_X_API_KEY=self.api_key
+        )
+
+    def test_mixed_batch_returns_per_item_results(self):
+        items = [
+            {'reader_serial_number': 'TEST000', 'command_type': 'start'},
+            {'reader_serial_number': 'TEST001', 'command_type': 'mode', 'details': {'antennas': [1, 2]}},
+            {'reader_serial_number': 'UNKNOWN', 'command_type': 'stop'},
+            {'reader_serial_number': 'TEST002', 'command_type': 'reboot'},
+            {'reader_serial_number': 'TEST002', 'command_type': 'status-detailed'},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(items)
+        # one reader lookup and one insert, whatever the batch size
+        command_queries = [q['sql'] for q in queries if '"app_reader"' in q['sql'] or '"app_command"' in q['sql']]
+        self.assertEqual(len(command_queries), 2)
+        self.assertEqual(response.status_code, 202)
+        payload = response.json()
+        self.assertEqual(payload['accepted'], 3)
+        self.assertEqual([result['status'] for result in payload['results']],
+                         ['PENDING', 'PENDING', 'REJECTED', 'REJECTED', 'PENDING'])
+        self.assertIn('command_type', payload['results'][3]['error'])
+        command = Command.objects.get(command_id=payload['results'][1]['command_id'])
+        self.assertEqual(json.loads(command.details), {'antennas': [1, 2]})
+        self.assertEqual(command.batch_id, payload['batch_id'])
+
+    def test_rejects_non_list(self):
+        self.assertEqual(self.post({'reader_serial_number': 'TEST000'}).status_code, 400)
+
+
+class IngestMeterTestCase(TestCase):
+    def test_snapshot_reports_peak_second_within_window(self):
+        now = [1000.2]
+        meter = IngestMeter(window=60, clock=lambda: now[0])
+        for _ in range(5):
+            meter.record('event', 100)
+        now[0] = 1001.5
+        meter.record('tagEvents', 10)
+        self.assertEqual(meter.snapshot(), {
+            'window_seconds': 60, 'messages': 6, 'bytes': 510,
+            'peak_messages_per_second': 5, 'by_kind': {'event': 5, 'tagEvents': 1},
+        })
+        now[0] = 1060.0
+        self.assertEqual(meter.snapshot()['messages'], 1)
+
+
+class MQTTPipelinedPublishTestCase(TestCase):
+    def setUp(self):
+        from mqtt_service.mqtt_manager import mqtt_manager
+        self.manager = mqtt_manager
+        self.mids = iter(range(1, 1000))
+        fake_client = mock.Mock()
+        fake_client.is_connected.return_value = True
+        fake_client.publish.side_effect = lambda *args, **kwargs: mock.Mock(rc=0, mid=next(self.mids))
+        patcher = mock.patch.object(self.manager, 'client', fake_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_futures_resolve_on_acknowledgement_by_mid(self):
+        first = self.manager.publish_async('smartreader/TEST001/control', {'command': 'start'})
+        second = self.manager.publish_async('smartreader/TEST002/control', {'command': 'stop'})
+        self.assertFalse(first.done() or second.done())
+        self.assertEqual(self.manager.client.publish.call_args_list[0].args[1], b'{"command": "start"}')
+
+        self.manager.on_publish(None, None, 2)
+        self.assertTrue(second.result(timeout=0))
+        self.assertFalse(first.done())
+        self.manager.on_publish(None, None, 1)
+        self.assertTrue(first.result(timeout=0))
+        self.assertEqual(len(self.manager._inflight), 0)
+
+    def test_acknowledgement_before_registration(self):
+        # e.g. QoS 0, where paho reports the mid from inside publish()
+        self.manager.on_publish(None, None, 1)
+        self.assertTrue(self.manager.publish_async('smartreader/TEST001/control', {}).result(timeout=0))
+
+    def test_window_limits_unacknowledged_messages(self):
+        with mock.patch.object(self.manager, '_inflight_window', BoundedSemaphore(1)), \
+                mock.patch.object(self.manager, 'publish_timeout', 0.01):
+            pending = self.manager.publish_async('smartreader/TEST001/control', {})
+            self.assertFalse(self.manager.publish_async('smartreader/TEST001/control', {}).result(timeout=0))
+            self.manager.on_publish(None, None, 1)
+            self.assertTrue(pending.result(timeout=0))
+            self.manager.publish_async('smartreader/TEST001/control', {})
+            self.assertEqual(self.manager.client.publish.call_count, 2)
+
+    def test_unacknowledged_publish_gives_its_slot_back(self):
+        with mock.patch.object(self.manager, '_inflight_window', BoundedSemaphore(1)), \
+                mock.patch.object(self.manager, 'publish_timeout', 0.01):
+            self.assertFalse(self.manager.publish('smartreader/TEST001/control', {}))
+            self.assertEqual(len(self.manager._inflight), 0)
+            second = self.manager.publish_async('smartreader/TEST001/control', {})
+            self.assertFalse(second.done())
+            # the late acknowledgement of the first message is ignored
+            self.manager.on_publish(None, None, 1)
+            self.assertFalse(second.done())
+            self.assertNotIn(1, self.manager._early_acks)
+            self.manager.on_publish(None, None, 2)
+            self.assertTrue(second.result(timeout=0))
+
+    def test_reused_mid_fails_the_message_it_replaces(self):
+        self.manager.client.publish.side_effect = lambda *args, **kwargs: mock.Mock(rc=0, mid=7)
+        with mock.patch.object(self.manager, '_inflight_window', BoundedSemaphore(2)):
+            first = self.manager.publish_async('smartreader/TEST001/control', {})
+            second = self.manager.publish_async('smartreader/TEST002/control', {})
+            self.assertFalse(first.result(timeout=0))
+            self.manager.on_publish(None, None, 7)
+            self.assertTrue(second.result(timeout=0))
+            # both slots are free again
+            self.assertTrue(self.manager._inflight_window.acquire(blocking=False))
+            self.assertTrue(self.manager._inflight_window.acquire(blocking=False))
@@ -9,7 +9,7 @@ urlpatterns = [
     path('readers/<int:reader_id>/mode/', views.mode_command, name='mode_command'),
     path('readers/edit/<int:pk>/', views.reader_edit, name='reader_edit'),
 
-    #path('readers/send_command/', views.send_command_to_readers, name='send_command_to_readers'),
+    path('readers/send_command/', views.send_command_to_readers, name='send_command_to_readers'),
     path('send-command/<int:reader_id>/', views.send_command, name='send_command'),
     path('command-history/', views.command_history, name='command_history'),
     path('command-detail/<int:command_id>/', views.command_detail, name='command_detail'),
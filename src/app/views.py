@@ -20,24 +20,28 @@ from app.tasks import process_command
 
 from app.models import DetailedStatusEvent, Reader, Command, ScheduledCommand
 from .services import (
-    get_active_firmwares, get_all_firmwares, get_reader, get_tag_events, get_paginated_items, get_readers, send_command,
-    handle_mode_command, get_detailed_status_events,
+    get_active_firmwares, get_all_firmwares, get_reader, get_tag_event_list, get_paginated_items, get_readers, send_command,
+    handle_mode_command, get_detailed_status_event_list, get_detailed_status_event_projection,
+    filter_detailed_status_events_by_json,
     store_command, get_alerts, create_alert, update_alert, delete_alert, 
-    toggle_alert, get_alert_logs, get_alert_by_id, get_scheduled_commands, 
+    toggle_alert, filter_alerts, get_alert_logs, get_alert_by_id, get_scheduled_commands, 
     create_scheduled_command, update_scheduled_command, delete_scheduled_command, upload_firmware,
-    get_firmware, send_firmware_update_command
+    get_firmware, send_firmware_update_command, get_command_history
 )
+from .db_routers import read_from_replica
+from .caching import get_cached_page, get_cached_rows, get_fragment_cache_context
 from .forms import FirmwareUploadForm, ReaderForm, ModeForm, AlertForm, ScheduledCommandForm
 from app import services
 
 logger = logging.getLogger(__name__)
 
 @login_required
+@read_from_replica
 def tag_event_list(request):
     search_query = request.GET.get('search', '')
     sort_by = request.GET.get('sort', '-first_seen_timestamp')
     export = request.GET.get('export', '')
-    tag_events = get_tag_events(search_query, sort_by)
+    tag_events = get_tag_event_list(search_query, sort_by)
 
     if export == 'csv':
         import csv
@@ -65,15 +69,18 @@ def tag_event_list(request):
     })
 
 @login_required
+@read_from_replica
 def reader_list(request):
     search_query = request.GET.get('search', '')
     sort_by = request.GET.get('sort', 'serial_number')
+    page_number = request.GET.get('page')
     readers = get_readers(search_query, sort_by)
-    page_obj = get_paginated_items(readers, request.GET.get('page'))
+    page_obj = get_cached_page('reader_list', readers, page_number, search_query, sort_by)
     return render(request, 'app/reader_list.html', {
         'page_obj': page_obj,
         'search_query': search_query,
-        'sort_by': sort_by
+        'sort_by': sort_by,
+        **get_fragment_cache_context(request, 'reader_list', search_query, sort_by, page_number)
     })
 
 @login_required
@@ -153,13 +160,16 @@ def send_command_to_readers(request):
     if request.method == 'POST':
         reader_ids = request.POST.getlist('reader_ids')
         command_type = request.POST.get('command')
-        readers = Reader.objects.filter(id__in=reader_ids)
-
-        # from .mqtt_client import client
-        for reader in readers:
-            send_command(reader, command_type)
-        
-        return redirect('reader_list')
+        if not command_type or not reader_ids:
+            messages.error(request, _("Select a command and at least one reader."))
+            return redirect('reader_list')
+        try:
+            batch_id, count, _skipped = services.fan_out_command(command_type, reader_ids=reader_ids)
+            messages.success(request, _("Command '%(command)s' queued for %(count)d readers.") % {'command': command_type, 'count': count})
+        except Exception as e:
+            logger.error(f"Error queueing commands: {str(e)}")
+            messages.error(request, _("An error occurred while processing the command."))
+    return redirect('reader_list')
 
 @login_required
 def mode_command(request, reader_id):
@@ -167,30 +177,21 @@ def mode_command(request, reader_id):
     if request.method == 'POST':
         form = ModeForm(request.POST)
         if form.is_valid():
-            handle_mode_command(reader, form.cleaned_data)
-            messages.success(request, _('Mode command sent successfully.'))
+            if handle_mode_command(reader, form.cleaned_data, force=form.cleaned_data['force']) is None:
+                messages.info(request, _('The reader already runs this configuration, nothing was sent.'))
+            else:
+                messages.success(request, _('Mode command sent successfully.'))
             return redirect('reader_list')
     else:
         form = ModeForm()
     return render(request, 'app/mode_form.html', {'form': form, 'reader': reader})
 
+@read_from_replica
 def command_history(request):
     search_query = request.GET.get('search', '')
     reader_serial = request.GET.get('reader', '')
     
-    commands = Command.objects.all()
-    
-    if reader_serial:
-        commands = commands.filter(reader__serial_number=reader_serial)
-    
-    if search_query:
-        commands = commands.filter(
-            Q(reader__serial_number__icontains=search_query) |
-            Q(command__icontains=search_query) |
-            Q(status__icontains=search_query)
-        )
-    
-    commands = commands.select_related('reader').order_by('-date_sent')
+    commands = get_command_history(search_query, reader_serial)
 
     paginator = Paginator(commands, 10)
     page_number = request.GET.get('page')
@@ -212,20 +213,46 @@ def command_detail(request, command_id):
 def detailed_status_event_list(request):
     search_query = request.GET.get('search', '')
     sort_by = request.GET.get('sort', '-timestamp')
-    events = get_detailed_status_events(search_query, sort_by)
+    json_path = request.GET.get('json_path', '')
+    json_value = request.GET.get('json_value', '')
+    events = get_detailed_status_event_list(search_query, sort_by)
+    if json_path and json_value:
+        try:
+            events = filter_detailed_status_events_by_json(events, json_path, json_value)
+        except ValueError as e:
+            messages.error(request, str(e))
     page_obj = get_paginated_items(events, request.GET.get('page'))
     return render(request, 'app/detailed_status_event_list.html', {
         'page_obj': page_obj,
         'search_query': search_query,
-        'sort_by': sort_by
+        'sort_by': sort_by,
+        'json_path': json_path,
+        'json_value': json_value
     })
 
 @login_required
 def detailed_status_event_detail(request, event_id):
-    event = get_object_or_404(DetailedStatusEvent, id=event_id)
-    filter_query = request.GET.get('filter', '')
+    filter_query = request.GET.get('filter', '').strip()
+    found = False
+    if filter_query:
+        # Try the filter as a JSON path first so only that sub-tree leaves the DB
+        found, projected = get_detailed_status_event_projection(event_id, filter_query)
+
+    if found:
+        event = get_object_or_404(
+            DetailedStatusEvent.objects.select_related('reader').defer('details', 'non_antenna_details'),
+            id=event_id
+        )
+        details = projected if isinstance(projected, dict) else {filter_query: projected}
+    else:
+        event = get_object_or_404(DetailedStatusEvent.objects.select_related('reader'), id=event_id)
+        details = {
+            key: value for key, value in (event.non_antenna_details or {}).items()
+            if filter_query.lower() in key.lower()
+        }
     return render(request, 'app/detailed_status_event_detail.html', {
         'event': event,
+        'details': details,
         'filter_query': filter_query
     })
 
@@ -233,12 +260,15 @@ def detailed_status_event_detail(request, event_id):
 def alert_list(request):
     search_query = request.GET.get('search', '')
     sort_by = request.GET.get('sort', 'name')
-    page_obj = get_alerts(request.user, search_query, sort_by, request.GET.get('page'))
+    page_number = request.GET.get('page')
+    alerts = filter_alerts(request.user, search_query, sort_by)
+    page_obj = get_cached_page('alert_list', alerts, page_number, request.user.pk, search_query, sort_by)
     
     return render(request, 'app/alert_list.html', {
         'page_obj': page_obj,
         'search_query': search_query,
-        'sort_by': sort_by
+        'sort_by': sort_by,
+        **get_fragment_cache_context(request, 'alert_list', search_query, sort_by, page_number)
     })
 
 @login_required
@@ -296,12 +326,14 @@ def alert_log_list(request):
 def scheduled_command_list(request):
     search_query = request.GET.get('search', '')
     sort_by = request.GET.get('sort', 'scheduled_time')
+    page_number = request.GET.get('page')
     scheduled_commands = get_scheduled_commands(search_query, sort_by)
-    page_obj = get_paginated_items(scheduled_commands, request.GET.get('page'))
+    page_obj = get_cached_page('scheduled_command_list', scheduled_commands, page_number, search_query, sort_by)
     return render(request, 'app/scheduled_command_list.html', {
         'page_obj': page_obj,
         'search_query': search_query,
-        'sort_by': sort_by
+        'sort_by': sort_by,
+        **get_fragment_cache_context(request, 'scheduled_command_list', search_query, sort_by, page_number)
     })
 
 @login_required
@@ -347,8 +379,11 @@ def scheduled_command_delete(request, pk):
 
 @login_required
 def firmware_list(request):
-    firmwares = get_all_firmwares()
-    return render(request, 'app/firmware_list.html', {'firmwares': firmwares})
+    firmwares = get_cached_rows('firmware_list', get_all_firmwares())
+    return render(request, 'app/firmware_list.html', {
+        'firmwares': firmwares,
+        **get_fragment_cache_context(request, 'firmware_list')
+    })
 
 @login_required
 def firmware_upload(request):
@@ -445,15 +480,7 @@ class CleanupStaleCommandsView(APIView):
     
     def post(self, request):
         try:
-            timeout = timezone.now() - timezone.timedelta(seconds=30)
-            stale_commands = Command.objects.filter(status='PROCESSING', updated_at__lt=timeout)
-            count = stale_commands.count()
-            
-            for command in stale_commands:
-                command.status = 'FAILED'
-                command.response = "Command processing timed out"
-                command.save()
-                logger.warning(f"Command {command.id} timed out and marked as failed")
+            count = services.expire_stale_commands()
             
             return Response({
                 'status': 'success',
@@ -90,6 +90,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'app.middleware.APIKeyMiddleware',
+    'app.middleware.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -133,6 +134,52 @@ DATABASES = {
     )
 }
 
+# Read replicas: comma separated database URLs, registered as replica_1..N.
+# Only views wrapped with app.db_routers.read_from_replica read from them.
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+]
+
+for index, replica_url in enumerate(DATABASE_REPLICA_URLS, start=1):
+    DATABASES[f'replica_{index}'] = dj_database_url.parse(
+        replica_url,
+        conn_max_age=600,
+        ssl_require=os.environ.get('DB_SSL_REQUIRE', 'False') == 'True'
+    )
+    DATABASES[f'replica_{index}']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['app.db_routers.ReadReplicaRouter']
+
+# Seconds a user's reads stay on the primary after one of their writes
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+
+
+# Cache
+# Redis (already part of docker-compose) when REDIS_CACHE_URL is set,
+# otherwise a per-process locmem cache.
+REDIS_CACHE_URL = os.environ.get('REDIS_CACHE_URL')
+
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'smartreader',
+        }
+    }
+
+# Seconds a cached list page (rows and rendered table) is kept; entries are
+# also invalidated through model signals, see app/caching.py
+LIST_CACHE_TIMEOUT = int(os.environ.get('LIST_CACHE_TIMEOUT', 300))
 
 
 # Password validation
@@ -213,6 +260,9 @@ MQTT_RECONNECT_DELAY = os.environ.get('MQTT_RECONNECT_DELAY', 5)
 MQTT_MAX_RECONNECT_ATTEMPTS = os.environ.get('MQTT_MAX_RECONNECT_ATTEMPTS', 5)
 MQTT_KEEPALIVE = os.environ.get('MQTT_KEEPALIVE', 60)
 MQTT_QOS = os.environ.get('MQTT_QOS', 1)
+# Unacknowledged QoS 1 publishes MQTTManager keeps in flight, and how long to wait for one
+MQTT_MAX_INFLIGHT = int(os.environ.get('MQTT_MAX_INFLIGHT', 100))
+MQTT_PUBLISH_TIMEOUT = float(os.environ.get('MQTT_PUBLISH_TIMEOUT', 10))
 MQTT_RETAIN = os.environ.get('MQTT_RETAIN', False)
 MQTT_USE_TLS = os.environ.get('MQTT_USE_TLS', False)
 MQTT_CA_CERTS  = os.environ.get('MQTT_CA_CERTS', '/path/to/ca.crt')
@@ -254,7 +304,71 @@ CELERY_TASK_ROUTES = {
     'app.tasks.process_and_cleanup_commands': {'queue': 'high_priority'},
     'app.tasks.execute_scheduled_commands_task': {'queue': 'scheduled_commands'},
     'app.tasks.process_pending_commands': {'queue': 'high_priority'},
+    'app.tasks.dispatch_commands': {'queue': 'high_priority'},
+    'app.tasks.dispatch_command_batch': {'queue': 'high_priority'},
+}
+
+# Enqueue stored commands for dispatch on commit instead of waiting for the
+# pollers (run_command_cleanup, run_mqtt_publisher), which remain as a safety net
+COMMAND_PUSH_DISPATCH = os.environ.get('COMMAND_PUSH_DISPATCH', 'True') == 'True'
+# Publishes kept in flight at once when dispatching a fleet-wide fan-out batch
+COMMAND_FANOUT_WINDOW = int(os.environ.get('COMMAND_FANOUT_WINDOW', 16))
+# Batch status lookup (GET /api/commands/status/): ids per request, and the
+# longest a request may wait for its commands to finish
+COMMAND_STATUS_MAX_IDS = int(os.environ.get('COMMAND_STATUS_MAX_IDS', 500))
+COMMAND_STATUS_MAX_WAIT = float(os.environ.get('COMMAND_STATUS_MAX_WAIT', 30))
+# Park commands for disconnected readers (DEFERRED) and send them when the reader
+# reports connected again; deferred commands older than COMMAND_DEFERRAL_TTL
+# seconds are failed instead (0 keeps them until the reader returns)
+COMMAND_DEFER_OFFLINE = os.environ.get('COMMAND_DEFER_OFFLINE', 'True') == 'True'
+COMMAND_DEFERRAL_TTL = int(os.environ.get('COMMAND_DEFERRAL_TTL', 3600))
+# Dispatch lane of each command type (the API can override it per command) and
+# the Celery queue serving each lane. Lanes are drained by separate workers
+# (see docker-compose.yml), so bulk status polls never delay a stop.
+COMMAND_PRIORITIES = {
+    'default': 'high',
+    'status-detailed': 'low',
+}
+COMMAND_PRIORITY_QUEUES = {
+    'high': 'high_priority',
+    'low': 'low_priority',
+}
+# Token buckets (rate per second, burst) limiting how fast commands reach one
+# reader: 'reader' covers all of its commands, the others one command type.
+# Kept in Redis when it is the cache backend, see app/ratelimit.py
+COMMAND_RATE_LIMIT_ENABLED = os.environ.get('COMMAND_RATE_LIMIT_ENABLED', str(not TESTING)) == 'True'
+COMMAND_RATE_LIMITS = {
+    'reader': (2.0, 10),
+    'default': (1.0, 5),
+    'mode': (0.2, 2),
+    'status-detailed': (0.5, 3),
+}
+# Seconds a claimed command may stay PROCESSING before cleanup_stale_commands
+# fails it, per command
+COMMAND_TIMEOUTS = {
+    'default': int(os.environ.get('COMMAND_TIMEOUT', 30)),
+    'status-detailed': int(os.environ.get('COMMAND_TIMEOUT_STATUS_DETAILED', 10)),
+}
+# The scheduler keeps schedules due within SCHEDULER_HORIZON seconds in memory
+# and checks for edits made by other processes every SCHEDULER_POLL_INTERVAL
+SCHEDULER_HORIZON = int(os.environ.get('SCHEDULER_HORIZON', 3600))
+SCHEDULER_POLL_INTERVAL = float(os.environ.get('SCHEDULER_POLL_INTERVAL', 1.0))
+# Seconds over which scheduled commands of a type are spread across the fleet;
+# each reader gets a fixed offset in the window (app.scheduler.get_spread_offset)
+SCHEDULED_COMMAND_SPREAD = {
+    'status-detailed': int(os.environ.get('SCHEDULED_STATUS_SPREAD', 300)),
 }
+# Mode commands only carry the settings that differ from the configuration the
+# reader last acknowledged (app/reader_config.py), and are skipped when nothing
+# differs; False always sends the whole configuration
+MODE_DRIFT_ONLY = os.environ.get('MODE_DRIFT_ONLY', 'True') == 'True'
+# Seconds an acknowledged configuration is trusted; it is also dropped when the
+# reader connects or disconnects, since it may have restarted with another one
+READER_CONFIG_CACHE_TIMEOUT = int(os.environ.get('READER_CONFIG_CACHE_TIMEOUT', 3600))
+# How long a dispatched command_id stays in the reply correlation map (app.correlation)
+COMMAND_CORRELATION_TTL = int(os.environ.get('COMMAND_CORRELATION_TTL', 3600))
+# Largest list accepted by POST /api/commands/batch/
+COMMAND_BATCH_MAX_SIZE = int(os.environ.get('COMMAND_BATCH_MAX_SIZE', 1000))
 
 CELERY_BEAT_SCHEDULE = {}
 
@@ -308,10 +422,23 @@ LOGGING = {
 
 DAPR_PUBLISHER_HOST = os.environ.get('DAPR_PUBLISHER_HOST', 'dapr-sidecar-publisher')
 DAPR_SUBSCRIBER_HOST = os.environ.get('DAPR_SUBSCRIBER_HOST', 'dapr-sidecar-subscriber')
-DAPR_HTTP_PORT = ('DAPR_HTTP_PORT', 3500)
-DAPR_GRPC_PORT = ('DAPR_GRPC_PORT', 50001)
-DAPR_PUBSUB_NAME = ('DAPR_PUBSUB_NAME', 'mqtt-pubsub')
-DAPR_STATE_STORE = ('DAPR_STATE_STORE', 'statestore')
+DAPR_HTTP_PORT = int(os.environ.get('DAPR_HTTP_PORT', 3500))
+DAPR_GRPC_PORT = int(os.environ.get('DAPR_GRPC_PORT', 50001))
+DAPR_PUBSUB_NAME = os.environ.get('DAPR_PUBSUB_NAME', 'mqtt-pubsub')
+DAPR_STATE_STORE = os.environ.get('DAPR_STATE_STORE', 'statestore')
+DAPR_PUBLISHER_HTTP_PORT = int(os.environ.get('DAPR_PUBLISHER_HTTP_PORT', 3501))
+DAPR_SUBSCRIBER_HTTP_PORT = int(os.environ.get('DAPR_SUBSCRIBER_HTTP_PORT', 3503))
+# Sidecar HTTP client: read timeout, connect timeout (seconds), retries and backoff factor
+DAPR_HTTP_TIMEOUT = float(os.environ.get('DAPR_HTTP_TIMEOUT', 5))
+DAPR_HTTP_CONNECT_TIMEOUT = float(os.environ.get('DAPR_HTTP_CONNECT_TIMEOUT', 1))
+DAPR_HTTP_RETRIES = int(os.environ.get('DAPR_HTTP_RETRIES', 3))
+DAPR_HTTP_BACKOFF = float(os.environ.get('DAPR_HTTP_BACKOFF', 0.2))
+DAPR_HTTP_POOL_SIZE = int(os.environ.get('DAPR_HTTP_POOL_SIZE', 20))
+
+# Circuit breakers around the Dapr sidecar and the MQTT broker (app/breakers.py):
+# open after this many consecutive failures, then probe every RESET_TIMEOUT seconds
+CIRCUIT_BREAKER_FAILURES = int(os.environ.get('CIRCUIT_BREAKER_FAILURES', 5))
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.environ.get('CIRCUIT_BREAKER_RESET_TIMEOUT', 10))
 
 # Ensure the logs directory exists
 os.makedirs(os.path.join(BASE_DIR, 'logs'), exist_ok=True)
@@ -0,0 +1,266 @@
+# dapr_integration/client.py
+import asyncio
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .config import (
+    DAPR_HTTP_TIMEOUT, DAPR_HTTP_CONNECT_TIMEOUT, DAPR_HTTP_RETRIES, DAPR_HTTP_BACKOFF, DAPR_HTTP_POOL_SIZE,
+    DAPR_PUBLISHER_HOST, DAPR_PUBLISHER_HTTP_PORT, DAPR_SUBSCRIBER_HOST, DAPR_SUBSCRIBER_HTTP_PORT,
+)
+
+try:
+    import aiohttp
+except ImportError:  # the asyncio client is optional
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# Sidecar answers worth retrying: it is starting up or briefly overloaded.
+# A 500 from a publish means the component rejected the message, so it is
+# returned to the caller instead of being sent again.
+RETRY_STATUSES = (502, 503, 504)
+
+# Dapr's bulk publish API is still alpha; sidecars older than 1.10 answer 404
+BULK_PUBLISH_PATH = '/v1.0-alpha1/publish/bulk'
+
+def _publish_body(data):
+    """Request arguments for a publish; pre-rendered bytes are sent as they are"""
+    if isinstance(data, bytes):
+        return {'data': data, 'headers': {'Content-Type': 'application/json'}}
+    return {'json': data}
+
+def _encode_event(data) -> bytes:
+    return data if isinstance(data, bytes) else json.dumps(data).encode()
+
+
+class DaprSidecarClient:
+    """
+    HTTP client for one Dapr sidecar. Connections are pooled and kept alive
+    across calls, every call has a timeout, and connection errors and
+    RETRY_STATUSES are retried with exponential backoff.
+    """
+    def __init__(self, host: str, port: int, timeout: float = DAPR_HTTP_TIMEOUT,
+                 retries: int = DAPR_HTTP_RETRIES, backoff: float = DAPR_HTTP_BACKOFF,
+                 pool_size: int = DAPR_HTTP_POOL_SIZE):
+        self.base_url = f"http://{host}:{port}"
+        self.timeout = (DAPR_HTTP_CONNECT_TIMEOUT, timeout)
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,  # the request may have reached the sidecar; do not resend it
+            status=retries,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,  # Dapr publishes are POSTs
+            backoff_factor=backoff,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.pool_size = pool_size
+        self.bulk_supported = None  # unknown until the first bulk publish
+
+    def request(self, method: str, path: str, timeout: Optional[float] = None, **kwargs) -> requests.Response:
+        timeout = self.timeout if timeout is None else (DAPR_HTTP_CONNECT_TIMEOUT, timeout)
+        return self.session.request(method, f"{self.base_url}{path}", timeout=timeout, **kwargs)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+    def publish(self, pubsub_name: str, topic: str, data: Any, **kwargs) -> requests.Response:
+        """
+        POST /v1.0/publish/<pubsub>/<topic>; Dapr answers 204 on success.
+        `data` is serialised to JSON, unless it is already JSON encoded bytes.
+        """
+        return self.post(f"/v1.0/publish/{pubsub_name}/{quote(topic, safe='/')}", **_publish_body(data), **kwargs)
+
+    def publish_bulk(self, pubsub_name: str, topic: str, events: Sequence[Any], **kwargs) -> requests.Response:
+        """
+        POST one bulk publish request for `events` on a single topic. Entry
+        ids are the event indexes. Dapr answers 204 when all were published,
+        otherwise 500 listing the failedEntries.
+        """
+        # Pre-encoded events are spliced in as they are, not parsed again
+        body = b'[' + b','.join(
+            b'{"entryId": "%d", "event": %s, "contentType": "application/json"}' % (index, _encode_event(event))
+            for index, event in enumerate(events)
+        ) + b']'
+        return self.post(
+            f"{BULK_PUBLISH_PATH}/{pubsub_name}/{quote(topic, safe='/')}",
+            data=body, headers={'Content-Type': 'application/json'}, **kwargs
+        )
+
+    def publish_many(self, pubsub_name: str, messages: Sequence[Tuple[str, Any]],
+                     window: Optional[int] = None, ordered: bool = True) -> List[Tuple[bool, Optional[str]]]:
+        """
+        Publish (topic, data) messages and return (ok, error) per message,
+        in order. Different topics are published concurrently, at most
+        `window` (default: the connection pool size) at a time.
+
+        With `ordered`, messages sharing a topic are published one after
+        another in the order given, so a reader receives e.g. a mode command
+        before the start that follows it. Otherwise they go out in one bulk
+        publish request where the sidecar supports it; Dapr does not keep
+        the order of the entries of a bulk request.
+        """
+        results = [None] * len(messages)
+        by_topic = {}
+        for index, (topic, _data) in enumerate(messages):
+            by_topic.setdefault(topic, []).append(index)
+
+        chains = []  # message indexes published one after another
+        bulk_rejected = []
+        for topic, indexes in by_topic.items():
+            if ordered:
+                chains.append(indexes)
+                continue
+            if len(indexes) > 1 and self.bulk_supported is not False:
+                if self._publish_topic_bulk(pubsub_name, topic, indexes, messages, results):
+                    continue
+                bulk_rejected.extend(indexes)
+            chains.extend([index] for index in indexes)
+
+        def publish_one(index):
+            topic, data = messages[index]
+            try:
+                response = self.publish(pubsub_name, topic, data)
+            except requests.RequestException as e:
+                return False, str(e)
+            return (True, None) if response.ok else (False, f"HTTP {response.status_code}")
+
+        def publish_chain(chain):
+            return [publish_one(index) for index in chain]
+
+        window = min(window or self.pool_size, len(chains))
+        if window > 1:
+            with ThreadPoolExecutor(max_workers=window) as executor:
+                outcomes = list(executor.map(publish_chain, chains))
+        else:
+            outcomes = [publish_chain(chain) for chain in chains]
+        for chain, chain_outcomes in zip(chains, outcomes):
+            for index, outcome in zip(chain, chain_outcomes):
+                results[index] = outcome
+
+        # A 404 also comes back for an unknown pubsub component; only a
+        # single publish that worked shows the bulk API itself is missing
+        if any(results[index][0] for index in bulk_rejected):
+            logger.info("Dapr sidecar has no bulk publish API, publishing messages one by one")
+            self.bulk_supported = False
+        return results
+
+    def _publish_topic_bulk(self, pubsub_name, topic, indexes, messages, results) -> bool:
+        """Fill in `results` for one topic's messages; False (on a 404) to publish them singly instead"""
+        try:
+            response = self.publish_bulk(pubsub_name, topic, [messages[index][1] for index in indexes])
+        except requests.RequestException as e:
+            for index in indexes:
+                results[index] = (False, str(e))
+            return True
+        if response.status_code == 404:
+            return False
+        self.bulk_supported = True
+        if response.ok:
+            for index in indexes:
+                results[index] = (True, None)
+            return True
+        try:
+            failed = {
+                int(entry['entryId']): entry.get('error') or f"HTTP {response.status_code}"
+                for entry in response.json().get('failedEntries', [])
+            }
+        except (ValueError, KeyError, TypeError, AttributeError):
+            failed = {}
+        if not failed:
+            # Nothing tells which entries failed: treat them all as failed
+            failed = {position: f"HTTP {response.status_code}" for position in range(len(indexes))}
+        for position, index in enumerate(indexes):
+            results[index] = (False, failed[position]) if position in failed else (True, None)
+        return True
+
+    def healthz(self) -> bool:
+        try:
+            return self.get('/v1.0/healthz', timeout=DAPR_HTTP_CONNECT_TIMEOUT).status_code == 204
+        except requests.RequestException:
+            return False
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncDaprSidecarClient:
+    """
+    asyncio counterpart of DaprSidecarClient, built on aiohttp (not a hard
+    dependency). Create it inside the running event loop and close() it
+    when done.
+    """
+    def __init__(self, host: str, port: int, timeout: float = DAPR_HTTP_TIMEOUT,
+                 retries: int = DAPR_HTTP_RETRIES, backoff: float = DAPR_HTTP_BACKOFF,
+                 pool_size: int = DAPR_HTTP_POOL_SIZE):
+        if aiohttp is None:
+            raise RuntimeError("AsyncDaprSidecarClient requires aiohttp to be installed")
+        self.base_url = f"http://{host}:{port}"
+        self.retries = retries
+        self.backoff = backoff
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size),
+            timeout=aiohttp.ClientTimeout(total=timeout, connect=DAPR_HTTP_CONNECT_TIMEOUT),
+        )
+
+    async def request(self, method: str, path: str, **kwargs):
+        """Return (status, body bytes)"""
+        attempt = 0
+        while True:
+            try:
+                async with self.session.request(method, f"{self.base_url}{path}", **kwargs) as response:
+                    body = await response.read()
+                    if response.status not in RETRY_STATUSES or attempt >= self.retries:
+                        return response.status, body
+            except aiohttp.ClientConnectionError:
+                if attempt >= self.retries:
+                    raise
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    async def get(self, path: str, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path: str, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    async def publish(self, pubsub_name: str, topic: str, data: Any, **kwargs):
+        return await self.post(f"/v1.0/publish/{pubsub_name}/{quote(topic, safe='/')}", **_publish_body(data), **kwargs)
+
+    async def close(self):
+        await self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_sidecar_client(host: str, port: int) -> DaprSidecarClient:
+    """Process-wide client per sidecar, so every caller shares one connection pool"""
+    key = (host, int(port))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = DaprSidecarClient(host, int(port))
+    return client
+
+def get_publisher_client() -> DaprSidecarClient:
+    return get_sidecar_client(DAPR_PUBLISHER_HOST, DAPR_PUBLISHER_HTTP_PORT)
+
+def get_subscriber_client() -> DaprSidecarClient:
+    return get_sidecar_client(DAPR_SUBSCRIBER_HOST, DAPR_SUBSCRIBER_HTTP_PORT)
@@ -9,6 +9,17 @@ DAPR_GRPC_PORT = getattr(settings, 'DAPR_GRPC_PORT', 50001)
 DAPR_PUBSUB_NAME = getattr(settings, 'DAPR_PUBSUB_NAME', 'mqtt-pubsub')
 DAPR_STATE_STORE = getattr(settings, 'DAPR_STATE_STORE', 'statestore')
 
+# Sidecar HTTP ports as published in docker-compose
+DAPR_PUBLISHER_HTTP_PORT = getattr(settings, 'DAPR_PUBLISHER_HTTP_PORT', 3501)
+DAPR_SUBSCRIBER_HTTP_PORT = getattr(settings, 'DAPR_SUBSCRIBER_HTTP_PORT', 3503)
+
+# Sidecar HTTP client (dapr_integration.client)
+DAPR_HTTP_TIMEOUT = getattr(settings, 'DAPR_HTTP_TIMEOUT', 5.0)
+DAPR_HTTP_CONNECT_TIMEOUT = getattr(settings, 'DAPR_HTTP_CONNECT_TIMEOUT', 1.0)
+DAPR_HTTP_RETRIES = getattr(settings, 'DAPR_HTTP_RETRIES', 3)
+DAPR_HTTP_BACKOFF = getattr(settings, 'DAPR_HTTP_BACKOFF', 0.2)
+DAPR_HTTP_POOL_SIZE = getattr(settings, 'DAPR_HTTP_POOL_SIZE', 20)
+
 # MQTT topics configuration
 MQTT_TOPICS = [
     'smartreader/+/controlResult',
@@ -2,7 +2,8 @@
 from dapr.clients import DaprClient
 import json
 import logging
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Sequence, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +45,66 @@ class DaprMQTTPublisher:
             logger.error(f"Error publishing message to {topic}: {str(e)}")
             return False
 
+    def publish_many(self, messages: Sequence[Tuple[str, Dict[str, Any]]],
+                     window: int = 8, ordered: bool = True) -> List[Tuple[bool, Optional[str]]]:
+        """
+        Publish (topic, message) pairs, `window` topics at a time. With
+        `ordered`, each topic's messages are published one after another in
+        the order given; otherwise in one bulk publish per topic where the
+        SDK and sidecar support it (Dapr does not keep the order of bulk
+        entries).
+
+        Returns:
+            list of (ok, error) per message, in order
+        """
+        results = [None] * len(messages)
+        by_topic = {}
+        for index, (topic, _message) in enumerate(messages):
+            by_topic.setdefault(topic, []).append(index)
+
+        chains = []  # message indexes published one after another
+        for topic, indexes in by_topic.items():
+            if ordered:
+                chains.append(indexes)
+                continue
+            if len(indexes) < 2 or not hasattr(self.client, 'publish_events'):
+                chains.extend([index] for index in indexes)
+                continue
+            try:
+                response = self.client.publish_events(
+                    pubsub_name=self.pubsub_name,
+                    topic_name=topic,
+                    data=[json.dumps(messages[index][1]) for index in indexes],
+                    data_content_type="application/json",
+                )
+            except Exception as e:
+                logger.warning(f"Bulk publish to {topic} failed, publishing one by one: {str(e)}")
+                chains.extend([index] for index in indexes)
+                continue
+            failed = {}
+            for entry in response.failed_entries:
+                if not entry.entry_id.isdigit():
+                    # Entry ids assigned by the SDK do not say which message failed
+                    failed = {position: entry.error for position in range(len(indexes))}
+                    break
+                failed[int(entry.entry_id)] = entry.error
+            for position, index in enumerate(indexes):
+                results[index] = (False, failed[position]) if position in failed else (True, None)
+
+        def publish_one(index):
+            topic, message = messages[index]
+            return (True, None) if self.publish(topic, message) else (False, f"Publish to {topic} failed")
+
+        def publish_chain(chain):
+            return [publish_one(index) for index in chain]
+
+        if chains:
+            with ThreadPoolExecutor(max_workers=max(1, min(window, len(chains)))) as executor:
+                for chain, outcomes in zip(chains, executor.map(publish_chain, chains)):
+                    for index, outcome in zip(chain, outcomes):
+                        results[index] = outcome
+        return results
+
     def close(self):
         """Close the Dapr client connection"""
         if self._client:
@@ -1,23 +1,22 @@
 # dapr_integration/pubsub.py
 import json
 import logging
-import requests
-from django.conf import settings
+from .client import get_sidecar_client
+from .config import DAPR_PUBLISHER_HOST, DAPR_PUBLISHER_HTTP_PORT
 
 logger = logging.getLogger(__name__)
 
 class DaprPubSub:
-    def __init__(self, pubsub_name="mqtt-pubsub", dapr_port=3500):
+    def __init__(self, pubsub_name="mqtt-pubsub", dapr_port=DAPR_PUBLISHER_HTTP_PORT):
         self.pubsub_name = pubsub_name
-        self.dapr_url = f"http://dapr-sidecar-publisher:{dapr_port}/v1.0"
+        self.client = get_sidecar_client(DAPR_PUBLISHER_HOST, dapr_port)
 
     def publish(self, topic: str, data: dict) -> bool:
         """Publish a message to a topic via Dapr"""
         try:
-            url = f"{self.dapr_url}/publish/{self.pubsub_name}/{topic}"
-            response = requests.post(url, json=data)
+            response = self.client.publish(self.pubsub_name, topic, data)
 
-            if response.status_code == 200:
+            if response.ok:
                 logger.info(f"Successfully published message to {topic}")
                 return True
             else:
@@ -28,6 +27,14 @@ class DaprPubSub:
             logger.error(f"Error publishing message: {str(e)}")
             return False
 
+    def publish_many(self, messages, window=None, ordered=True):
+        """Publish (topic, data) messages; returns (ok, error) per message, see DaprSidecarClient.publish_many"""
+        try:
+            return self.client.publish_many(self.pubsub_name, messages, window=window, ordered=ordered)
+        except Exception as e:
+            logger.error(f"Error publishing messages: {str(e)}")
+            return [(False, str(e))] * len(messages)
+
     def subscribe(self, topic: str, route: str):
         """Subscribe to a topic"""
         try:
@@ -37,8 +44,7 @@ class DaprPubSub:
                 "route": route
             }
 
-            url = f"{self.dapr_url}/subscribe"
-            response = requests.post(url, json=[subscription])
+            response = self.client.post("/v1.0/subscribe", json=[subscription])
 
             if response.status_code == 200:
                 logger.info(f"Successfully subscribed to {topic}")
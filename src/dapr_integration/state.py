@@ -1,26 +1,26 @@
 # dapr_integration/state.py
 import json
 import logging
-import requests
 from typing import Any, Optional
+from .client import get_sidecar_client
+from .config import DAPR_SUBSCRIBER_HOST, DAPR_SUBSCRIBER_HTTP_PORT
 
 logger = logging.getLogger(__name__)
 
 class DaprState:
-    def __init__(self, store_name="statestore", dapr_port=3500):
+    def __init__(self, store_name="statestore", dapr_port=DAPR_SUBSCRIBER_HTTP_PORT):
         self.store_name = store_name
-        self.dapr_url = f"http://dapr-sidecar-subscriber:{dapr_port}/v1.0"
+        self.client = get_sidecar_client(DAPR_SUBSCRIBER_HOST, dapr_port)
 
     def save_state(self, key: str, value: Any) -> bool:
         """Save a value to the state store"""
         try:
-            url = f"{self.dapr_url}/state/{self.store_name}"
             state_item = [{
                 "key": key,
                 "value": value
             }]
 
-            response = requests.post(url, json=state_item)
+            response = self.client.post(f"/v1.0/state/{self.store_name}", json=state_item)
 
             if response.status_code == 204:
                 logger.info(f"Successfully saved state for key {key}")
@@ -36,8 +36,7 @@ class DaprState:
     def get_state(self, key: str) -> Optional[Any]:
         """Get a value from the state store"""
         try:
-            url = f"{self.dapr_url}/state/{self.store_name}/{key}"
-            response = requests.get(url)
+            response = self.client.get(f"/v1.0/state/{self.store_name}/{key}")
 
             if response.status_code == 200:
                 return response.json()
@@ -64,12 +64,15 @@ class Command(BaseCommand):
         
         DAPR_HTTP_PORT = 3505
         DJANGO_API_URL = "http://web:8000"
+        API_TIMEOUT = 10
+        # Keep-alive connection to the web app across polls
+        api_session = requests.Session()
         
         while True:
             try:
                 # Get pending commands
                 headers = {'X-API-Key': os.environ.get('API_KEY')}
-                response = requests.get(f"{DJANGO_API_URL}/api/commands/pending/", headers=headers)
+                response = api_session.get(f"{DJANGO_API_URL}/api/commands/pending/", headers=headers, timeout=API_TIMEOUT)
                 if response.status_code == 200:
                     commands = response.json().get('commands', [])
                     
@@ -81,7 +84,8 @@ class Command(BaseCommand):
                                 command['reader_id'],
                                 command['command_id'],
                                 command['command'],
-                                command['details']
+                                command['details'],
+                                envelope=command.get('envelope')
                             )
                             
                             # Publish via Dapr
@@ -115,10 +119,11 @@ class Command(BaseCommand):
                                 #         "response": f"Failed to publish: {pub_response.status_code}"
                                 #     }
                                     
-                                requests.put(
+                                api_session.put(
                                     f"{DJANGO_API_URL}/api/commands/{command['command_id']}/status/",
                                     headers=headers,
-                                    json=status_data
+                                    json=status_data,
+                                    timeout=API_TIMEOUT
                                 )
                                 
                         except Exception as e:
@@ -129,10 +134,11 @@ class Command(BaseCommand):
                                 "status": "FAILED",
                                 "response": f"Error: {str(e)}"
                             }
-                            requests.put(
+                            api_session.put(
                                 f"{DJANGO_API_URL}/api/commands/{command['command_id']}/status/",
                                 headers=headers,
-                                json=status_data
+                                json=status_data,
+                                timeout=API_TIMEOUT
                             )
                             
             except Exception as e:
@@ -141,9 +147,10 @@ class Command(BaseCommand):
             time.sleep(5)  # Wait before next poll
 import logging
 import json
-import requests
 from django.core.management.base import BaseCommand
 from django.core.wsgi import get_wsgi_application
+from dapr_integration.client import get_sidecar_client
+from dapr_integration.config import DAPR_SUBSCRIBER_HOST
 import time
 
 logger = logging.getLogger(__name__)
@@ -167,8 +174,8 @@ class Command(BaseCommand):
         }
         
         try:
-            response = requests.post(
-                f"http://dapr-sidecar-subscriber:{DAPR_HTTP_PORT}/dapr/subscribe",
+            response = get_sidecar_client(DAPR_SUBSCRIBER_HOST, DAPR_HTTP_PORT).post(
+                "/dapr/subscribe",
                 json=[subscription]
             )
             if response.status_code == 200:
@@ -2,10 +2,11 @@ import logging
 import json
 import os
 import django
-import requests
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.core.wsgi import get_wsgi_application
+from dapr_integration.client import get_sidecar_client
+from dapr_integration.config import DAPR_SUBSCRIBER_HOST
 import time
 
 logger = logging.getLogger(__name__)
@@ -66,9 +67,11 @@ class Command(BaseCommand):
         #     logger.error("Failed to connect to Dapr sidecar after maximum retries")
         #     return
 
+        sidecar = get_sidecar_client(DAPR_SUBSCRIBER_HOST, DAPR_HTTP_PORT)
+
         try:
-            response = requests.post(
-                f"http://dapr-sidecar-subscriber:{DAPR_HTTP_PORT}/dapr/subscribe",
+            response = sidecar.post(
+                "/dapr/subscribe",
                 json=subscriptions
             )
             if response.status_code == 200:
@@ -119,8 +122,8 @@ class Command(BaseCommand):
             logger.info(f"Started HTTP server on port {APP_PORT}")
 
             # Register subscriptions with Dapr
-            response = requests.post(
-                f"http://dapr-sidecar-subscriber:{DAPR_HTTP_PORT}/dapr/subscribe",
+            response = sidecar.post(
+                "/dapr/subscribe",
                 json=subscriptions,
                 headers={
                     "Content-Type": "application/json",
@@ -0,0 +1,48 @@
+# mqtt_service/metrics.py
+import time
+from collections import deque
+from threading import Lock
+
+
+class IngestMeter:
+    """
+    Per-second counts of received MQTT messages over the last `window`
+    seconds. The peak second shows bursts (e.g. a whole fleet answering a
+    scheduled status request at once) that a plain total hides.
+    """
+    def __init__(self, window=60, clock=time.time):
+        self.window = window
+        self.clock = clock
+        self._seconds = deque()  # [second, messages, bytes, {kind: messages}]
+        self._lock = Lock()
+
+    def record(self, kind, size):
+        second = int(self.clock())
+        with self._lock:
+            if not self._seconds or self._seconds[-1][0] != second:
+                self._seconds.append([second, 0, 0, {}])
+                self._expire(second)
+            bucket = self._seconds[-1]
+            bucket[1] += 1
+            bucket[2] += size
+            bucket[3][kind] = bucket[3].get(kind, 0) + 1
+
+    def _expire(self, now):
+        while self._seconds and self._seconds[0][0] <= now - self.window:
+            self._seconds.popleft()
+
+    def snapshot(self):
+        with self._lock:
+            self._expire(int(self.clock()))
+            seconds = list(self._seconds)
+        by_kind = {}
+        for _second, _messages, _size, kinds in seconds:
+            for kind, count in kinds.items():
+                by_kind[kind] = by_kind.get(kind, 0) + count
+        return {
+            "window_seconds": self.window,
+            "messages": sum(bucket[1] for bucket in seconds),
+            "bytes": sum(bucket[2] for bucket in seconds),
+            "peak_messages_per_second": max((bucket[1] for bucket in seconds), default=0),
+            "by_kind": by_kind,
+        }
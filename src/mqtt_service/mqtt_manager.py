@@ -7,7 +7,8 @@ from django.conf import settings
 import paho.mqtt.client as mqtt
 import json
 import logging
-from threading import Lock
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from threading import BoundedSemaphore, Lock, Thread
 from datetime import datetime
 import ssl
 from pathlib import Path
@@ -16,6 +17,10 @@ from app.services import (
     update_reader_connection_status, update_reader_last_communication, process_tag_events, 
     store_detailed_status_event, update_command_status
 )
+from app.ratelimit import get_throttle_stats
+from app.reader_config import forget_reader_configs
+from app.breakers import get_breaker, get_breaker_states
+from .metrics import IngestMeter
 
 
 logger = logging.getLogger(__name__)
@@ -23,7 +28,6 @@ logger = logging.getLogger(__name__)
 class MQTTManager:
     _instance = None
     _lock = Lock()
-    _publish_lock = Lock()
 
     def __new__(cls):
         with cls._lock:
@@ -57,6 +61,19 @@ class MQTTManager:
         self.reconnect_delay = getattr(settings, 'MQTT_RECONNECT_DELAY', 5)
         self.publish_attempts = 0
         self.successful_publishes = 0
+        self.publish_timeout = float(getattr(settings, 'MQTT_PUBLISH_TIMEOUT', 10.0))
+        self.max_inflight = int(getattr(settings, 'MQTT_MAX_INFLIGHT', 100))
+        # mid -> (Future, topic, deadline) for messages awaiting their acknowledgement
+        self._inflight = {}
+        self._early_acks = set()
+        # mids given up on by _expire_inflight, whose late acknowledgement is ignored
+        self._expired = set()
+        self._inflight_lock = Lock()
+        self._inflight_window = BoundedSemaphore(self.max_inflight)
+        self.ingest = IngestMeter()
+        # Open while the broker is unreachable: publishers fail at once
+        # instead of each waiting on a connection attempt
+        self.breaker = get_breaker('mqtt-broker', probe=self._probe_broker)
         
     def _setup_mqtt_client(self):
         client_id = f"django_mqtt_{int(time.time())}"
@@ -127,6 +144,11 @@ class MQTTManager:
         self.client.on_connect = self.on_connect
         self.client.on_disconnect = self.on_disconnect
         self.client.on_message = self.on_message
+        self.client.on_publish = self.on_publish
+        self.client.max_inflight_messages_set(self.max_inflight)
+        # The network loop reconnects on its own after a disconnect, backing
+        # off up to MQTT_RECONNECT_DELAY seconds between attempts
+        self.client.reconnect_delay_set(min_delay=1, max_delay=max(1, int(self.reconnect_delay)))
         
         # Set up credentials if configured
         if hasattr(settings, 'MQTT_USERNAME') and hasattr(settings, 'MQTT_PASSWORD'):
@@ -162,11 +184,7 @@ class MQTTManager:
             self.logger.info(f"TLS Enabled: {getattr(settings, 'MQTT_USE_TLS', False)}")
             
             # Set keep alive interval
-            keepalive = getattr(settings, 'MQTT_KEEPALIVE', 60)
-            self.client.connect(mqtt_broker, mqtt_port, keepalive)
-            
-            self.logger.info(f"Attempting connection to broker at {mqtt_broker}:{mqtt_port}")
-            
+            keepalive = int(getattr(settings, 'MQTT_KEEPALIVE', 60))
             self.client.connect(mqtt_broker, mqtt_port, keepalive)
             
             # Start network loop in background thread
@@ -185,8 +203,22 @@ class MQTTManager:
         except Exception as e:
             self.logger.error(f"Failed to connect to MQTT broker: {str(e)}")
             self.connection_state = "DISCONNECTED"
+            self.breaker.record_failure()
             return False
 
+    def _reconnect_in_background(self):
+        """Connect off the caller's thread, unless the network loop is already reconnecting"""
+        loop_running = self.client._thread is not None and self.client._thread.is_alive()
+        if loop_running or self.connection_state == "CONNECTING":
+            return
+        Thread(target=self.connect, name='mqtt-reconnect', daemon=True).start()
+
+    def _probe_broker(self):
+        if self.client.is_connected():
+            return True
+        self._reconnect_in_background()
+        return False
+
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             self.connection_state = "CONNECTED"
@@ -197,9 +229,11 @@ class MQTTManager:
             self.logger.info(f"Client ID: {client._client_id}")
             self.logger.info(f"Protocol version: {client._protocol}")
             
+            self.breaker.record_success()
             self.subscribe_to_topics()
         else:
             self.connection_state = "DISCONNECTED"
+            self.breaker.record_failure()
             self.logger.error(f"Connection failed with result code {rc}: {mqtt.connack_string(rc)}")
 
     def on_disconnect(self, client, userdata, rc):
@@ -207,18 +241,18 @@ class MQTTManager:
         
         if rc != 0:
             self.logger.warning(f"Unexpected disconnection from MQTT broker. RC: {rc}")
+            self.breaker.trip()
             self._handle_reconnection()
 
     def _handle_reconnection(self):
-        if self.reconnect_count >= self.max_reconnect_attempts:
-            self.logger.error("Max reconnection attempts reached. Manual intervention required.")
-            return
-
+        # Runs on paho's network thread: never sleep or connect here. The
+        # network loop reconnects with backoff (see reconnect_delay_set) and
+        # the breaker's probe covers a client whose loop is not running.
         self.reconnect_count += 1
-        self.logger.info(f"Attempting reconnection {self.reconnect_count}/{self.max_reconnect_attempts}")
-        
-        time.sleep(self.reconnect_delay)
-        self.connect()
+        if self.reconnect_count > int(self.max_reconnect_attempts):
+            self.logger.error(f"Broker still unreachable after {self.reconnect_count - 1} reconnections, still retrying")
+        else:
+            self.logger.info(f"Waiting for reconnection {self.reconnect_count}/{self.max_reconnect_attempts}")
 
     def subscribe_to_topics(self):
         for topic in self.topics:
@@ -234,6 +268,8 @@ class MQTTManager:
     def on_message(self, client, userdata, msg):
         """Handle incoming MQTT messages"""
         topic = msg.topic
+        # smartreader/<serial>/<kind>
+        self.ingest.record(topic.rsplit('/', 1)[-1], len(msg.payload))
         try:
             payload = json.loads(msg.payload.decode())
         except json.JSONDecodeError:
@@ -244,7 +280,7 @@ class MQTTManager:
         
         try:
             serial_number = topic.split('/')[1]
-            reader = update_reader_last_communication(serial_number)
+            reader = update_reader_last_communication(serial_number, mark_connected='/lwt' not in topic)
             if reader is None:
                 self.logger.warning(f"No reader found for serial number: {serial_number}")
                 return
@@ -262,6 +298,8 @@ class MQTTManager:
             elif '/event' in topic:
                 mqtt_status = payload.get('smartreader-mqtt-status')
                 if mqtt_status == 'connected':
+                    # Any inbound message already marked it online; a (re)start may have reset its mode
+                    forget_reader_configs([serial_number])
                     update_reader_connection_status(reader, True)
                 store_detailed_status_event(reader, payload)
                 
@@ -323,45 +361,163 @@ class MQTTManager:
             )
             raise
 
+    def publish_async(self, topic, message, callback=None):
+        """
+        Publish without waiting for the broker. Returns a Future that
+        resolves to True once the broker acknowledged the message (PUBACK
+        for QoS 1, handed to the socket for QoS 0) and False on failure.
+        `callback`, if given, is called with that future when it resolves,
+        usually on the paho network thread, so it must not block or call
+        back into the client.
+
+        At most MQTT_MAX_INFLIGHT messages are unacknowledged at a time;
+        further calls block until the window has room.
+        """
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        self._count('publish_attempts')
+
+        # Serialise once; the size check runs on the exact bytes sent
+        if isinstance(message, (bytes, bytearray)):
+            payload = bytes(message)
+        elif isinstance(message, str):
+            payload = message.encode('utf-8')
+        else:
+            payload = json.dumps(message).encode('utf-8')
+        if len(payload) > int(getattr(settings, 'MQTT_MAX_MESSAGE_SIZE', 10000)):
+            self.logger.error(f"Message size exceeds maximum allowed")
+            future.set_result(False)
+            return future
+
+        if not self._verify_connection():
+            future.set_result(False)
+            return future
+
+        if not self._inflight_window.acquire(blocking=False):
+            # Window full: first reclaim the slots of messages that will never be acknowledged
+            self._expire_inflight()
+            if not self._inflight_window.acquire(timeout=self.publish_timeout):
+                self.logger.error(f"Publish window full for {self.publish_timeout}s, dropping message to {topic}")
+                future.set_result(False)
+                return future
+
+        try:
+            result = self.client.publish(
+                topic,
+                payload,
+                qos=int(getattr(settings, 'MQTT_QOS', 1)),
+                retain=getattr(settings, 'MQTT_RETAIN', False)
+            )
+        except Exception as e:
+            self.logger.error(f"Error publishing message: {str(e)}")
+            self._inflight_window.release()
+            future.set_result(False)
+            return future
+
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.logger.error(f"Failed to publish message. Result code: {result.rc}")
+            if result.rc == mqtt.MQTT_ERR_NO_CONN:
+                self.breaker.record_failure()
+            self._inflight_window.release()
+            future.set_result(False)
+            return future
+
+        with self._inflight_lock:
+            self._expired.discard(result.mid)
+            # paho may already have reported this mid (QoS 0, or a very fast
+            # PUBACK) before publish() returned
+            acknowledged = result.mid in self._early_acks
+            if acknowledged:
+                self._early_acks.discard(result.mid)
+                replaced = None
+            else:
+                # mids wrap around at 65535: an entry still under this one was never acknowledged
+                replaced = self._inflight.get(result.mid)
+                self._inflight[result.mid] = (future, topic, time.monotonic() + self.publish_timeout)
+        if replaced is not None:
+            self.logger.error(f"Message to {replaced[1]} was never acknowledged before its mid was reused")
+            self._fail(replaced[0])
+        if acknowledged:
+            self._acknowledge(future, topic)
+        return future
+
     def publish(self, topic, message):
-        with self._publish_lock:
-            self.publish_attempts += 1
-            
-            if not self._verify_connection():
-                return False
+        """Blocking publish, kept for existing callers"""
+        future = self.publish_async(topic, message)
+        try:
+            return future.result(timeout=self.publish_timeout)
+        except FutureTimeoutError:
+            self.logger.error(f"Timed out waiting for broker acknowledgement on {topic}")
+            self._expire_inflight()
+            return False
 
+    def publish_many(self, messages):
+        """
+        Publish (topic, message) pairs back to back, keeping the in-flight
+        window full, and return one bool per message in order.
+        """
+        futures = [self.publish_async(topic, message) for topic, message in messages]
+        results = []
+        for future in futures:
             try:
-                json_message = json.dumps(message)
-                if len(json_message) > getattr(settings, 'MQTT_MAX_MESSAGE_SIZE', 10000):
-                    self.logger.error(f"Message size exceeds maximum allowed")
-                    return False
-                
-                result = self.client.publish(
-                    topic,
-                    json_message,
-                    qos=getattr(settings, 'MQTT_QOS', 1),
-                    retain=getattr(settings, 'MQTT_RETAIN', False)
-                )
-                
-                result.wait_for_publish(timeout=10.0)
-                
-                if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                    self.successful_publishes += 1
-                    self.logger.info(f"Successfully published message to {topic}")
-                    return True
+                results.append(future.result(timeout=self.publish_timeout))
+            except FutureTimeoutError:
+                results.append(False)
+        if not all(results):
+            self._expire_inflight()
+        return results
+
+    def on_publish(self, client, userdata, mid):
+        # Called by paho with its own locks held: never call back into the
+        # client from here
+        with self._inflight_lock:
+            entry = self._inflight.pop(mid, None)
+            if entry is None:
+                if mid in self._expired:
+                    self._expired.discard(mid)
                 else:
-                    self.logger.error(f"Failed to publish message. Result code: {result.rc}")
-                    return False
-                    
-            except Exception as e:
-                self.logger.error(f"Error publishing message: {str(e)}")
-                return False
+                    self._early_acks.add(mid)
+                return
+        future, topic, _deadline = entry
+        self._acknowledge(future, topic)
+
+    def _acknowledge(self, future, topic):
+        self._inflight_window.release()
+        self._count('successful_publishes')
+        self.logger.info(f"Successfully published message to {topic}")
+        if not future.done():
+            future.set_result(True)
+
+    def _fail(self, future):
+        self._inflight_window.release()
+        if not future.done():
+            future.set_result(False)
+
+    def _expire_inflight(self):
+        """Fail messages unacknowledged past MQTT_PUBLISH_TIMEOUT and give their window slots back"""
+        now = time.monotonic()
+        with self._inflight_lock:
+            expired = [mid for mid, (_future, _topic, deadline) in self._inflight.items() if deadline <= now]
+            entries = [self._inflight.pop(mid) for mid in expired]
+            self._expired.update(expired)
+        for future, topic, _deadline in entries:
+            self.logger.error(f"No acknowledgement for message to {topic} within {self.publish_timeout}s")
+            self._fail(future)
+
+    def _count(self, counter):
+        with self._inflight_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
 
     def _verify_connection(self):
-        if not self.client.is_connected():
-            self.logger.warning("Client disconnected. Attempting reconnection...")
-            return self.connect()
-        return True
+        """Never connects on the caller's thread: publishes fail fast while the broker is away"""
+        if self.client.is_connected():
+            return True
+        if self.breaker.allow():
+            self.logger.warning("Client disconnected. Reconnecting in the background")
+            self.breaker.record_failure()
+            self._reconnect_in_background()
+        return False
 
     def get_diagnostics(self):
         return {
@@ -371,6 +527,11 @@ class MQTTManager:
             "reconnect_count": self.reconnect_count,
             "publish_attempts": self.publish_attempts,
             "successful_publishes": self.successful_publishes,
+            "inflight_messages": len(self._inflight),
+            "max_inflight": self.max_inflight,
+            "command_throttle": get_throttle_stats(),
+            "ingest": self.ingest.snapshot(),
+            "circuit_breakers": get_breaker_states(),
             "client_id": self.client._client_id.decode() if self.client._client_id else None,
             "broker": getattr(settings, 'MQTT_BROKER', 'unknown'),
             "port": getattr(settings, 'MQTT_PORT', 'unknown'),
@@ -3,6 +3,7 @@ from datetime import datetime
 from django.utils import timezone
 from app.models import Reader, TagEvent, DetailedStatusEvent
 from app.services import update_reader_connection_status, update_reader_last_communication
+from app.reader_config import forget_reader_configs
 from dapr_integration.dapr_publisher import DaprMQTTPublisher
 
 logger = logging.getLogger(__name__)
@@ -43,7 +44,7 @@ def process_mqtt_message(topic: str, payload: dict) -> bool:
     """Process an MQTT message and store it in the database"""
     try:
         serial_number = topic.split('/')[1]
-        reader = update_reader_last_communication(serial_number)
+        reader = update_reader_last_communication(serial_number, mark_connected='/lwt' not in topic)
         if reader is None:
             logger.warning(f"No reader found for serial number: {serial_number}")
             return False
@@ -63,6 +64,8 @@ def process_mqtt_message(topic: str, payload: dict) -> bool:
         elif '/event' in topic:
             mqtt_status = payload.get('smartreader-mqtt-status')
             if mqtt_status == 'connected':
+                # Any inbound message already marked it online; a (re)start may have reset its mode
+                forget_reader_configs([reader.serial_number])
                 update_reader_connection_status(reader, True)
             store_detailed_status_event(reader, payload)
             return True